@@ -0,0 +1,538 @@
+#!/usr/bin/env python
+"""Benchmarks the GreenPiThumb ingest pipeline end to end.
+
+Polls synthetic sensors through the same poll workers, record queue, record
+processor and database stores as the daemon. The offered load starts at
+--min_pots pots and doubles on each step until the pipeline saturates, that
+is until it misses poll deadlines, drops records, or lets the record queue
+back up by more than two rounds of polls. The saturation point is the most
+pots, and the highest record rate, that the pipeline sustained at the poll
+interval. For each step, the benchmark reports:
+
+* records committed per second
+* p50 and p99 time from a record's scheduled poll to its commit
+* CPU time per record
+* database growth per record, in bytes of pages in use
+* peak and growth of resident memory
+* poll deadlines missed, records dropped and the deepest the record queue got
+
+Results are compared with a saved baseline so that regressions show up. The
+baseline is only meaningful on the machine that recorded it.
+
+Run from the repository root:
+
+    python -m benchmark.ingest_benchmark
+    python -m benchmark.ingest_benchmark --save_baseline
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import pytz
+
+from greenpithumb import bounded_queue
+from greenpithumb import clock
+from greenpithumb import db_store
+from greenpithumb import mqtt_client
+from greenpithumb import poll_stats
+from greenpithumb import poller
+from greenpithumb import record_processor
+
+_DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'ingest_baseline.json')
+
+# Number of sensors polled for each pot.
+_SENSORS_PER_POT = 4
+
+# Number of rounds of polls that may wait in the record queue at once before
+# the queue counts as backed up.
+_MAX_QUEUED_ROUNDS = 2
+
+# Key of the results that summarize the saturation point.
+_SATURATION_KEY = 'saturation'
+
+# For each metric compared with the baseline, whether a larger value is
+# better.
+_COMPARED_METRICS = {
+    'sustained_records_per_second': True,
+    'latency_p99': False,
+    'cpu_us_per_record': False,
+    'db_bytes_per_record': False,
+}
+
+
+class _SyntheticSensor(object):
+    """Sensor that returns random readings after an optional delay."""
+
+    def __init__(self, rng, read_latency):
+        self._rng = rng
+        self._read_latency = read_latency
+
+    def _read(self, low, high):
+        if self._read_latency:
+            time.sleep(self._read_latency)
+        return self._rng.uniform(low, high)
+
+    def temperature(self):
+        return self._read(15.0, 30.0)
+
+    def humidity(self):
+        return self._read(30.0, 80.0)
+
+    def light(self):
+        return self._read(0.0, 100.0)
+
+    def water_level(self):
+        return self._read(0.0, 25.0)
+
+
+class _TrackingRecordQueue(bounded_queue.RecordQueue):
+    """Record queue that remembers the records taken from it."""
+
+    def __init__(self, *args, **kwargs):
+        bounded_queue.RecordQueue.__init__(self, *args, **kwargs)
+        self._taken = []
+
+    def _get(self):
+        item = bounded_queue.RecordQueue._get(self)
+        if item is not record_processor.SHUTDOWN:
+            self._taken.append(item)
+        return item
+
+    def pop_taken(self):
+        """Returns the records taken since the last call."""
+        with self.mutex:
+            taken, self._taken = self._taken, []
+        return taken
+
+
+class _CommitTimingConnection(object):
+    """Database connection that reports each commit."""
+
+    def __init__(self, connection, on_commit):
+        self._connection = connection
+        self._on_commit = on_commit
+
+    def commit(self):
+        self._connection.commit()
+        self._on_commit()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def _db_bytes_used(connection, db_path):
+    """Returns the number of bytes a database uses to store its contents.
+
+    Checkpoints the write-ahead log, if any, into the database file. Where
+    SQLite has the dbstat table, counts the bytes in use on each page, since a
+    page holds many rows and the file only grows a page at a time. Otherwise,
+    vacuums the database and returns the size of its file.
+
+    Args:
+        connection: Connection to the database, with no open transaction.
+        db_path: Path to the database file.
+
+    Returns:
+        The number of bytes in use.
+    """
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    try:
+        return connection.execute(
+            'SELECT SUM(pgsize - unused) FROM dbstat').fetchone()[0]
+    except sqlite3.OperationalError:
+        connection.execute('VACUUM')
+        return os.path.getsize(db_path)
+
+
+def _rss_bytes():
+    """Returns the current resident memory of the process, or None."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return None
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def saturated(metrics, pots):
+    """Returns whether a step of the benchmark saturated the pipeline.
+
+    Args:
+        metrics: A dict of the step's metrics, as returned by run_scenario.
+        pots: Number of pots polled in the step.
+    """
+    return (metrics['missed_deadlines'] > 0 or metrics['dropped_records'] > 0 or
+            metrics['max_queue_depth'] >
+            _MAX_QUEUED_ROUNDS * pots * _SENSORS_PER_POT)
+
+
+def run_scenario(pots, poll_interval, duration, read_latency, db_dir,
+                 batch_size, batch_max_age, wal, overflow_policy):
+    """Runs the pipeline for a while and measures it.
+
+    Args:
+        pots: Number of pots, each with a temperature, humidity, light and
+            water level sensor.
+        poll_interval: Number of whole seconds between polls of each sensor.
+        duration: Number of seconds to poll for.
+        read_latency: Number of seconds each synthetic sensor read takes.
+        db_dir: Directory in which to create the database.
+        batch_size: Number of pending records at which to commit a batch.
+        batch_max_age: Maximum time (as a timedelta) a record waits before its
+            batch is committed.
+        wal: Whether to use write-ahead logging for the database.
+        overflow_policy: What the record queue does when it is full, one of
+            bounded_queue.OVERFLOW_POLICIES.
+
+    Returns:
+        A dict of the run's metrics.
+    """
+    db_path = os.path.join(db_dir, 'pots%d_interval%d.db' % (pots,
+                                                             poll_interval))
+    record_queue = _TrackingRecordQueue(overflow_policy=overflow_policy)
+    latencies = []
+
+    def record_commit():
+        commit_time = datetime.datetime.now(tz=pytz.utc)
+        for record in record_queue.pop_taken():
+            latencies.append((commit_time - db_store.unwrap_record(record)
+                              .timestamp).total_seconds())
+
+    with contextlib.closing(
+            db_store.open_or_create_db(db_path, wal=wal)) as connection:
+        initial_db_size = _db_bytes_used(connection, db_path)
+        timed_connection = _CommitTimingConnection(connection, record_commit)
+        processor = record_processor.RecordProcessor(
+            record_queue,
+            db_store.SoilMoistureStore(timed_connection),
+            db_store.LightStore(timed_connection),
+            db_store.HumidityStore(timed_connection),
+            db_store.TemperatureStore(timed_connection),
+            db_store.WaterLevelStore(timed_connection),
+            db_store.WateringEventStore(timed_connection),
+            rollup_store=db_store.RollupStore(timed_connection),
+            batch_size=batch_size,
+            batch_max_age=batch_max_age)
+
+        utc_clock = clock.Clock()
+        engine = poller.PollEngine(utc_clock)
+        stats_registry = poll_stats.PollStats()
+        interval = datetime.timedelta(seconds=poll_interval)
+
+        def make_scheduler():
+            return poller.Scheduler(utc_clock, interval)
+
+        factory = poller.SensorPollerFactory(
+            make_scheduler,
+            record_queue,
+            mqtt_client.NullMqttClient(),
+            poll_engine=engine,
+            stats_registry=stats_registry)
+        rng = random.Random(0)
+        pollers = []
+        for _ in range(pots):
+            sensor = _SyntheticSensor(rng, read_latency)
+            pollers.extend([
+                factory.create_temperature_poller(sensor),
+                factory.create_humidity_poller(sensor),
+                factory.create_light_poller(sensor),
+                factory.create_water_level_poller(sensor),
+            ])
+
+        def stop():
+            for current_poller in pollers:
+                current_poller.close()
+            engine.stop()
+            processor.shutdown()
+
+        initial_rss = _rss_bytes()
+        initial_cpu = _cpu_seconds()
+        start_time = time.time()
+        for current_poller in pollers:
+            current_poller.start_polling_async()
+        stop_timer = threading.Timer(duration, stop)
+        stop_timer.start()
+        processor.run()
+        elapsed = time.time() - start_time
+        cpu = _cpu_seconds() - initial_cpu
+        final_rss = _rss_bytes()
+        stop_timer.join()
+        db_growth = _db_bytes_used(connection, db_path) - initial_db_size
+
+    records = len(latencies)
+    latencies.sort()
+    worker_stats = stats_registry.snapshot().values()
+    queue_stats = record_queue.stats()
+    cpu_us_per_record = None
+    db_bytes_per_record = None
+    if records:
+        cpu_us_per_record = 1e6 * cpu / records
+        db_bytes_per_record = float(db_growth) / records
+    rss_growth_mb = None
+    if initial_rss is not None:
+        rss_growth_mb = (final_rss - initial_rss) / (1024.0 * 1024.0)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    offered_rate = float(pots * _SENSORS_PER_POT) / poll_interval
+    missed_deadlines = sum(stats['missed_deadlines'] for stats in worker_stats)
+    return {
+        'records': records,
+        'offered_records_per_second': offered_rate,
+        'records_per_second': records / elapsed,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p99': _percentile(latencies, 99),
+        'cpu_us_per_record': cpu_us_per_record,
+        'db_bytes_per_record': db_bytes_per_record,
+        'peak_rss_mb': peak_rss_kb / 1024.0,
+        'rss_growth_mb': rss_growth_mb,
+        'missed_deadlines': missed_deadlines,
+        'dropped_records': queue_stats['dropped'],
+        'max_queue_depth': queue_stats['max_depth'],
+    }
+
+
+def _scenario_key(pots, poll_interval):
+    return 'pots=%d,interval=%ds' % (pots, poll_interval)
+
+
+def find_saturation(run_step, min_pots, max_pots):
+    """Doubles the number of pots until the pipeline saturates.
+
+    Args:
+        run_step: Function called with a number of pots that runs the pipeline
+            with that many pots and returns the step's metrics.
+        min_pots: Number of pots in the first step.
+        max_pots: Largest number of pots to try.
+
+    Returns:
+        A tuple of a dict mapping the number of pots in each step to its
+        metrics, including whether it saturated the pipeline, and a dict
+        summarizing the saturation point.
+    """
+    steps = {}
+    sustained_pots = None
+    saturated_pots = None
+    pots = min_pots
+    while pots <= max_pots:
+        steps[pots] = run_step(pots)
+        steps[pots]['saturated'] = saturated(steps[pots], pots)
+        if steps[pots]['saturated']:
+            saturated_pots = pots
+            break
+        sustained_pots = pots
+        pots *= 2
+    sustained_rate = None
+    if sustained_pots:
+        sustained_rate = steps[sustained_pots]['records_per_second']
+    summary = {
+        'sustained_pots': sustained_pots,
+        'sustained_records_per_second': sustained_rate,
+        'saturated_pots': saturated_pots,
+    }
+    return steps, summary
+
+
+def compare(results, baseline, tolerance):
+    """Finds metrics that regressed from the baseline.
+
+    Args:
+        results: A dict mapping scenario keys to metric dicts.
+        baseline: A dict mapping scenario keys to baseline metric dicts.
+        tolerance: Fraction by which a metric may be worse than the baseline.
+
+    Returns:
+        A list of strings describing each regression.
+    """
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        baseline_metrics = baseline.get(key)
+        # A saturated pipeline falls behind by a different amount on each
+        # run, so only the steps it sustained are comparable.
+        if (not baseline_metrics or metrics.get('saturated') or
+                baseline_metrics.get('saturated')):
+            continue
+        for metric, higher_is_better in sorted(_COMPARED_METRICS.items()):
+            value = metrics.get(metric)
+            baseline_value = baseline_metrics.get(metric)
+            if not baseline_value:
+                continue
+            if value is None:
+                # The pipeline saturated before reaching a sustained rate.
+                value = 0.0
+            change = (value - baseline_value) / float(baseline_value)
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append('%s: %s %.4g vs. baseline %.4g (%+.0f%%)' %
+                                   (key, metric, value, baseline_value,
+                                    100.0 * change))
+    return regressions
+
+
+def _print_results(results):
+    print('%-22s %9s %9s %9s %9s %9s %9s %8s %8s %6s %6s %6s' %
+          ('scenario', 'records', 'offered/s', 'rec/s', 'p50 s', 'p99 s',
+           'cpu us/r', 'db B/r', 'rss MB', 'missed', 'drops', 'queue'))
+    steps = [(key, metrics) for key, metrics in results.items()
+             if key != _SATURATION_KEY]
+    # List the steps in the order they ran, from the lightest load up.
+    steps.sort(key=lambda step: step[1]['offered_records_per_second'])
+    for key, metrics in steps:
+        print(
+            '%-22s %9d %9.1f %9.1f %9.3f %9.3f %9.1f %8.1f %8.1f %6d %6d %6d' %
+            (key, metrics['records'], metrics['offered_records_per_second'],
+             metrics['records_per_second'], metrics['latency_p50'],
+             metrics['latency_p99'], metrics['cpu_us_per_record'] or 0.0,
+             metrics['db_bytes_per_record'] or 0.0, metrics['peak_rss_mb'],
+             metrics['missed_deadlines'], metrics['dropped_records'],
+             metrics['max_queue_depth']))
+    summary = results[_SATURATION_KEY]
+    if summary['sustained_pots'] is None:
+        print(
+            'saturated at the first step, %d pots' % summary['saturated_pots'])
+    elif summary['saturated_pots'] is None:
+        print('sustained %d pots (%.1f records/s) without saturating' %
+              (summary['sustained_pots'],
+               summary['sustained_records_per_second']))
+    else:
+        print('sustained %d pots (%.1f records/s), saturated at %d pots' %
+              (summary['sustained_pots'],
+               summary['sustained_records_per_second'],
+               summary['saturated_pots']))
+
+
+def main(args):
+    db_dir = tempfile.mkdtemp()
+
+    def run_step(pots):
+        sys.stderr.write('running %s for %.0f s\n' %
+                         (_scenario_key(pots, args.poll_interval),
+                          args.duration))
+        return run_scenario(
+            pots,
+            args.poll_interval,
+            args.duration,
+            args.read_latency,
+            db_dir,
+            args.db_batch_size,
+            datetime.timedelta(seconds=args.db_batch_seconds),
+            args.db_wal,
+            args.record_queue_overflow)
+
+    try:
+        steps, summary = find_saturation(run_step, args.min_pots, args.max_pots)
+    finally:
+        shutil.rmtree(db_dir)
+    results = dict((_scenario_key(pots, args.poll_interval), metrics)
+                   for pots, metrics in steps.items())
+    results[_SATURATION_KEY] = summary
+    _print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(
+                results,
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+                separators=(',', ': '))
+            baseline_file.write('\n')
+        print('saved baseline to %s' % args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline at %s' % args.baseline)
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+    if regressions:
+        return 1
+    print('no regressions against %s' % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='GreenPiThumb Ingest Benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--min_pots',
+        type=int,
+        help=('Number of pots in the first step, each with a temperature, '
+              'humidity, light and water level sensor'),
+        default=1)
+    parser.add_argument(
+        '--max_pots',
+        type=int,
+        help='Largest number of pots to try if the pipeline never saturates',
+        default=4096)
+    parser.add_argument(
+        '--poll_interval',
+        type=int,
+        help='Number of seconds between polls of each sensor',
+        default=1)
+    parser.add_argument(
+        '--duration',
+        type=float,
+        help='Number of seconds to run each step',
+        default=10.0)
+    parser.add_argument(
+        '--read_latency',
+        type=float,
+        help='Number of seconds each synthetic sensor read takes',
+        default=0.0)
+    parser.add_argument(
+        '--db_batch_size',
+        type=int,
+        help='Number of records at which to commit a database batch',
+        default=record_processor.DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        '--db_batch_seconds',
+        type=float,
+        help=('Maximum number of seconds a record waits before its batch is '
+              'committed to the database'),
+        default=record_processor.DEFAULT_BATCH_MAX_AGE.total_seconds())
+    parser.add_argument(
+        '--db_wal',
+        action='store_true',
+        help='Use write-ahead logging for the database')
+    parser.add_argument(
+        '--record_queue_overflow',
+        choices=bounded_queue.OVERFLOW_POLICIES,
+        help='What to do with new records when the record queue is full',
+        default=bounded_queue.BLOCK)
+    parser.add_argument(
+        '--baseline', help='Baseline results file', default=_DEFAULT_BASELINE)
+    parser.add_argument(
+        '--save_baseline',
+        action='store_true',
+        help='Save the results as the new baseline instead of comparing')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        help='Fraction by which a metric may be worse than the baseline',
+        default=0.25)
+    sys.exit(main(parser.parse_args()))
@@ -1,27 +1,68 @@
 import threading
 
+# Ways to combine several samples of an ADC channel into one reading.
+MEDIAN = 'median'
+MEAN = 'mean'
+REDUCTIONS = (MEDIAN, MEAN)
+
+
+def _median(samples):
+    ordered = sorted(samples)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return float(ordered[middle])
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def _mean(samples):
+    return float(sum(samples)) / len(samples)
+
+
+_REDUCTION_FUNCS = {MEDIAN: _median, MEAN: _mean}
+
 
 class Adc(object):
     """Thread-safe wrapper around an ADC object."""
 
-    def __init__(self, adc):
+    def __init__(self, adc, samples=1, reduction=MEDIAN):
         """Create a new Adc instance
 
         Args:
             adc: The raw ADC which this class makes thread-safe by synchronizing
                 its read calls.
+            samples: Default number of samples to take of each channel read.
+            reduction: Default way to combine samples, one of REDUCTIONS.
+
+        Raises:
+            ValueError if samples or reduction is invalid.
         """
+        if samples < 1:
+            raise ValueError(
+                'Number of ADC samples must be positive: %d' % samples)
+        if reduction not in REDUCTIONS:
+            raise ValueError('Unknown ADC sample reduction: %s' % reduction)
         self._adc = adc
+        self._samples = samples
+        self._reduction = reduction
         self._lock = threading.Lock()
 
     def read_adc(self, adc_number):
         """Read a value from the ADC
 
+        Takes the default number of samples of the channel while holding the
+        ADC, and combines them with the default reduction.
+
         Args:
             adc_number: ADC channel to read.
 
         Returns:
-            The value read from the given ADC channel (as a float).
+            The value read from the given ADC channel. A single sample is
+            returned as read, several are combined into a float.
         """
         with self._lock:
-            return self._adc.read_adc(adc_number)
+            samples = [
+                self._adc.read_adc(adc_number) for _ in range(self._samples)
+            ]
+        if len(samples) == 1:
+            return samples[0]
+        return _REDUCTION_FUNCS[self._reduction](samples)
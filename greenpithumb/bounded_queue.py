@@ -0,0 +1,158 @@
+import Queue
+import threading
+import time
+
+import db_store
+
+# Policies for a put into a full RecordQueue.
+#
+# Wait for the consumer to make room.
+BLOCK = 'block'
+# Discard the oldest sensor reading in the queue.
+DROP_OLDEST = 'drop_oldest'
+# Merge the two oldest readings from the same sensor into a CoalescedRecord.
+COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+# Number of records the queue holds before applying its overflow policy.
+DEFAULT_MAX_RECORDS = 10000
+
+
+class RecordQueue(Queue.Queue):
+    """Bounded queue of database records with a configurable overflow policy.
+
+    When the queue is full, a put either waits for room (BLOCK) or makes room
+    by discarding (DROP_OLDEST) or merging (COALESCE) queued sensor readings.
+    Records that are not sensor readings, such as watering events, are never
+    discarded or merged. If a put cannot make room that way, it waits just as
+    under BLOCK.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAX_RECORDS, overflow_policy=BLOCK):
+        """Creates a new RecordQueue instance.
+
+        Args:
+            maxsize: Number of records at which the queue is full.
+            overflow_policy: One of OVERFLOW_POLICIES.
+
+        Raises:
+            ValueError if maxsize or overflow_policy is invalid.
+        """
+        if maxsize <= 0:
+            raise ValueError('Record queue size must be positive: %d' % maxsize)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % overflow_policy)
+        Queue.Queue.__init__(self, maxsize)
+        self._overflow_policy = overflow_policy
+        self._stats_lock = threading.Lock()
+        self._dropped = 0
+        self._coalesced = 0
+        self._blocked_puts = 0
+        self._max_depth = 0
+
+    def _drop_oldest_reading(self):
+        """Discards the oldest queued sensor reading. Caller must hold mutex.
+
+        Returns:
+            True if a reading was discarded.
+        """
+        for index, record in enumerate(self.queue):
+            if db_store.sensor_name(record) is not None:
+                del self.queue[index]
+                self._dropped += 1
+                return True
+        return False
+
+    def _coalesce_oldest_readings(self, new_record):
+        """Merges the two oldest queued readings from one sensor.
+
+        Prefers readings from the same sensor as the record being added.
+        Caller must hold mutex.
+
+        Returns:
+            True if two readings were merged.
+        """
+        new_sensor = db_store.sensor_name(new_record)
+        first_index_by_sensor = {}
+        pair = None
+        for index, record in enumerate(self.queue):
+            sensor = db_store.sensor_name(record)
+            if sensor is None or getattr(
+                    db_store.unwrap_record(record), sensor) is None:
+                continue
+            if sensor not in first_index_by_sensor:
+                first_index_by_sensor[sensor] = index
+                continue
+            if pair is None:
+                pair = (first_index_by_sensor[sensor], index)
+            if sensor == new_sensor:
+                pair = (first_index_by_sensor[sensor], index)
+                break
+        if pair is None:
+            return False
+        first_index, second_index = pair
+        self.queue[first_index] = db_store.coalesce(self.queue[first_index],
+                                                    self.queue[second_index])
+        del self.queue[second_index]
+        self._coalesced += 1
+        return True
+
+    def _make_room(self, record):
+        """Applies the overflow policy to a full queue. Caller must hold mutex.
+
+        Returns:
+            True if the policy freed a slot.
+        """
+        with self._stats_lock:
+            if self._overflow_policy == DROP_OLDEST:
+                return self._drop_oldest_reading()
+            elif self._overflow_policy == COALESCE:
+                return self._coalesce_oldest_readings(record)
+            return False
+
+    def put(self, item, block=True, timeout=None):
+        """Puts a record into the queue, applying the overflow policy if full.
+
+        Args:
+            item: The record to add.
+            block: Whether to wait for room if the overflow policy cannot make
+                any.
+            timeout: If not None, the maximum number of seconds to wait.
+
+        Raises:
+            Queue.Full if the queue has no room and the wait ran out.
+        """
+        with self.not_full:
+            if self._qsize() >= self.maxsize and not self._make_room(item):
+                with self._stats_lock:
+                    self._blocked_puts += 1
+                if not block:
+                    raise Queue.Full
+                if timeout is None:
+                    while self._qsize() >= self.maxsize:
+                        self.not_full.wait()
+                else:
+                    end_time = time.time() + timeout
+                    while self._qsize() >= self.maxsize:
+                        remaining = end_time - time.time()
+                        if remaining <= 0.0:
+                            raise Queue.Full
+                        self.not_full.wait(remaining)
+            self._put(item)
+            self.unfinished_tasks += 1
+            with self._stats_lock:
+                self._max_depth = max(self._max_depth, self._qsize())
+            self.not_empty.notify()
+
+    def stats(self):
+        """Returns a dict of the queue's depth and overflow counters."""
+        depth = self.qsize()
+        with self._stats_lock:
+            return {
+                'depth': depth,
+                'max_depth': self._max_depth,
+                'capacity': self.maxsize,
+                'dropped': self._dropped,
+                'coalesced': self._coalesced,
+                'blocked_puts': self._blocked_puts,
+            }
@@ -1,8 +1,9 @@
 import logging
 import os
-import picamera
 import glob
 
+import reading_cache
+
 logger = logging.getLogger(__name__)
 
 # Format of filename to write for camera image file (assumes timestamp is in
@@ -19,21 +20,26 @@ TIMELAPSE_NUM_IMAGES = 48
 class CameraManager(object):
     """Captures and saves photos to the filesystem."""
 
-    def __init__(self, image_path, clock, light_sensor):
+    def __init__(self, image_path, clock, camera, light_sensor,
+                 latest_readings=None):
         """Creates a new camera manager instance.
 
         Args:
             image_path: Path name of the folder where images will be stored.
             clock: Clock interface.
+            camera: Camera interface, such as a picamera.PiCamera.
             light_sensor: An interface for reading the light level.
+            latest_readings: If not None, a ReadingCache whose recent light
+                readings are used instead of reading the light sensor.
         """
         if not os.path.exists(image_path):
             os.makedirs(image_path)
         self._image_path = image_path        
         self._clock = clock
-        self._camera = picamera.PiCamera(resolution=picamera.PiCamera.MAX_RESOLUTION)
+        self._camera = camera
         self._camera.rotation = CAMERA_ROTATION
         self._light_sensor = light_sensor
+        self._latest_readings = latest_readings
 
     def sufficient_light(self):
         """Checks if there is sufficient light to capture a photo.
@@ -41,7 +47,12 @@ class CameraManager(object):
         Returns:
             A boolean indicating whether or not there is sufficient light.
         """
-        if self._light_sensor.light() >= LIGHT_THRESHOLD_PCT:
+        light = None
+        if self._latest_readings:
+            light = self._latest_readings.fresh_value(reading_cache.LIGHT)
+        if light is None:
+            light = self._light_sensor.light()
+        if light >= LIGHT_THRESHOLD_PCT:
             return True
         return False
 
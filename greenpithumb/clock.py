@@ -1,9 +1,116 @@
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import fcntl
+import os
+import select
+import threading
 import time
 
 import pytz
 import tzlocal
 
+# Value of CLOCK_MONOTONIC in Linux's <time.h>.
+_CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _make_monotonic_func():
+    """Returns a function that reads a monotonic clock, in seconds.
+
+    Python 2 has no time.monotonic(), so on Linux this reads CLOCK_MONOTONIC
+    directly. Platforms without clock_gettime fall back to wall-clock time.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        clock_gettime = ctypes.CDLL(
+            ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+            use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic():
+        timespec = _Timespec()
+        if clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+            return time.time()
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    return monotonic
+
+
+# Returns the seconds elapsed on a clock that never jumps, such as when NTP
+# corrects the wall clock after the Pi boots.
+monotonic = _make_monotonic_func()
+
+
+class WakeupEvent(object):
+    """A flag that threads can set to wake a thread waiting on it.
+
+    Has the interface of a threading.Event, but a timed wait blocks in select()
+    on a pipe that set() writes to. On Python 2, a timed wait on a
+    threading.Event instead polls the flag up to every 50 ms, which keeps an
+    otherwise idle Pi busy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flag = False
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def is_set(self):
+        return self._flag
+
+    def set(self):
+        """Sets the flag and wakes any thread waiting for it."""
+        with self._lock:
+            if self._flag:
+                return
+            self._flag = True
+            os.write(self._write_fd, b'x')
+
+    def clear(self):
+        """Resets the flag, so that later waits block until it is set again."""
+        with self._lock:
+            self._flag = False
+            try:
+                while os.read(self._read_fd, 512):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def wait(self, timeout=None):
+        """Blocks until the flag is set or a timeout passes.
+
+        Args:
+            timeout: Maximum number of seconds to wait, or None to wait until
+                the flag is set.
+
+        Returns:
+            True if the flag is set.
+        """
+        if not self._flag:
+            try:
+                select.select([self._read_fd], [], [], timeout)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        return self._flag
+
+    def close(self):
+        """Releases the event's pipe. The event cannot be used afterwards."""
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
 
 class Clock(object):
     """A wrapper for managing clock time functions."""
@@ -19,6 +126,34 @@ class Clock(object):
                 'Wait time cannot be negative: %f' % wait_time_seconds)
         time.sleep(wait_time_seconds)
 
+    def wait_until(self, deadline, cancel_event=None):
+        """Waits until a given time or until a cancel event is set.
+
+        The wait is measured on a monotonic clock, so it is exact even if the
+        wall clock is adjusted or the sleep is interrupted early. The thread
+        sleeps until the deadline or the cancel event, without waking up in
+        between.
+
+        Args:
+            deadline: The time to wait until, as a timezone-aware datetime.
+            cancel_event: If not None, a WakeupEvent that ends the wait as soon
+                as it is set.
+
+        Returns:
+            True if the deadline was reached, False if the wait was cancelled.
+        """
+        end_time = monotonic() + (deadline - self.now()).total_seconds()
+        while True:
+            if cancel_event and cancel_event.is_set():
+                return False
+            remaining_seconds = end_time - monotonic()
+            if remaining_seconds <= 0.0:
+                return True
+            if cancel_event:
+                cancel_event.wait(remaining_seconds)
+            else:
+                time.sleep(remaining_seconds)
+
     def now(self):
         return datetime.datetime.now(tz=pytz.utc)
 
@@ -71,3 +206,95 @@ class Timer(object):
     def reset(self):
         """Resets the countdown timer to its starting duration."""
         self._end_time = self._clock.now() + self._duration
+
+
+class VirtualClock(Clock):
+    """A clock whose time moves only when it is advanced or waited on.
+
+    A wait returns immediately after moving the clock forward by the time
+    waited, so code that waits on a VirtualClock runs days of simulated time in
+    moments. The clock suits a single-threaded simulation, in which whatever
+    waits is the only thing happening at the time.
+    """
+
+    def __init__(self, start_time=None):
+        """Creates a new VirtualClock instance.
+
+        Args:
+            start_time: Initial time of the clock, as a timezone-aware
+                datetime. Defaults to the current time.
+        """
+        self._lock = threading.Lock()
+        self._now = (start_time or
+                     datetime.datetime.now(tz=pytz.utc)).astimezone(pytz.utc)
+
+    def now(self):
+        with self._lock:
+            return self._now
+
+    def advance_to(self, when):
+        """Moves the clock forward to a given time.
+
+        Args:
+            when: The new time, as a timezone-aware datetime. A time in the
+                past leaves the clock unchanged, so the clock never runs
+                backwards.
+        """
+        with self._lock:
+            self._now = max(self._now, when.astimezone(pytz.utc))
+
+    def wait(self, wait_time_seconds):
+        """Moves the clock forward by the specified number of seconds.
+
+        Args:
+            wait_time_seconds: Number of seconds to wait.
+        """
+        if wait_time_seconds < 0.0:
+            raise ValueError(
+                'Wait time cannot be negative: %f' % wait_time_seconds)
+        with self._lock:
+            self._now += datetime.timedelta(seconds=wait_time_seconds)
+
+    def wait_until(self, deadline, cancel_event=None):
+        """Moves the clock forward to a given time unless cancelled.
+
+        Args:
+            deadline: The time to wait until, as a timezone-aware datetime.
+            cancel_event: If not None, a WakeupEvent that cancels the wait
+                if it is already set.
+
+        Returns:
+            True if the deadline was reached, False if the wait was cancelled.
+        """
+        if cancel_event and cancel_event.is_set():
+            return False
+        self.advance_to(deadline)
+        return True
+
+    def local_clock(self, timezone=None):
+        """Returns a view of this clock's time in a given time zone.
+
+        Waiting on the view waits on this clock, so the two always agree.
+
+        Args:
+            timezone: A tzinfo for the view's time. Defaults to the local time
+                zone, as used by LocalClock.
+        """
+        return _ZonedClock(self, timezone or tzlocal.get_localzone())
+
+
+class _ZonedClock(Clock):
+    """Reports the time of another clock in a given time zone."""
+
+    def __init__(self, base_clock, timezone):
+        self._base_clock = base_clock
+        self._timezone = timezone
+
+    def wait(self, wait_time_seconds):
+        self._base_clock.wait(wait_time_seconds)
+
+    def wait_until(self, deadline, cancel_event=None):
+        return self._base_clock.wait_until(deadline, cancel_event)
+
+    def now(self):
+        return self._base_clock.now().astimezone(self._timezone)
@@ -1,15 +1,28 @@
+import calendar
 import collections
+import contextlib
 import datetime
 import logging
 import os
+import Queue
 import sqlite3
 
 import pytz
 
 logger = logging.getLogger(__name__)
 
+
+class Error(Exception):
+    pass
+
+
+class UnsupportedSchemaError(Error):
+    pass
+
+
 # For each record, timestamp is a datetime representing the time of the reading
-# or event.
+# or event. Records read with raw_timestamps=True instead hold the timestamp as
+# an int of seconds since the UNIX epoch.
 SoilMoistureRecord = collections.namedtuple('SoilMoistureRecord',
                                             ['timestamp', 'soil_moisture', 'water_present'])
 LightRecord = collections.namedtuple('LightRecord', ['timestamp', 'light'])
@@ -24,55 +37,417 @@ WaterLevelRecord = collections.namedtuple('WaterLevelRecord',
 # water_pumped is the volume of water pumped in mL.
 WateringEventRecord = collections.namedtuple('WateringEventRecord',
                                              ['timestamp', 'water_pumped'])
+# Aggregate of a sensor's readings over one rollup period. period_start is a
+# datetime representing the start of the period and count is the number of
+# readings in it.
+RollupRecord = collections.namedtuple(
+    'RollupRecord', ['period_start', 'count', 'minimum', 'maximum', 'mean'])
+
+# Run of readings from one sensor merged into a single record. record is a
+# reading record holding the mean of the readings, timestamped with the first
+# reading. count, minimum and maximum describe the merged readings, so that
+# rollups still see every one of them.
+CoalescedRecord = collections.namedtuple(
+    'CoalescedRecord', ['record', 'count', 'minimum', 'maximum'])
+
+# Length of each rollup resolution, in seconds.
+ROLLUP_RESOLUTIONS = {'hour': 60 * 60, 'day': 24 * 60 * 60}
+
+# Names of the sensors with rollups, keyed by the record type holding their
+# readings. Each name is also the record field holding the reading's value.
+_ROLLUP_SENSORS = {
+    TemperatureRecord: 'temperature',
+    HumidityRecord: 'humidity',
+    LightRecord: 'light',
+    SoilMoistureRecord: 'soil_moisture',
+    WaterLevelRecord: 'water_level',
+}
 
 # SQL statements to create database tables. Each statement is separated by a
 # semicolon and newline.
 _CREATE_TABLE_COMMANDS = """
 CREATE TABLE temperature
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     temperature REAL    --temperature (in degrees Celsius)
 );
 CREATE TABLE humidity
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     humidity REAL
 );
 CREATE TABLE water_level
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     water_level REAL
 );
 CREATE TABLE soil_moisture
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     soil_moisture REAL,
     water_present INTEGER
 );
 CREATE TABLE light
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     light REAL
 );
 CREATE TABLE watering_events
 (
-    timestamp TEXT,
+    timestamp INTEGER,  --seconds since UNIX epoch (UTC)
     water_pumped REAL   --amount of water pumped (in ml)
 );
 """
 
-# Format to store timestamps to database (assumes timestamp is in UTC) in format
-# of YYYY-MM-DDTHH:MMZ.
-_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%MZ'
+# SQL statement to create the table of running hourly and daily aggregates of
+# each sensor's readings. Rollups are not subject to retention purges.
+_CREATE_ROLLUP_TABLE_COMMAND = """
+CREATE TABLE IF NOT EXISTS rollups
+(
+    sensor TEXT,
+    resolution TEXT,        --'hour' or 'day'
+    period_start INTEGER,   --start of period, in seconds since UNIX epoch (UTC)
+    count INTEGER,
+    total REAL,
+    minimum REAL,
+    maximum REAL,
+    PRIMARY KEY (sensor, resolution, period_start)
+)
+"""
 
-# Delete records older than this value
-DELETE_THRESHOLD = 10   # [days]
+# SQL statements to create an index on the timestamp column of each table, so
+# that time-range queries don't scan the whole table. Each statement is
+# separated by a semicolon and newline.
+_CREATE_INDEX_COMMANDS = """
+CREATE INDEX IF NOT EXISTS temperature_timestamp ON temperature (timestamp);
+CREATE INDEX IF NOT EXISTS humidity_timestamp ON humidity (timestamp);
+CREATE INDEX IF NOT EXISTS water_level_timestamp ON water_level (timestamp);
+CREATE INDEX IF NOT EXISTS soil_moisture_timestamp ON soil_moisture (timestamp);
+CREATE INDEX IF NOT EXISTS light_timestamp ON light (timestamp);
+CREATE INDEX IF NOT EXISTS watering_events_timestamp
+    ON watering_events (timestamp)
+"""
+
+# Format in which older databases stored timestamps as text (assumes timestamp
+# is in UTC), as YYYY-MM-DDTHH:MMZ. Databases in this format are migrated to
+# integer timestamps when opened.
+_LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%MZ'
+
+# Default number of rows iter_records fetches from the database at a time.
+DEFAULT_CHUNK_SIZE = 256
+
+# Page cache size for connections in WAL mode, in KiB. Larger than SQLite's
+# default so that recent pages of every table stay cached between polls.
+WAL_CACHE_SIZE_KB = 4096
+
+# Value of PRAGMA auto_vacuum when the database frees pages incrementally.
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# Default amount of time to keep records in each table before they are purged.
+DEFAULT_RETENTION = {
+    'temperature': datetime.timedelta(days=10),
+    'humidity': datetime.timedelta(days=10),
+    'water_level': datetime.timedelta(days=10),
+    'soil_moisture': datetime.timedelta(days=10),
+    'light': datetime.timedelta(days=10),
+    'watering_events': datetime.timedelta(days=10),
+}
 
 
 def _timestamp_to_utc(timestamp):
     return timestamp.replace(tzinfo=timestamp.tzinfo).astimezone(pytz.utc)
 
 
+def _format_timestamp(timestamp):
+    """Converts a datetime into the timestamp format stored in the database.
+
+    Returns:
+        The timestamp as an int of seconds since the UNIX epoch.
+    """
+    return calendar.timegm(_timestamp_to_utc(timestamp).utctimetuple())
+
+
+def _parse_timestamp(timestamp):
+    """Converts a database timestamp into a UTC datetime."""
+    return datetime.datetime.utcfromtimestamp(timestamp).replace(
+        tzinfo=pytz.utc)
+
+
+def _record_to_row(record):
+    """Converts a record into a row tuple with a database timestamp."""
+    return (_format_timestamp(record.timestamp),) + tuple(record[1:])
+
+
+def sensor_name(record):
+    """Returns the name of the sensor whose reading a record holds.
+
+    Args:
+        record: A record, which may be a CoalescedRecord.
+
+    Returns:
+        The sensor's name, such as 'temperature', or None if the record is not
+        a sensor reading, such as a watering event.
+    """
+    if isinstance(record, CoalescedRecord):
+        record = record.record
+    return _ROLLUP_SENSORS.get(type(record))
+
+
+def unwrap_record(record):
+    """Returns the record to store in a raw table in place of a record."""
+    if isinstance(record, CoalescedRecord):
+        return record.record
+    return record
+
+
+def _as_aggregate(record):
+    """Returns (reading, count, minimum, maximum) for a record."""
+    if isinstance(record, CoalescedRecord):
+        return record
+    value = getattr(record, sensor_name(record))
+    return record, 1, value, value
+
+
+def coalesce(first, second):
+    """Merges two readings from the same sensor into a CoalescedRecord.
+
+    Args:
+        first: The earlier reading, which may be a CoalescedRecord.
+        second: The later reading, which may be a CoalescedRecord.
+
+    Returns:
+        A CoalescedRecord of both readings.
+
+    Raises:
+        ValueError if the records are not readings from the same sensor.
+    """
+    sensor = sensor_name(first)
+    if sensor is None or sensor != sensor_name(second):
+        raise ValueError('Cannot coalesce %s and %s' % (first, second))
+    first_reading, first_count, first_minimum, first_maximum = (
+        _as_aggregate(first))
+    _, second_count, second_minimum, second_maximum = _as_aggregate(second)
+    count = first_count + second_count
+    mean = (getattr(first_reading, sensor) * first_count + getattr(
+        unwrap_record(second), sensor) * second_count) / float(count)
+    return CoalescedRecord(
+        first_reading._replace(**{sensor: mean}), count,
+        min(first_minimum, second_minimum), max(first_maximum, second_maximum))
+
+
+def _time_range_clause(start, end):
+    """Builds a WHERE clause that restricts timestamps to a time range.
+
+    Args:
+        start: A datetime. If not None, only timestamps at or after this time
+            match.
+        end: A datetime. If not None, only timestamps before this time match.
+
+    Returns:
+        A two-tuple of the WHERE clause (an empty string if the range is
+        unbounded, otherwise with a leading space) and its parameters.
+    """
+    conditions = []
+    parameters = []
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        parameters.append(_format_timestamp(start))
+    if end is not None:
+        conditions.append('timestamp < ?')
+        parameters.append(_format_timestamp(end))
+    if not conditions:
+        return '', ()
+    return ' WHERE ' + ' AND '.join(conditions), tuple(parameters)
+
+
+def _select_query(table, start, end, limit, order):
+    """Builds a query for the records in a table within a time range.
+
+    Args:
+        table: Name of the table to query.
+        start: A datetime. If not None, only records with a timestamp at or
+            after this time are selected.
+        end: A datetime. If not None, only records with a timestamp before
+            this time are selected.
+        limit: If not None, the maximum number of records to select.
+        order: 'asc' to select records oldest first or 'desc' to select
+            records newest first.
+
+    Returns:
+        A two-tuple of the SQL query string and its parameters.
+
+    Raises:
+        ValueError if order is not 'asc' or 'desc'.
+    """
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be "asc" or "desc", got: %s' % order)
+    where_clause, parameters = _time_range_clause(start, end)
+    sql = 'SELECT * FROM %s%s ORDER BY timestamp %s' % (table, where_clause,
+                                                         order.upper())
+    parameters = list(parameters)
+    if limit is not None:
+        sql += ' LIMIT ?'
+        parameters.append(limit)
+    return sql, tuple(parameters)
+
+
+def _table_columns(cursor, table):
+    """Returns a list of (name, declared type) pairs for a table's columns."""
+    cursor.execute('PRAGMA table_info(%s)' % table)
+    return [(row[1], row[2].upper()) for row in cursor.fetchall()]
+
+
+def _add_water_present_column(cursor):
+    """Adds the water_present column to soil moisture tables that predate it.
+
+    Args:
+        cursor: Cursor of a connection with an open transaction.
+    """
+    soil_moisture_columns = [
+        name for name, _ in _table_columns(cursor, 'soil_moisture')
+    ]
+    if 'water_present' not in soil_moisture_columns:
+        cursor.execute(
+            'ALTER TABLE soil_moisture ADD COLUMN water_present INTEGER')
+
+
+def _convert_text_timestamps(cursor):
+    """Converts tables that store timestamps as text to integer timestamps.
+
+    Databases created before integer timestamps were introduced store each
+    timestamp as text in _LEGACY_TIMESTAMP_FORMAT. SQLite cannot change a
+    column's type in place, so each such table is rebuilt with the current
+    schema and its rows copied over with their timestamps converted to
+    seconds since the UNIX epoch.
+
+    Args:
+        cursor: Cursor of a connection with an open transaction.
+    """
+    create_table_commands = dict(
+        (sql_command.split()[2], sql_command)
+        for sql_command in _CREATE_TABLE_COMMANDS.split(';\n')
+        if sql_command.strip())
+    legacy_tables = [
+        table for table in sorted(create_table_commands)
+        if ('timestamp', 'TEXT') in _table_columns(cursor, table)
+    ]
+    if legacy_tables:
+        logger.info('converting text timestamps to integers in: %s',
+                    ', '.join(legacy_tables))
+    for table in legacy_tables:
+        legacy_columns = [name for name, _ in _table_columns(cursor, table)]
+        legacy_table = table + '_legacy'
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, legacy_table))
+        cursor.execute(create_table_commands[table])
+        # Copy only the columns the legacy table has, so that rows from
+        # databases that predate a column get NULL for it.
+        value_columns = [
+            name for name, _ in _table_columns(cursor, table)
+            if name != 'timestamp' and name in legacy_columns
+        ]
+        cursor.execute(
+            ('INSERT INTO {table} (timestamp{columns}) '
+             'SELECT CAST(strftime(\'%s\', timestamp) AS INTEGER){columns} '
+             'FROM {legacy_table}').format(
+                 table=table,
+                 legacy_table=legacy_table,
+                 columns=''.join(', ' + name for name in value_columns)))
+        cursor.execute('DROP TABLE %s' % legacy_table)
+
+
+def _create_rollup_table(cursor):
+    """Creates the rollups table if the database does not have one.
+
+    Args:
+        cursor: Cursor of a connection with an open transaction.
+    """
+    cursor.execute(_CREATE_ROLLUP_TABLE_COMMAND)
+
+
+def _create_indexes(cursor):
+    """Creates any timestamp indexes missing from the database.
+
+    Args:
+        cursor: Cursor of a connection with an open transaction.
+    """
+    for sql_command in _CREATE_INDEX_COMMANDS.split(';\n'):
+        cursor.execute(sql_command)
+
+
+# Schema migrations, in order. The migration at index N brings a database from
+# schema version N to N + 1. New migrations must only ever be appended.
+# Databases created before schema versioning existed report version 0 whatever
+# their actual schema, so each migration must be a no-op if its change is
+# already present.
+_MIGRATIONS = [
+    _add_water_present_column,
+    _convert_text_timestamps,
+    _create_rollup_table,
+    _create_indexes,
+]
+
+# Schema version of a fully migrated database, as stored in PRAGMA
+# user_version.
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+def schema_version(connection):
+    """Returns the schema version of a database.
+
+    Args:
+        connection: SQLite database connection.
+
+    Returns:
+        The version as stored in PRAGMA user_version. Databases created before
+        schema versioning existed report version 0.
+    """
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def _migrate(connection):
+    """Brings a database up to the current schema version.
+
+    Runs every migration the database has not yet had, in order, inside a
+    single transaction. If any migration fails, the database is left
+    unchanged.
+
+    Args:
+        connection: SQLite database connection.
+
+    Raises:
+        UnsupportedSchemaError if the database has a newer schema version than
+            this code supports.
+    """
+    version = schema_version(connection)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise UnsupportedSchemaError(
+            'Database schema version %d is newer than supported version %d' %
+            (version, SCHEMA_VERSION))
+
+    # Take manual control of the transaction, as the sqlite3 module otherwise
+    # commits implicitly before each schema change.
+    cursor = connection.cursor()
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        cursor.execute('BEGIN')
+        for from_version in range(version, SCHEMA_VERSION):
+            logger.info('migrating database schema from version %d to %d',
+                        from_version, from_version + 1)
+            _MIGRATIONS[from_version](cursor)
+        cursor.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        cursor.execute('COMMIT')
+    except:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        connection.isolation_level = isolation_level
+
+
 def _open_db(db_path):
     logger.info('opening existing greenpithumb database at "%s"', db_path)
     return sqlite3.connect(db_path)
@@ -93,29 +468,167 @@ def _create_db(db_path):
     """
     logger.info('creating new greenpithumb database at "%s"', db_path)
     sql_commands = _CREATE_TABLE_COMMANDS.split(';\n')
-    connection = _open_db(db_path)
+    connection = sqlite3.connect(db_path)
     cursor = connection.cursor()
+    # Must be set before any tables are created. Lets purge_expired_records
+    # return freed pages to the filesystem without a full VACUUM.
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
     for sql_command in sql_commands:
         cursor.execute(sql_command)
     connection.commit()
+    # The data tables are created with their current schema, so migrations
+    # only add what lives outside them, such as rollups and indexes.
+    _migrate(connection)
     return connection
 
 
-def open_or_create_db(db_path):
+def _enable_wal(connection):
+    """Switches a connection to write-ahead logging with tuned settings.
+
+    In WAL mode, readers do not block the writer and the writer does not block
+    readers. The journal mode is persistent, so it also applies to other
+    processes that open the same database file.
+
+    Args:
+        connection: SQLite database connection.
+    """
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode = WAL')
+    journal_mode = cursor.fetchone()[0]
+    if journal_mode.lower() != 'wal':
+        logger.warning('failed to enable WAL, journal mode is "%s"',
+                       journal_mode)
+        return
+    # In WAL mode, NORMAL is safe from corruption and only syncs at
+    # checkpoints rather than on every commit.
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    # A negative value sets the cache size in KiB rather than in pages.
+    cursor.execute('PRAGMA cache_size = -%d' % WAL_CACHE_SIZE_KB)
+
+
+def open_or_create_db(db_path, wal=False):
     """Opens a database file or creates one if the file does not exist.
 
     If a file exists at the given path, opens the file at that path as a
     database and returns a connection to it. If no file exists, creates and
     initializes a GreenPiThumb database at the given file path.
 
+    Args:
+        db_path: Path to the database file.
+        wal: If True, switches the database to write-ahead logging so that
+            readers and the writer don't block each other.
+
     Returns:
         A sqlite connection object for the database. The caller is responsible
         for closing the object.
     """
     if os.path.exists(db_path):
-        return _open_db(db_path)
+        connection = _open_db(db_path)
+        # Bring databases created by older versions up to the current schema.
+        _migrate(connection)
     else:
-        return _create_db(db_path)
+        connection = _create_db(db_path)
+    if wal:
+        _enable_wal(connection)
+    return connection
+
+
+class ReadConnectionPool(object):
+    """A fixed-size pool of read-only connections to a GreenPiThumb database.
+
+    Lets threads other than the one writing records query the database
+    without sharing the writer's connection. Pair with a database in WAL mode
+    so that these reads don't block writes. This class is thread-safe.
+    """
+
+    def __init__(self, db_path, size):
+        """Creates a new ReadConnectionPool instance.
+
+        Args:
+            db_path: Path to an existing GreenPiThumb database file.
+            size: Number of connections in the pool.
+        """
+        self._connections = Queue.Queue()
+        self._all_connections = []
+        for _ in range(size):
+            # Each connection is only used by one thread at a time, but may be
+            # used by different threads over its lifetime.
+            connection = sqlite3.connect(db_path, check_same_thread=False)
+            connection.execute('PRAGMA query_only = ON')
+            self._all_connections.append(connection)
+            self._connections.put(connection)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Borrows a read-only connection from the pool.
+
+        Blocks until a connection is available. The connection is returned to
+        the pool when the with block exits.
+
+        Args:
+            timeout: The maximum time (in seconds) to wait for a connection,
+                or None to wait indefinitely.
+
+        Raises:
+            Queue.Empty if no connection became available before the timeout.
+        """
+        connection = self._connections.get(timeout=timeout)
+        try:
+            yield connection
+        finally:
+            # End any read transaction so that the connection doesn't pin an
+            # old snapshot of the database while it sits in the pool.
+            connection.rollback()
+            self._connections.put(connection)
+
+    def close(self):
+        """Closes every connection in the pool."""
+        for connection in self._all_connections:
+            connection.close()
+
+
+def purge_expired_records(connection, retention, now):
+    """Deletes records that are older than their table's retention period.
+
+    All tables are purged in a single transaction. If the database was created
+    with incremental auto-vacuum, the pages freed by the purge are then
+    returned to the filesystem.
+
+    Args:
+        connection: SQLite database connection.
+        retention: A dict mapping table names to a timedelta of how long to
+            keep records in that table.
+        now: A datetime representing the current time.
+
+    Returns:
+        A dict mapping each purged table name to the number of rows deleted
+        from it.
+
+    Raises:
+        ValueError if retention refers to an unknown table.
+    """
+    for table in retention:
+        if table not in DEFAULT_RETENTION:
+            raise ValueError('Unknown table for retention: %s' % table)
+    cursor = connection.cursor()
+    rows_deleted = {}
+    try:
+        for table, max_age in sorted(retention.items()):
+            cutoff = _timestamp_to_utc(now - max_age)
+            cursor.execute('DELETE FROM %s WHERE timestamp <= ?' % table,
+                           (_format_timestamp(cutoff),))
+            rows_deleted[table] = cursor.rowcount
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+        # SQLite frees one page per step of this statement, so fetch every
+        # row to run it to completion.
+        cursor.execute('PRAGMA incremental_vacuum').fetchall()
+    return rows_deleted
 
 
 class _DbStoreBase(object):
@@ -140,61 +653,126 @@ class _DbStoreBase(object):
           value1: Value 1 to insert for the record.
           value2: Value 2 to insert for the record.
         """
-        timestamp_utc = _timestamp_to_utc(timestamp)
-        
         # Insert timestamp, value1, value2 (when inserting water_present)
         #logger.info("_do_insert() value1={} value2={}".format(value1, value2))
         if value2 is not None:
-            self._cursor.execute(sql, (timestamp_utc.strftime(_TIMESTAMP_FORMAT), value1, value2))
+            self._cursor.execute(sql, (_format_timestamp(timestamp), value1, value2))
         # Insert timestamp, value1 (standard case)
         else:
-            self._cursor.execute(sql, (timestamp_utc.strftime(_TIMESTAMP_FORMAT), value1))
+            self._cursor.execute(sql, (_format_timestamp(timestamp), value1))
         
         self._connection.commit()
 
 
-    def _do_delete_old_data(self, sql):
-        """Executes and commits a SQL delete command.
+    def _do_insert_many(self, sql, records, commit):
+        """Executes a SQL insert command once for each record in a batch.
 
         Args:
-          sql: SQL query string for the delete command.
+          sql: SQL query string for the insert command.
+          records: A sequence of records to insert.
+          commit: Whether to commit the insert. If False, the insert is left
+            in the connection's open transaction.
         """
-        #~ logger.info("[do_delete_old_data] Execute sql={}".format(sql))
-        try:
-            self._cursor.execute(sql)        
+        self._cursor.executemany(sql, [_record_to_row(r) for r in records])
+        if commit:
             self._connection.commit()
-            #~ logger.info("[do_delete_old_data] Deleted older data from database")
 
-        except:
-            self._connection.rollback()
-            logger.error("[do_delete_old_data] Cannot delete older data from database")
 
-
-    def _do_get(self, sql, record_type, is_soil_moisture_record=None):
+    def _do_get(self, sql, record_type, parameters=(), raw_timestamps=False):
         """Executes a SQL select query and returns the results.
 
         Args:
           sql: SQL select query string.
           record_type: The record type to parse the SQL results into.
-          is_soil_moisture_record: Flag indicating that this is a soil moisture record.
+          parameters: Values for the query's placeholders.
+          raw_timestamps: If True, leaves record timestamps as seconds since
+            the UNIX epoch instead of converting them to datetimes.
 
         Returns:
           A list of database records corresponding to the select query.
         """
-        self._cursor.execute(sql)
-        data = []
-        for row in self._cursor.fetchall():
-            timestamp = datetime.datetime.strptime(row[0], _TIMESTAMP_FORMAT).replace(tzinfo=pytz.utc)
-            
-            # Append timestamp, field1, field2 (when appending water_present)
-            if is_soil_moisture_record is not None:
-                data.append((timestamp, row[1], row[2]))
-            # Append timestamp, field1 (standard case)
-            else:
-                data.append((timestamp, row[1]))
+        self._cursor.execute(sql, parameters)
+        rows = self._cursor.fetchall()
+        if raw_timestamps:
+            return [record_type._make(row) for row in rows]
+        return [
+            record_type._make((_parse_timestamp(row[0]),) + tuple(row[1:]))
+            for row in rows
+        ]
+
+    def _do_get_range(self, table, record_type, start, end, limit, order,
+                      raw_timestamps):
+        """Retrieves the records in a table within a time range.
+
+        Args:
+          table: Name of the table to query.
+          record_type: The record type to parse the SQL results into.
+          start: If not None, earliest timestamp (inclusive) to retrieve.
+          end: If not None, latest timestamp (exclusive) to retrieve.
+          limit: If not None, the maximum number of records to retrieve.
+          order: 'asc' for oldest records first, 'desc' for newest first.
+          raw_timestamps: If True, leaves record timestamps as seconds since
+            the UNIX epoch.
+
+        Returns:
+          A list of records ordered by timestamp.
+        """
+        sql, parameters = _select_query(table, start, end, limit, order)
+        return self._do_get(sql, record_type, parameters, raw_timestamps)
 
-        typed_data = map(record_type._make, data)
-        return typed_data
+    def _do_iter_range(self, table, record_type, start, end, chunk_size,
+                       raw_timestamps):
+        """Lazily yields the records in a table within a time range.
+
+        Fetches chunk_size rows from the database at a time, so memory use is
+        bounded regardless of how many records the range contains. Uses its
+        own cursor, so other queries on the store may run while iterating.
+        Writes on the same connection reset open queries, so callers that
+        iterate over long ranges while records are being stored should use a
+        separate connection.
+
+        Args:
+          table: Name of the table to query.
+          record_type: The record type to parse the SQL results into.
+          start: If not None, earliest timestamp (inclusive) to retrieve.
+          end: If not None, latest timestamp (exclusive) to retrieve.
+          chunk_size: Number of rows to fetch from the database at a time.
+          raw_timestamps: If True, leaves record timestamps as seconds since
+            the UNIX epoch.
+
+        Yields:
+          Records in ascending timestamp order.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive: %d' % chunk_size)
+        sql, parameters = _select_query(table, start, end, None, 'asc')
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(sql, parameters)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    if raw_timestamps:
+                        yield record_type._make(row)
+                    else:
+                        yield record_type._make(
+                            (_parse_timestamp(row[0]),) + tuple(row[1:]))
+        finally:
+            cursor.close()
+
+    def commit(self):
+        """Commits all pending writes on the store's database connection.
+
+        Stores that share a connection share a transaction, so a single commit
+        covers batched inserts made through any of them.
+        """
+        self._connection.commit()
+
+    def rollback(self):
+        """Discards all uncommitted writes on the store's database connection."""
+        self._connection.rollback()
 
 
 class SoilMoistureStore(_DbStoreBase):
@@ -210,15 +788,63 @@ class SoilMoistureStore(_DbStoreBase):
                         soil_moisture_record.timestamp,
                         soil_moisture_record.soil_moisture,
                         soil_moisture_record.water_present)
-        self._do_delete_old_data("DELETE FROM soil_moisture WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))        
 
-    def get(self):
+    def insert_many(self, soil_moisture_records, commit=True):
+        """Inserts a batch of soil moisture records with a single statement.
+
+        Args:
+            soil_moisture_records: A sequence of soil moisture records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO soil_moisture VALUES (?, ?, ?)',
+                             soil_moisture_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp, soil moisture and water present readings.
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of readings to retrieve.
+            order: 'asc' for oldest readings first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp', 'soil_moisture' and 'water_present' fields.
         """
-        return self._do_get('SELECT * FROM soil_moisture', SoilMoistureRecord, True)
+        return self._do_get_range('soil_moisture', SoilMoistureRecord,
+                                  start, end, limit, order,
+                                  raw_timestamps)
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over soil moisture readings in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of readings to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp', 'soil_moisture' and
+            'water_present' fields.
+        """
+        return self._do_iter_range('soil_moisture', SoilMoistureRecord,
+                                   start, end, chunk_size,
+                                   raw_timestamps)
 
 
 class LightStore(_DbStoreBase):
@@ -232,15 +858,60 @@ class LightStore(_DbStoreBase):
         """
         self._do_insert('INSERT INTO light VALUES (?, ?)',
                         light_record.timestamp, light_record.light)
-        self._do_delete_old_data("DELETE FROM light WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))
 
-    def get(self):
+    def insert_many(self, light_records, commit=True):
+        """Inserts a batch of light records with a single statement.
+
+        Args:
+            light_records: A sequence of light records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO light VALUES (?, ?)',
+                             light_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp and light readings.
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of readings to retrieve.
+            order: 'asc' for oldest readings first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp' and 'light' fields.
         """
-        return self._do_get('SELECT * FROM light', LightRecord)
+        return self._do_get_range('light', LightRecord, start, end, limit,
+                                  order, raw_timestamps)
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over light readings in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of readings to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp' and 'light' fields.
+        """
+        return self._do_iter_range('light', LightRecord, start, end,
+                                   chunk_size, raw_timestamps)
 
 
 class HumidityStore(_DbStoreBase):
@@ -254,15 +925,60 @@ class HumidityStore(_DbStoreBase):
         """
         self._do_insert('INSERT INTO humidity VALUES (?, ?)',
                         humidity_record.timestamp, humidity_record.humidity)
-        self._do_delete_old_data("DELETE FROM humidity WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))
 
-    def get(self):
+    def insert_many(self, humidity_records, commit=True):
+        """Inserts a batch of humidity records with a single statement.
+
+        Args:
+            humidity_records: A sequence of humidity records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO humidity VALUES (?, ?)',
+                             humidity_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp and relative humidity readings.
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of readings to retrieve.
+            order: 'asc' for oldest readings first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp' and 'humidity' fields.
         """
-        return self._do_get('SELECT * FROM humidity', HumidityRecord)
+        return self._do_get_range('humidity', HumidityRecord, start, end,
+                                  limit, order, raw_timestamps)
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over humidity readings in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of readings to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp' and 'humidity' fields.
+        """
+        return self._do_iter_range('humidity', HumidityRecord, start, end,
+                                   chunk_size, raw_timestamps)
 
 
 class TemperatureStore(_DbStoreBase):
@@ -277,15 +993,61 @@ class TemperatureStore(_DbStoreBase):
         self._do_insert('INSERT INTO temperature VALUES (?, ?)',
                         temperature_record.timestamp,
                         temperature_record.temperature)
-        self._do_delete_old_data("DELETE FROM temperature WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))
 
-    def get(self):
+    def insert_many(self, temperature_records, commit=True):
+        """Inserts a batch of temperature records with a single statement.
+
+        Args:
+            temperature_records: A sequence of temperature records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO temperature VALUES (?, ?)',
+                             temperature_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp and temperature(C) readings.
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of readings to retrieve.
+            order: 'asc' for oldest readings first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp' and 'temperature' fields.
         """
-        return self._do_get('SELECT * FROM temperature', TemperatureRecord)
+        return self._do_get_range('temperature', TemperatureRecord,
+                                  start, end, limit, order,
+                                  raw_timestamps)
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over temperature readings in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of readings to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp' and 'temperature' fields.
+        """
+        return self._do_iter_range('temperature', TemperatureRecord, start, end,
+                                   chunk_size, raw_timestamps)
         
 class WaterLevelStore(_DbStoreBase):
     """Stores water level readings."""
@@ -299,15 +1061,61 @@ class WaterLevelStore(_DbStoreBase):
         self._do_insert('INSERT INTO water_level VALUES (?, ?)',
                         water_level_record.timestamp,
                         water_level_record.water_level)
-        self._do_delete_old_data("DELETE FROM water_level WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))
 
-    def get(self):
+    def insert_many(self, water_level_records, commit=True):
+        """Inserts a batch of water level records with a single statement.
+
+        Args:
+            water_level_records: A sequence of water level records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO water_level VALUES (?, ?)',
+                             water_level_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp and water level [cm] readings.
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of readings to retrieve.
+            order: 'asc' for oldest readings first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp' and 'water_level' fields.
         """
-        return self._do_get('SELECT * FROM water_level', WaterLevelRecord)        
+        return self._do_get_range('water_level', WaterLevelRecord,
+                                  start, end, limit, order,
+                                  raw_timestamps)
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over water level readings in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of readings to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp' and 'water_level' fields.
+        """
+        return self._do_iter_range('water_level', WaterLevelRecord, start, end,
+                                   chunk_size, raw_timestamps)        
 
 
 class WateringEventStore(_DbStoreBase):
@@ -322,13 +1130,193 @@ class WateringEventStore(_DbStoreBase):
         self._do_insert('INSERT INTO watering_events VALUES (?, ?)',
                         watering_event_record.timestamp,
                         watering_event_record.water_pumped)
-        self._do_delete_old_data("DELETE FROM watering_events WHERE timestamp <= date('now','-{} day')".format(DELETE_THRESHOLD))
 
-    def get(self):
+    def insert_many(self, watering_event_records, commit=True):
+        """Inserts a batch of watering event records with a single statement.
+
+        Args:
+            watering_event_records: A sequence of watering event records to store.
+            commit: Whether to commit the batch. If False, the inserts are
+                left in the connection's open transaction for the caller to
+                commit along with other writes.
+        """
+        self._do_insert_many('INSERT INTO watering_events VALUES (?, ?)',
+                             watering_event_records, commit)
+
+    def get(self,
+            start=None,
+            end=None,
+            limit=None,
+            order='asc',
+            raw_timestamps=False):
         """Retrieves timestamp and volume of water pumped(in mL).
 
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            limit: If not None, the maximum number of events to retrieve.
+            order: 'asc' for oldest events first, 'desc' for newest first.
+            raw_timestamps: If True, returns timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
         Returns:
             A list of objects with 'timestamp' and 'water_pumped' fields.
         """
-        return self._do_get('SELECT * FROM watering_events',
-                            WateringEventRecord)
+        return self._do_get_range('watering_events', WateringEventRecord,
+                                  start, end, limit, order,
+                                  raw_timestamps)
+
+    def latest(self):
+        """Retrieves the most recent watering event.
+
+        Uses the timestamp index, so the lookup takes constant time regardless
+        of how many events are stored.
+
+        Returns:
+            The watering event record with the newest timestamp, or None if no
+            events are stored.
+        """
+        records = self.get(limit=1, order='desc')
+        if not records:
+            return None
+        return records[0]
+
+    def total_water_pumped(self, start=None, end=None):
+        """Retrieves the total volume of water pumped within a time range.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to include.
+            end: If not None, latest timestamp (exclusive) to include.
+
+        Returns:
+            Total water pumped (in mL) by the events in the range, or 0.0 if
+            there are none.
+        """
+        where_clause, parameters = _time_range_clause(start, end)
+        self._cursor.execute(
+            'SELECT TOTAL(water_pumped) FROM watering_events' + where_clause,
+            parameters)
+        return self._cursor.fetchone()[0]
+
+    def iter_records(self,
+                     start=None,
+                     end=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     raw_timestamps=False):
+        """Lazily iterates over watering events in timestamp order.
+
+        Args:
+            start: If not None, earliest timestamp (inclusive) to retrieve.
+            end: If not None, latest timestamp (exclusive) to retrieve.
+            chunk_size: Number of events to fetch from the database at a time.
+            raw_timestamps: If True, yields timestamps as seconds since the
+                UNIX epoch instead of as datetimes.
+
+        Returns:
+            A generator of objects with 'timestamp' and 'water_pumped' fields.
+        """
+        return self._do_iter_range('watering_events', WateringEventRecord,
+                                   start, end, chunk_size,
+                                   raw_timestamps)
+
+
+class RollupStore(_DbStoreBase):
+    """Stores and retrieves hourly and daily aggregates of sensor readings."""
+
+    def add(self, records, commit=True):
+        """Folds sensor readings into their hourly and daily rollups.
+
+        Each rollup keeps a running count, total, minimum and maximum, so
+        adding readings never rescans the raw tables. Records of types without
+        rollups, such as watering events, are ignored.
+
+        Args:
+            records: A sequence of sensor reading records. A CoalescedRecord
+                counts as all of the readings it merges.
+            commit: Whether to commit the update. If False, the update is left
+                in the connection's open transaction for the caller to commit
+                along with other writes.
+        """
+        # Aggregate the batch in memory first, so each rollup period touched
+        # costs one database update regardless of how many readings it has.
+        aggregates = {}
+        for record in records:
+            sensor = sensor_name(record)
+            if sensor is None:
+                continue
+            if getattr(unwrap_record(record), sensor) is None:
+                continue
+            reading, count, minimum, maximum = _as_aggregate(record)
+            total = getattr(reading, sensor) * count
+            timestamp = _format_timestamp(reading.timestamp)
+            for resolution, period_seconds in ROLLUP_RESOLUTIONS.items():
+                key = (sensor, resolution,
+                       timestamp - (timestamp % period_seconds))
+                if key in aggregates:
+                    (period_count, period_total, period_minimum,
+                     period_maximum) = aggregates[key]
+                    aggregates[key] = (period_count + count,
+                                       period_total + total,
+                                       min(period_minimum, minimum),
+                                       max(period_maximum, maximum))
+                else:
+                    aggregates[key] = (count, total, minimum, maximum)
+        if aggregates:
+            keys = sorted(aggregates)
+            self._cursor.executemany(
+                'INSERT OR IGNORE INTO rollups VALUES (?, ?, ?, 0, 0.0, ?, ?)',
+                [
+                    rollup_key + aggregates[rollup_key][2:]
+                    for rollup_key in keys
+                ])
+            self._cursor.executemany(
+                'UPDATE rollups SET count = count + ?, total = total + ?, '
+                'minimum = MIN(minimum, ?), maximum = MAX(maximum, ?) '
+                'WHERE sensor = ? AND resolution = ? AND period_start = ?',
+                [aggregates[rollup_key] + rollup_key for rollup_key in keys])
+        if commit:
+            self._connection.commit()
+
+    def get_rollup(self, sensor, resolution, start=None, end=None):
+        """Retrieves a sensor's rollups at the given resolution.
+
+        Args:
+            sensor: Name of the sensor, such as 'temperature'.
+            resolution: 'hour' or 'day'.
+            start: If not None, only rollups for periods starting at or after
+                this datetime are retrieved.
+            end: If not None, only rollups for periods starting before this
+                datetime are retrieved.
+
+        Returns:
+            A list of objects with 'period_start', 'count', 'minimum',
+            'maximum' and 'mean' fields, ordered by period_start.
+
+        Raises:
+            ValueError if sensor or resolution is unknown.
+        """
+        if sensor not in _ROLLUP_SENSORS.values():
+            raise ValueError('No rollups for sensor: %s' % sensor)
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError('Unknown rollup resolution: %s' % resolution)
+        sql = ('SELECT period_start, count, minimum, maximum, total '
+               'FROM rollups WHERE sensor = ? AND resolution = ?')
+        parameters = [sensor, resolution]
+        if start is not None:
+            sql += ' AND period_start >= ?'
+            parameters.append(_format_timestamp(start))
+        if end is not None:
+            sql += ' AND period_start < ?'
+            parameters.append(_format_timestamp(end))
+        sql += ' ORDER BY period_start ASC'
+        self._cursor.execute(sql, parameters)
+        return [
+            RollupRecord(
+                period_start=_parse_timestamp(period_start),
+                count=count,
+                minimum=minimum,
+                maximum=maximum,
+                mean=total / count)
+            for period_start, count, minimum, maximum, total in
+            self._cursor.fetchall()
+        ]
@@ -1,8 +1,12 @@
 import logging
-import time
+
+import clock
 
 logger = logging.getLogger(__name__)
 
+# Number of seconds the sensor needs after power up before it can be read.
+STARTUP_SECONDS = 2.0
+
 WET_VALUE = 600
 DRY_VALUE = 1000
 
@@ -11,7 +15,7 @@ class DrainSensor(object):
     """Wrapper for a moisture sensor."""
 
 
-    def __init__(self, adc, pi_io, channel, gpio_pin):
+    def __init__(self, adc, pi_io, channel, gpio_pin, utc_clock=None):
         """Creates a new DrainSensor instance.
 
         Args:
@@ -22,11 +26,14 @@ class DrainSensor(object):
                 be an int between 0 and 7.
             gpio_pin: The Raspberry Pi GPIO pin that the moisture sensor is
                 connected to. Must be an int between 2 and 27.
+            utc_clock: A clock interface used to wait for the sensor to start
+                up. Defaults to the system clock.
         """
         self._adc = adc
         self._pi_io = pi_io
         self._channel = channel
         self._gpio_pin = gpio_pin
+        self._clock = utc_clock or clock.Clock()
 
 
     def water_present(self):
@@ -39,7 +46,7 @@ class DrainSensor(object):
         self._pi_io.turn_pin_on(self._gpio_pin)
         
         # Sensor startup time
-        time.sleep(2.0)   # Wait time in seconds
+        self._clock.wait(STARTUP_SECONDS)
 
         # Take sensor reading
         reading = self._adc.read_adc(self._channel)
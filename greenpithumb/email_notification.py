@@ -1,5 +1,4 @@
 import logging
-import yagmail
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +25,10 @@ class EmailNotification(object):
 
     def send(self):
         """Sends an email via yagmail."""
+        # Imported on first use, so that code that may notify, such as the
+        # pump manager, runs without yagmail installed.
+        import yagmail
+
         # Read credentials
         try:
             f = open(AUTH_PATH, 'r')
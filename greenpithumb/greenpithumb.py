@@ -1,27 +1,32 @@
 import argparse
 import contextlib
 import datetime
+import fcntl
 import logging
-import Queue
-import time
-
-import Adafruit_DHT
-import Adafruit_MCP3008
-#~ import picamera
-import RPi.GPIO as GPIO
+import os
+import signal
+import sys
+import threading
 
 import adc_thread_safe
+import bounded_queue
 import camera_manager
 import clock
 import db_store
 import dht22
+import hardware
 import humidity_sensor
 import light_sensor
 import pi_io
+import poll_stats
 import poller
 import pump
 import pump_history
+import read_executor
+import reading_cache
 import record_processor
+import replay
+import retention
 import sleep_windows
 #import soil_moisture_sensor
 import vegetronix_vh400
@@ -33,6 +38,16 @@ import mqtt_client
 
 logger = logging.getLogger(__name__)
 
+# Largest change between consecutive readings of each sensor that adaptive
+# polling treats as stable.
+_ADAPTIVE_POLL_TOLERANCES = {
+    reading_cache.TEMPERATURE: 0.5,  # [degrees C]
+    reading_cache.HUMIDITY: 2.0,  # [%]
+    reading_cache.WATER_LEVEL: 0.2,  # [l]
+    reading_cache.LIGHT: 5.0,  # [%]
+    reading_cache.SOIL_MOISTURE: 1.0,  # [% VWC]
+}
+
 
 def configure_logging(verbose):
     """Configure the root logger for log output."""
@@ -56,42 +71,34 @@ def read_wiring_config(config_filename):
         return wiring_config_parser.parse(config_file.read())
 
 
-def make_adc(wiring_config):
-    """Creates ADC instance based on the given wiring_config.
+def make_adc(hardware_backend, samples, reduction):
+    """Creates a thread-safe ADC instance.
 
     Args:
-        wiring_config: Wiring configuration for the GreenPiThumb.
+        hardware_backend: Hardware backend that provides the raw ADC.
+        samples: Number of samples to take of each channel read.
+        reduction: How to combine each channel's samples, one of
+            adc_thread_safe.REDUCTIONS.
 
     Returns:
-        An ADC instance for the specified wiring config.
+        An ADC instance for the hardware backend.
     """
-    # The MCP3008 spec and Adafruit library use different naming for the
-    # Raspberry Pi GPIO pins, so we translate as follows:
-    # * CLK -> CLK
-    # * CS/SHDN -> CS
-    # * DOUT -> MISO
-    # * DIN -> MOSI
     return adc_thread_safe.Adc(
-        Adafruit_MCP3008.MCP3008(
-            clk=wiring_config.gpio_pins.mcp3008_clk,
-            cs=wiring_config.gpio_pins.mcp3008_cs_shdn,
-            miso=wiring_config.gpio_pins.mcp3008_dout,
-            mosi=wiring_config.gpio_pins.mcp3008_din))
+        hardware_backend.adc(), samples=samples, reduction=reduction)
 
 
-def make_dht22_sensors(wiring_config):
+def make_dht22_sensors(hardware_backend):
     """Creates sensors derived from the DHT22 sensor.
 
     Args:
-        wiring_config: Wiring configuration for the GreenPiThumb.
+        hardware_backend: Hardware backend that provides the DHT22.
 
     Returns:
         A two-tuple where the first element is a temperature sensor and the
         second element is a humidity sensor.
     """
-    local_dht22 = dht22.CachingDHT22(
-        lambda: Adafruit_DHT.read_retry(Adafruit_DHT.DHT22, wiring_config.gpio_pins.dht22),
-        clock.Clock())
+    local_dht22 = dht22.CachingDHT22(hardware_backend.dht22_read_func(),
+                                     clock.Clock())
     return temperature_sensor.TemperatureSensor(
         local_dht22), humidity_sensor.HumiditySensor(local_dht22),
 
@@ -112,28 +119,50 @@ def make_drain_sensor(adc, raspberry_pi_io, wiring_config):
 def make_light_sensor(adc, wiring_config):
     return light_sensor.LightSensor(adc,
                                     wiring_config.adc_channels.light_sensor)
-                                    
-def make_mqtt_client(mqtt_broker):
+
+
+def make_mqtt_client(mqtt_broker, hardware_backend_name=hardware.PI):
+    """Creates the client on which readings are published over MQTT.
+
+    Args:
+        mqtt_broker: IP address of the MQTT broker, or None or empty if there
+            is none.
+        hardware_backend_name: Name of the hardware backend in use.
+
+    Returns:
+        An MqttClient connected to the broker, or a NullMqttClient that
+        discards what it publishes if there is no broker or the hardware is
+        simulated.
+    """
+    if not mqtt_broker or hardware_backend_name == hardware.SIM:
+        logger.info('not publishing readings over MQTT')
+        return mqtt_client.NullMqttClient()
     return mqtt_client.MqttClient(mqtt_broker)
 
-def make_camera_manager(rotation, image_path, light_sensor):
+
+def make_camera_manager(hardware_backend, rotation, image_path, light_sensor,
+                        latest_readings):
     """Creates a camera manager instance.
 
     Args:
+        hardware_backend: Hardware backend that provides the camera.
         rotation: The amount (in whole degrees) to rotate the camera image.
         image_path: The directory in which to save images.
         light_sensor: A light sensor instance.
+        latest_readings: Cache of the latest sensor readings.
 
     Returns:
         A CameraManager instance with the given settings.
     """
-    #~ camera = picamera.PiCamera(resolution=picamera.PiCamera.MAX_RESOLUTION)
-    #~ camera.rotation = 0 
-    return camera_manager.CameraManager(image_path, clock.Clock(), light_sensor)
+    return camera_manager.CameraManager(image_path, clock.Clock(),
+                                        hardware_backend.camera(),
+                                        light_sensor, latest_readings)
 
 
 def make_pump_manager(moisture_threshold, sleep_windows, raspberry_pi_io,
-                      wiring_config, pump_amount, db_connection, pump_interval, water_level_sensor):
+                      wiring_config, pump_amount, db_read_pool, pump_interval,
+                      water_level_sensor, latest_readings, poll_engine,
+                      sensor_read_executor):
     """Creates a pump manager instance.
 
     Args:
@@ -143,9 +172,14 @@ def make_pump_manager(moisture_threshold, sleep_windows, raspberry_pi_io,
         raspberry_pi_io: pi_io instance for the GreenPiThumb.
         wiring_config: Wiring configuration for the GreenPiThumb.
         pump_amount: Amount (in mL) to pump on each run of the pump.
-        db_connection: Database connection to use to retrieve pump history.
+        db_read_pool: Pool of read-only database connections to use to
+            retrieve pump history.
         pump_interval: Maximum amount of hours between pump runs.
         water_level_sensor: Interface to the water level sensor.
+        latest_readings: Cache of the latest sensor readings.
+        poll_engine: PollEngine on which pump events run.
+        sensor_read_executor: ReadExecutor on which pump events read the
+            drain sensor.
 
     Returns:
         A PumpManager instance with the given settings.
@@ -153,7 +187,13 @@ def make_pump_manager(moisture_threshold, sleep_windows, raspberry_pi_io,
     water_pump = pump.Pump(raspberry_pi_io, clock.Clock(), wiring_config.gpio_pins.pump)
     pump_scheduler = pump.PumpScheduler(clock.LocalClock(), sleep_windows)
     pump_timer = clock.Timer(clock.Clock(), pump_interval)
-    last_pump_time = pump_history.last_pump_time(db_store.WateringEventStore(db_connection))
+    with db_read_pool.connection() as db_connection:
+        watering_event_store = db_store.WateringEventStore(db_connection)
+        last_pump_time = pump_history.last_pump_time(watering_event_store)
+        logger.info('water pumped in the last day: %.0f mL',
+                    pump_history.water_pumped_since(
+                        watering_event_store,
+                        clock.Clock().now() - datetime.timedelta(days=1)))
     if last_pump_time:
         logger.info('last watering was at %s', last_pump_time)
         time_remaining = max(datetime.timedelta(seconds=0), (last_pump_time + pump_interval) - clock.Clock().now())
@@ -163,17 +203,23 @@ def make_pump_manager(moisture_threshold, sleep_windows, raspberry_pi_io,
         time_remaining = pump_interval                      # Schedule the first mandatory plant watering event in pump_interval hours
     logger.info('time until until next watering: %s', time_remaining)
     pump_timer.set_remaining(time_remaining)
-    return pump.PumpManager(water_pump, pump_scheduler, moisture_threshold, pump_amount, pump_timer, water_level_sensor)
+    return pump.PumpManager(water_pump, pump_scheduler, moisture_threshold, pump_amount, pump_timer, water_level_sensor,
+                            latest_readings, poll_engine=poll_engine,
+                            sensor_read_executor=sensor_read_executor)
 
 
-def make_sensor_pollers(poll_interval, photo_interval, record_queue, mqtt_client,
+def make_sensor_pollers(poll_interval, max_poll_interval, photo_interval, record_queue, mqtt_client,
                         temperature_sensor, humidity_sensor, water_level_sensor,
                         soil_moisture_sensor, drain_sensor, light_sensor, camera_manager,
-                        pump_manager):
+                        pump_manager, latest_readings, poll_engine, stats_registry,
+                        sensor_read_executor):
     """Creates a poller for each GreenPiThumb sensor.
 
     Args:
         poll_interval: The frequency at which to poll non-camera sensors.
+        max_poll_interval: If not None, non-camera sensors are polled
+            adaptively, backing off from poll_interval up to this interval
+            while their readings are stable.
         photo_interval: The frequency at which to capture photos.
         record_queue: Queue on which to put sensor reading records.
         mqtt_client: The mqtt client for sending updates to openhab
@@ -185,6 +231,13 @@ def make_sensor_pollers(poll_interval, photo_interval, record_queue, mqtt_client
         light_sensor: Sensor for measuring light levels.
         camera_manager: Interface for capturing photos.
         pump_manager: Interface for turning water pump on and off.
+        latest_readings: Cache in which pollers store the latest sensor
+            readings.
+        poll_engine: PollEngine that runs the pollers' polls.
+        stats_registry: PollStats registry to which the pollers' timing
+            statistics are added.
+        sensor_read_executor: ReadExecutor on which the pollers read their
+            sensors.
 
     Returns:
         A list of sensor pollers.
@@ -193,29 +246,97 @@ def make_sensor_pollers(poll_interval, photo_interval, record_queue, mqtt_client
                 poll_interval.total_seconds())
     utc_clock = clock.Clock()
 
-    make_scheduler_func = lambda: poller.Scheduler(utc_clock, poll_interval)
+    def poller_factory(sensor, fast_polling_func=None):
+        """Creates a poller factory whose schedulers suit the given sensor."""
+        if max_poll_interval is None:
+            make_scheduler_func = lambda: poller.Scheduler(utc_clock, poll_interval)
+        else:
+            make_scheduler_func = lambda: poller.AdaptiveScheduler(
+                utc_clock, poll_interval, max_poll_interval,
+                _ADAPTIVE_POLL_TOLERANCES[sensor], fast_polling_func)
+        return poller.SensorPollerFactory(make_scheduler_func, record_queue, mqtt_client,
+                                          latest_readings, poll_engine, stats_registry,
+                                          sensor_read_executor)
+
     photo_make_scheduler_func = lambda: poller.Scheduler(utc_clock, photo_interval)
-    poller_factory = poller.SensorPollerFactory(make_scheduler_func, record_queue, mqtt_client)
     camera_poller_factory = poller.SensorPollerFactory(
-        photo_make_scheduler_func, record_queue, mqtt_client)
+        photo_make_scheduler_func, record_queue, mqtt_client, latest_readings,
+        poll_engine, stats_registry)
 
     return [
-        poller_factory.create_temperature_poller(temperature_sensor),
-        poller_factory.create_humidity_poller(humidity_sensor),
-        poller_factory.create_water_level_poller(water_level_sensor),
-        poller_factory.create_soil_watering_poller(
+        poller_factory(reading_cache.TEMPERATURE).create_temperature_poller(
+            temperature_sensor),
+        poller_factory(reading_cache.HUMIDITY).create_humidity_poller(
+            humidity_sensor),
+        poller_factory(reading_cache.WATER_LEVEL,
+                       pump_manager.pump_event_in_progress
+                      ).create_water_level_poller(water_level_sensor),
+        poller_factory(reading_cache.SOIL_MOISTURE,
+                       pump_manager.pump_event_in_progress
+                      ).create_soil_watering_poller(
             soil_moisture_sensor, drain_sensor, pump_manager),
-        poller_factory.create_light_poller(light_sensor),
+        poller_factory(reading_cache.LIGHT).create_light_poller(light_sensor),
         camera_poller_factory.create_camera_poller(camera_manager)
     ]  # yapf: disable
 
 
-def create_record_processor(db_connection, record_queue):
+def make_retention_poller(retention_interval, table_retention, record_queue,
+                          mqtt_client, poll_engine, stats_registry):
+    """Creates a poller that periodically purges expired database records.
+
+    Args:
+        retention_interval: The frequency at which to purge expired records.
+        table_retention: A dict mapping table names to a timedelta of how long
+            to keep records in that table.
+        record_queue: Queue on which to put database records, and the purges
+            for the record processor to run.
+        mqtt_client: The mqtt client for sending updates to openhab.
+        poll_engine: PollEngine that runs the poller's polls.
+        stats_registry: PollStats registry to which the poller's timing
+            statistics are added.
+
+    Returns:
+        A poller for the retention compactor.
+    """
+    utc_clock = clock.Clock()
+    retention_poller_factory = poller.SensorPollerFactory(
+        lambda: poller.Scheduler(utc_clock, retention_interval), record_queue,
+        mqtt_client, poll_engine=poll_engine, stats_registry=stats_registry)
+    return retention_poller_factory.create_retention_poller(
+        retention.RetentionCompactor(record_queue, table_retention, utc_clock))
+
+
+def make_poll_stats_poller(stats_interval, stats_registry, record_queue,
+                           mqtt_client, poll_engine):
+    """Creates a poller that periodically reports poll timing statistics.
+
+    Args:
+        stats_interval: The frequency at which to report statistics.
+        stats_registry: PollStats registry of the statistics to report.
+        record_queue: Queue on which to put database records.
+        mqtt_client: The mqtt client for sending updates to openhab.
+        poll_engine: PollEngine that runs the poller's polls.
+
+    Returns:
+        A poller that logs and publishes the statistics.
+    """
+    utc_clock = clock.Clock()
+    stats_poller_factory = poller.SensorPollerFactory(
+        lambda: poller.Scheduler(utc_clock, stats_interval), record_queue,
+        mqtt_client, poll_engine=poll_engine)
+    return stats_poller_factory.create_poll_stats_poller(stats_registry)
+
+
+def create_record_processor(db_connection, record_queue, batch_size,
+                            batch_max_age):
     """Creates a record processor for storing records in a database.
 
     Args:
         db_connection: Database connection to use to store records.
         record_queue: Record queue from which to process records.
+        batch_size: Number of pending records at which to commit a batch.
+        batch_max_age: Maximum time (as a timedelta) a record waits before its
+            batch is committed.
     """
     return record_processor.RecordProcessor(
         record_queue,
@@ -224,43 +345,176 @@ def create_record_processor(db_connection, record_queue):
         db_store.HumidityStore(db_connection),
         db_store.TemperatureStore(db_connection),
         db_store.WaterLevelStore(db_connection),
-        db_store.WateringEventStore(db_connection))
+        db_store.WateringEventStore(db_connection),
+        rollup_store=db_store.RollupStore(db_connection),
+        connection=db_connection,
+        utc_clock=clock.Clock(),
+        batch_size=batch_size,
+        batch_max_age=batch_max_age)
+
+
+def shutdown_processor_on_signals(processor):
+    """Asks a record processor to stop when the process gets SIGINT or SIGTERM.
+
+    The signals are handled without raising KeyboardInterrupt, which could
+    otherwise arrive in the middle of a commit and roll back the pending batch
+    of records. Instead, Python writes to its signal wakeup fd as soon as a
+    signal arrives, even while the main thread blocks on the record queue, and
+    a helper thread waiting on that fd asks the processor to shut down. run()
+    then returns once it has stored the records queued so far.
+
+    Must be called from the main thread.
+
+    Args:
+        processor: The RecordProcessor running on the main thread.
+    """
+    read_fd, write_fd = os.pipe()
+    fcntl.fcntl(write_fd, fcntl.F_SETFL,
+                fcntl.fcntl(write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def log_signal(signum, unused_frame):
+        logger.info('Caught signal %d. Exiting.', signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, log_signal)
+    signal.set_wakeup_fd(write_fd)
+
+    def wait_for_signal():
+        os.read(read_fd, 1)
+        processor.shutdown()
+
+    t = threading.Thread(target=wait_for_signal)
+    t.setDaemon(True)
+    t.start()
+
+
+def run_replay(args):
+    """Replays the records of an existing database through the pipeline.
+
+    Streams the database's records through the record queue, the pump
+    manager's watering check and MQTT publishing into a record processor that
+    stores them and their rollups in a separate output database, then prints
+    the replay's statistics.
+
+    Args:
+        args: Command-line arguments of the GreenPiThumb.
+
+    Raises:
+        ValueError if the database to replay does not exist or is also the
+        output database.
+        db_store.UnsupportedSchemaError if the database to replay has a newer
+        schema version than this code supports.
+    """
+    if not os.path.exists(args.replay):
+        raise ValueError('No database to replay at %s' % args.replay)
+    if os.path.abspath(args.replay) == os.path.abspath(args.replay_output):
+        raise ValueError('Cannot replay a database into itself: %s' %
+                         args.replay)
+    logger.info('replaying "%s" into "%s"', args.replay, args.replay_output)
+    # Replayed records wait for room in the queue rather than being dropped or
+    # merged, so that every stage sees all of them.
+    record_queue = bounded_queue.RecordQueue(args.record_queue_size,
+                                             bounded_queue.BLOCK)
+    replay_mqtt_client = make_mqtt_client(args.mqtt_broker)
+    replayer = replay.Replayer(
+        record_queue, replay_mqtt_client, args.moisture_threshold,
+        datetime.timedelta(hours=args.pump_interval),
+        sleep_windows.parse(args.sleep_window), args.replay_speed)
+    results = {}
+
+    with replay.current_schema_db(args.replay) as replay_db_path, \
+            contextlib.closing(
+                db_store.open_or_create_db(
+                    args.replay_output)) as output_connection, \
+            contextlib.closing(
+                db_store.ReadConnectionPool(replay_db_path, 1)) as replay_pool:
+        processor = create_record_processor(
+            output_connection, record_queue, args.db_batch_size,
+            datetime.timedelta(seconds=args.db_batch_seconds))
+
+        def replay_history():
+            try:
+                with replay_pool.connection() as replay_connection:
+                    results.update(
+                        replayer.replay(replay.iter_history(replay_connection)))
+            finally:
+                processor.shutdown()
+
+        start_time = clock.monotonic()
+        replay_thread = threading.Thread(target=replay_history)
+        replay_thread.setDaemon(True)
+        replay_thread.start()
+        processor.run()
+        replay_thread.join()
+        pipeline_seconds = clock.monotonic() - start_time
+
+    if results:
+        results['pipeline_seconds'] = pipeline_seconds
+        results['pipeline_records_per_second'] = (
+            results['records'] / pipeline_seconds if pipeline_seconds else None)
+        for name, value in sorted(results.items()):
+            print '%-28s %s' % (name, value)
 
 
 def main(args):
     configure_logging(args.verbose)
+    if args.replay:
+        try:
+            run_replay(args)
+        except db_store.UnsupportedSchemaError as e:
+            sys.exit(str(e))
+        return
     logger.info('starting greenpithumb')
     wiring_config = read_wiring_config(args.config_file)
-    record_queue = Queue.Queue()
-    raspberry_pi_io = pi_io.IO(GPIO)
-    adc = make_adc(wiring_config)
+    record_queue = bounded_queue.RecordQueue(args.record_queue_size,
+                                             args.record_queue_overflow)
+    hardware_backend = hardware.make_backend(args.hardware, wiring_config,
+                                             clock.Clock())
+    raspberry_pi_io = pi_io.IO(hardware_backend.gpio())
+    adc = make_adc(hardware_backend, args.adc_samples, args.adc_reduction)
     local_soil_moisture_sensor = make_soil_moisture_sensor(
         adc, raspberry_pi_io, wiring_config)
     local_drain_sensor = make_drain_sensor(
         adc, raspberry_pi_io, wiring_config)
     local_temperature_sensor, local_humidity_sensor = make_dht22_sensors(
-        wiring_config)
+        hardware_backend)
     local_water_level_sensor = make_water_level_sensor(
         raspberry_pi_io, wiring_config)        
     local_light_sensor = make_light_sensor(adc, wiring_config)
-    camera_manager = make_camera_manager(args.camera_rotation, args.image_path,
-                                         local_light_sensor)
-    mqtt_client = make_mqtt_client(args.mqtt_broker)
+    latest_readings = reading_cache.ReadingCache(clock.Clock())
+    camera_manager = make_camera_manager(hardware_backend,
+                                         args.camera_rotation, args.image_path,
+                                         local_light_sensor, latest_readings)
+    mqtt_client = make_mqtt_client(args.mqtt_broker, args.hardware)
 
     with contextlib.closing(
-            db_store.open_or_create_db(args.db_file)) as db_connection:
-        record_processor = create_record_processor(db_connection, record_queue)
+            db_store.open_or_create_db(
+                args.db_file, wal=args.db_wal)) as db_connection, \
+            contextlib.closing(
+                db_store.ReadConnectionPool(
+                    args.db_file, args.db_read_connections)) as db_read_pool:
+        poll_engine = poller.PollEngine(clock.Clock())
+        stats_registry = poll_stats.PollStats()
+        sensor_read_executor = read_executor.ReadExecutor(clock.Clock())
+        record_processor = create_record_processor(
+            db_connection, record_queue, args.db_batch_size,
+            datetime.timedelta(seconds=args.db_batch_seconds))
         pump_manager = make_pump_manager(
             args.moisture_threshold,
             sleep_windows.parse(args.sleep_window),
             raspberry_pi_io,
             wiring_config,
             args.pump_amount,
-            db_connection,
+            db_read_pool,
             datetime.timedelta(hours=args.pump_interval),
-            local_water_level_sensor)
+            local_water_level_sensor,
+            latest_readings,
+            poll_engine,
+            sensor_read_executor)
         pollers = make_sensor_pollers(
             datetime.timedelta(minutes=args.poll_interval),
+            (datetime.timedelta(minutes=args.max_poll_interval)
+             if args.adaptive_polling else None),
             datetime.timedelta(minutes=args.photo_interval),
             record_queue,
             mqtt_client,
@@ -271,18 +525,39 @@ def main(args):
             local_drain_sensor,
             local_light_sensor,
             camera_manager,
-            pump_manager)
+            pump_manager,
+            latest_readings,
+            poll_engine,
+            stats_registry,
+            sensor_read_executor)
+        pollers.append(
+            make_retention_poller(
+                datetime.timedelta(minutes=args.retention_interval),
+                retention.parse(args.retention),
+                record_queue,
+                mqtt_client,
+                poll_engine,
+                stats_registry))
+        pollers.append(
+            make_poll_stats_poller(
+                datetime.timedelta(minutes=args.stats_interval),
+                stats_registry,
+                record_queue,
+                mqtt_client,
+                poll_engine))
         try:
             for current_poller in pollers:
                 current_poller.start_polling_async()
-            while True:
-                if not record_processor.try_process_next_record():
-                    time.sleep(0.1)
+            shutdown_processor_on_signals(record_processor)
+            record_processor.run()
         except KeyboardInterrupt:
             logger.info('Caught keyboard interrupt. Exiting.')
         finally:
             for current_poller in pollers:
                 current_poller.close()
+            poll_engine.stop()
+            sensor_read_executor.close()
+            record_processor.flush()
             raspberry_pi_io.close()
 
 
@@ -302,6 +577,17 @@ if __name__ == '__main__':
         type=float,
         help='Number of minutes between each sensor poll',
         default=15)
+    parser.add_argument(
+        '--adaptive_polling',
+        action='store_true',
+        help=('Poll each sensor less often while its readings are stable, '
+              'backing off from --poll_interval up to --max_poll_interval'))
+    parser.add_argument(
+        '--max_poll_interval',
+        type=float,
+        help=('Maximum number of minutes between sensor polls when adaptive '
+              'polling is enabled'),
+        default=(8 * 15))
     parser.add_argument(
         '-t',
         '--photo_interval',
@@ -319,6 +605,12 @@ if __name__ == '__main__':
         '--config_file',
         help='Wiring config file',
         default='greenpithumb/wiring_config.ini')
+    parser.add_argument(
+        '--hardware',
+        choices=hardware.BACKENDS,
+        help=('Hardware to run on: the sensors, pump and camera of a '
+              'Raspberry Pi, or a simulation of them that runs on any machine'),
+        default=hardware.PI)
     parser.add_argument(
         '-s',
         '--sleep_window',
@@ -339,6 +631,74 @@ if __name__ == '__main__':
         '--db_file',
         help='Location to store GreenPiThumb database file',
         default='greenpithumb/greenpithumb.db')
+    parser.add_argument(
+        '--db_batch_size',
+        type=int,
+        help=('Number of pending records at which to commit a batch of '
+              'records to the database'),
+        default=record_processor.DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        '--db_batch_seconds',
+        type=float,
+        help=('Maximum number of seconds a record waits before its batch is '
+              'committed to the database'),
+        default=record_processor.DEFAULT_BATCH_MAX_AGE.total_seconds())
+    parser.add_argument(
+        '--adc_samples',
+        type=int,
+        help=('Number of samples to take of an ADC channel on each read of a '
+              'light, soil moisture or drain sensor'),
+        default=5)
+    parser.add_argument(
+        '--adc_reduction',
+        choices=adc_thread_safe.REDUCTIONS,
+        help='How to combine the samples of an ADC channel into one reading',
+        default=adc_thread_safe.MEDIAN)
+    parser.add_argument(
+        '--record_queue_size',
+        type=int,
+        help=('Maximum number of records waiting to be written to the '
+              'database'),
+        default=bounded_queue.DEFAULT_MAX_RECORDS)
+    parser.add_argument(
+        '--record_queue_overflow',
+        choices=bounded_queue.OVERFLOW_POLICIES,
+        help=('What to do with new records when the record queue is full: '
+              'block pollers until there is room, drop the oldest sensor '
+              'reading, or coalesce readings from the same sensor. Only '
+              'block keeps every reading'),
+        default=bounded_queue.BLOCK)
+    parser.add_argument(
+        '--db_wal',
+        action='store_true',
+        help=('Use write-ahead logging for the database so that readers, such '
+              'as the web frontend, do not block inserts and vice versa'))
+    parser.add_argument(
+        '--db_read_connections',
+        type=int,
+        help=('Number of read-only database connections to keep open for '
+              'threads other than the record writer'),
+        default=2)
+    parser.add_argument(
+        '--retention',
+        action='append',
+        type=str,
+        default=[],
+        help=('Number of days to keep records in a database table before '
+              'purging them, in the form "table=days", such as '
+              '"temperature=30". Tables without an override keep records for '
+              '%d days' % db_store.DEFAULT_RETENTION['temperature'].days))
+    parser.add_argument(
+        '--retention_interval',
+        type=float,
+        help='Number of minutes between purges of expired database records',
+        default=60)
+    parser.add_argument(
+        '--stats_interval',
+        type=float,
+        help=('Number of minutes between reports of poll timing statistics to '
+              'the log and mqtt'),
+        default=60)
     parser.add_argument(
         '-m',
         '--moisture_threshold',
@@ -351,6 +711,24 @@ if __name__ == '__main__':
         type=int,
         choices=(0, 90, 180, 270),
         help='Specifies the amount to rotate the camera\'s image.')
+    parser.add_argument(
+        '--replay',
+        help=('Instead of polling the hardware, replay the records of this '
+              'database through the record queue, watering check, MQTT '
+              'publishing and rollups, then report throughput. The watering '
+              'check uses --moisture_threshold, --pump_interval and '
+              '--sleep_window, so replays show how other settings would have '
+              'behaved'))
+    parser.add_argument(
+        '--replay_speed',
+        type=float,
+        help=('Multiple of real time at which to replay records. By default, '
+              'records are replayed as fast as the pipeline accepts them'))
+    parser.add_argument(
+        '--replay_output',
+        help=('Database in which to store replayed records and their rollups. '
+              'By default, they are kept in memory'),
+        default=':memory:')
     parser.add_argument(
         '--mqtt_broker',
         type=str,
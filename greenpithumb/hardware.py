@@ -0,0 +1,79 @@
+# Names of the hardware backends.
+#
+# The GreenPiThumb's real sensors, pump and camera on a Raspberry Pi.
+PI = 'pi'
+# Simulated hardware that runs on any machine.
+SIM = 'sim'
+BACKENDS = (PI, SIM)
+
+
+class RaspberryPiHardware(object):
+    """The GreenPiThumb's real hardware.
+
+    The hardware libraries are imported on first use, so that importing this
+    module does not require them.
+    """
+
+    def __init__(self, wiring_config):
+        """Creates a new RaspberryPiHardware instance.
+
+        Args:
+            wiring_config: Wiring configuration for the GreenPiThumb.
+        """
+        self._wiring_config = wiring_config
+
+    def gpio(self):
+        """Returns the Raspberry Pi GPIO module."""
+        import RPi.GPIO as GPIO
+        return GPIO
+
+    def adc(self):
+        """Returns the raw MCP3008 ADC."""
+        import Adafruit_MCP3008
+        # The MCP3008 spec and Adafruit library use different naming for the
+        # Raspberry Pi GPIO pins, so we translate as follows:
+        # * CLK -> CLK
+        # * CS/SHDN -> CS
+        # * DOUT -> MISO
+        # * DIN -> MOSI
+        gpio_pins = self._wiring_config.gpio_pins
+        return Adafruit_MCP3008.MCP3008(
+            clk=gpio_pins.mcp3008_clk,
+            cs=gpio_pins.mcp3008_cs_shdn,
+            miso=gpio_pins.mcp3008_dout,
+            mosi=gpio_pins.mcp3008_din)
+
+    def dht22_read_func(self):
+        """Returns a function that reads (humidity, temperature) from the DHT22.
+        """
+        import Adafruit_DHT
+        pin = self._wiring_config.gpio_pins.dht22
+        return lambda: Adafruit_DHT.read_retry(Adafruit_DHT.DHT22, pin)
+
+    def camera(self):
+        """Returns the Raspberry Pi camera."""
+        import picamera
+        return picamera.PiCamera(resolution=picamera.PiCamera.MAX_RESOLUTION)
+
+
+def make_backend(name, wiring_config, clock):
+    """Creates a hardware backend.
+
+    Args:
+        name: Name of the backend, one of BACKENDS.
+        wiring_config: Wiring configuration for the GreenPiThumb.
+        clock: A clock interface, used by simulated hardware.
+
+    Returns:
+        An object with gpio(), adc(), dht22_read_func() and camera() methods
+        that return the GreenPiThumb's hardware interfaces.
+
+    Raises:
+        ValueError if name is not a known backend.
+    """
+    if name == PI:
+        return RaspberryPiHardware(wiring_config)
+    elif name == SIM:
+        import hardware_sim
+        return hardware_sim.SimulatedHardware(wiring_config, clock)
+    raise ValueError('Unknown hardware backend: %s' % name)
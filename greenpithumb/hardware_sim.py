@@ -0,0 +1,458 @@
+import datetime
+import logging
+import math
+import random
+import threading
+import time
+
+import drain_sensor
+import water_level_sensor
+
+logger = logging.getLogger(__name__)
+
+# Largest raw value of the 10-bit MCP3008.
+ADC_MAX_VALUE = 1023
+# Standard deviation of the noise on simulated ADC readings, in raw counts.
+ADC_NOISE = 2.0
+
+# Volume at which the water level sensor reads 100%, in liters.
+RESERVOIR_CAPACITY_LITERS = 25.0
+# Flow of the simulated pump, matching the calibration of the real one.
+PUMP_RATE_ML_PER_SEC = 1433.0 / 60.0
+# Rise in soil moisture (in % VWC) per liter of water pumped into the pot.
+MOISTURE_PER_LITER = 8.0
+# Soil moisture (in % VWC) above which water drains out of the pot.
+SATURATION_MOISTURE = 40.0
+# How long water keeps reaching the drain sensor once the soil is saturated.
+DRAIN_DURATION = datetime.timedelta(minutes=10)
+# Fall in soil moisture (in % VWC) per day at full sunlight. Soil dries at a
+# third of this rate in the dark.
+DRYING_RATE = 6.0
+
+# Number of attempts and delay between attempts of Adafruit_DHT.read_retry.
+DHT22_RETRIES = 15
+DHT22_RETRY_DELAY_SECONDS = 2.0
+# Mean duration of a single DHT22 read attempt.
+DEFAULT_DHT22_LATENCY_SECONDS = 0.25
+# Probability that a single DHT22 read attempt fails.
+DEFAULT_DHT22_FAILURE_RATE = 0.1
+
+# Time between the end of a sonar trigger pulse and the start of its echo.
+_SONAR_ECHO_DELAY_SECONDS = 0.0002
+# Speed of sound, in cm/s.
+_SPEED_OF_SOUND = 34000.0
+
+# Duration of a simulated photo capture.
+DEFAULT_CAPTURE_SECONDS = 1.0
+# Minimal JPEG stream (start of image, comment, end of image) written by the
+# fake camera.
+_PLACEHOLDER_JPEG = ('\xff\xd8\xff\xfe\x00\x1egreenpithumb simulated image'
+                     '\xff\xd9')
+
+
+def _diurnal(now, peak_hour):
+    """Returns a value in [-1, 1] that peaks daily at the given UTC hour."""
+    hour = now.hour + now.minute / 60.0 + now.second / 3600.0
+    return math.cos(2.0 * math.pi * (hour - peak_hour) / 24.0)
+
+
+class PlantModel(object):
+    """Physical model of the plant's pot, its reservoir and their surroundings.
+
+    The soil dries over time, faster in daylight, and the pump moves water
+    from the reservoir into the soil. Light, temperature and humidity follow a
+    daily cycle. The model advances to the clock's current time whenever it is
+    read. This class is thread-safe.
+    """
+
+    def __init__(self,
+                 clock,
+                 reservoir_liters=20.0,
+                 soil_moisture=30.0,
+                 rng=None):
+        """Creates a new PlantModel instance.
+
+        Args:
+            clock: A clock interface.
+            reservoir_liters: Initial volume of water in the reservoir.
+            soil_moisture: Initial soil moisture, in % VWC.
+            rng: A random.Random for sensor noise.
+        """
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._reservoir_liters = reservoir_liters
+        self._soil_moisture = soil_moisture
+        self._pump_on = False
+        self._draining_until = None
+        self._last_update = clock.now()
+
+    def _advance(self):
+        """Advances the model to the current time. Caller must hold the lock.
+
+        Returns:
+            The current time.
+        """
+        now = self._clock.now()
+        elapsed_seconds = max(0.0, (now - self._last_update).total_seconds())
+        self._last_update = now
+        drying_rate = DRYING_RATE * (1.0 + 2.0 * self._daylight(now)) / 3.0
+        self._soil_moisture = max(
+            0.0, self._soil_moisture - drying_rate * elapsed_seconds / 86400.0)
+        if self._pump_on:
+            pumped_liters = min(self._reservoir_liters,
+                                PUMP_RATE_ML_PER_SEC * elapsed_seconds / 1000.0)
+            self._reservoir_liters -= pumped_liters
+            self._soil_moisture += pumped_liters * MOISTURE_PER_LITER
+        if self._soil_moisture > SATURATION_MOISTURE:
+            self._soil_moisture = SATURATION_MOISTURE
+            self._draining_until = now + DRAIN_DURATION
+        return now
+
+    def _daylight(self, now):
+        """Returns the fraction of full sunlight at the given time."""
+        return max(0.0, _diurnal(now, peak_hour=12))
+
+    def set_pump(self, pump_on):
+        """Turns the pump on or off."""
+        with self._lock:
+            self._advance()
+            self._pump_on = pump_on
+
+    def reservoir_liters(self):
+        with self._lock:
+            self._advance()
+            return self._reservoir_liters
+
+    def soil_moisture(self):
+        """Returns the soil moisture, in % VWC."""
+        with self._lock:
+            self._advance()
+            return self._soil_moisture
+
+    def water_draining(self):
+        """Returns True if water is draining from the pot."""
+        with self._lock:
+            now = self._advance()
+            return (self._draining_until is not None and
+                    now < self._draining_until)
+
+    def light(self):
+        """Returns the light level, as a percentage of full sunlight."""
+        with self._lock:
+            now = self._advance()
+            return 100.0 * self._daylight(now)
+
+    def temperature(self):
+        """Returns the air temperature, in degrees Celsius."""
+        with self._lock:
+            now = self._advance()
+        noise = self._rng.gauss(0.0, 0.2)
+        return 21.0 + 4.0 * _diurnal(now, peak_hour=15) + noise
+
+    def humidity(self):
+        """Returns the relative humidity, in %."""
+        with self._lock:
+            now = self._advance()
+        noise = self._rng.gauss(0.0, 0.5)
+        return 55.0 - 10.0 * _diurnal(now, peak_hour=15) + noise
+
+
+class SimulatedGpio(object):
+    """Stand-in for the RPi.GPIO module.
+
+    Devices attach to pins as listeners, which see every value written to an
+    output pin, and as sources, which supply the values read from an input
+    pin. An input pin without a source reads the last value written to it.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._output_listeners = {}
+        self._input_sources = {}
+
+    def add_output_listener(self, pin, listener):
+        """Calls listener(value) with each value written to a pin."""
+        self._output_listeners[pin] = listener
+
+    def add_input_source(self, pin, source):
+        """Reads a pin's input values from source()."""
+        self._input_sources[pin] = source
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        pass
+
+    def output(self, pin, value):
+        value = self.HIGH if value else self.LOW
+        with self._lock:
+            self._values[pin] = value
+        if pin in self._output_listeners:
+            self._output_listeners[pin](value)
+
+    def input(self, pin):
+        if pin in self._input_sources:
+            return self._input_sources[pin]()
+        with self._lock:
+            return self._values.get(pin, self.LOW)
+
+    def cleanup(self):
+        with self._lock:
+            self._values.clear()
+
+
+class SonarEchoModel(object):
+    """Simulates the echo of a Parallax Ping))) sonar.
+
+    The falling edge of a trigger pulse starts an echo pulse whose length is
+    the round trip time of sound to the water's surface. Echoes are timed in
+    real time, since the sonar driver times them with time.time().
+    """
+
+    def __init__(self, distance_func):
+        """Creates a new SonarEchoModel instance.
+
+        Args:
+            distance_func: Function that returns the distance to the water's
+                surface, in cm.
+        """
+        self._distance_func = distance_func
+        self._lock = threading.Lock()
+        self._triggered = False
+        self._echo_start = None
+        self._echo_end = None
+
+    def trigger(self, value):
+        """Handles a value written to the sonar's pin."""
+        with self._lock:
+            if value:
+                self._triggered = True
+                return
+            if not self._triggered:
+                return
+            self._triggered = False
+            distance = (self._distance_func() +
+                        water_level_sensor.DISTANCE_CORRECTION_FACTOR)
+            round_trip = 2.0 * distance / _SPEED_OF_SOUND
+            self._echo_start = time.time() + _SONAR_ECHO_DELAY_SECONDS
+            self._echo_end = self._echo_start + round_trip
+
+    def echo(self):
+        """Returns the value read from the sonar's pin."""
+        with self._lock:
+            if self._echo_start is None:
+                return 0
+            now = time.time()
+            return 1 if self._echo_start <= now < self._echo_end else 0
+
+
+def _sonar_distance(reservoir_liters):
+    """Returns the sonar distance at which the sensor reads a volume."""
+    fill = reservoir_liters / RESERVOIR_CAPACITY_LITERS
+    return water_level_sensor.RESERVOIR_EMPTY - fill * (
+        water_level_sensor.RESERVOIR_EMPTY - water_level_sensor.RESERVOIR_FULL)
+
+
+def _vh400_voltage(soil_moisture):
+    """Returns the VH400 output voltage for a soil moisture, in % VWC.
+
+    Inverts the piecewise linear curve of
+    vegetronix_vh400.SoilMoistureSensor.calc_vwc.
+    """
+    # calc_vwc halves the VWC of the sensor's curve.
+    vwc = 2.0 * max(0.0, soil_moisture)
+    if vwc < 10.0:
+        return (vwc + 1.0) / 10.0
+    elif vwc < 15.0:
+        return (vwc + 17.5) / 25.0
+    elif vwc < 40.0:
+        return (vwc + 47.5) / 48.08
+    elif vwc < 50.0:
+        return (vwc + 7.89) / 26.32
+    return (vwc + 87.5) / 62.5
+
+
+def _drain_sensor_value(water_draining):
+    """Returns the raw ADC value of the drain sensor."""
+    return drain_sensor.WET_VALUE if water_draining else drain_sensor.DRY_VALUE
+
+
+class SimulatedAdc(object):
+    """Stand-in for an MCP3008 ADC.
+
+    Each channel's value comes from a script of raw values, while it lasts,
+    and otherwise from a function such as a reading of the plant model. Raw
+    values get a little noise and are clamped to the ADC's range.
+    """
+
+    def __init__(self, channel_funcs, rng=None):
+        """Creates a new SimulatedAdc instance.
+
+        Args:
+            channel_funcs: A dict mapping channel numbers to functions that
+                return the channel's raw value.
+            rng: A random.Random for noise.
+        """
+        self._channel_funcs = channel_funcs
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._scripts = {}
+
+    def script(self, channel, raw_values):
+        """Makes a channel return the given raw values, in order.
+
+        Args:
+            channel: The ADC channel.
+            raw_values: An iterable of raw values. Once it is exhausted, the
+                channel goes back to its function.
+        """
+        with self._lock:
+            self._scripts[channel] = iter(raw_values)
+
+    def read_adc(self, channel):
+        with self._lock:
+            script = self._scripts.get(channel)
+            if script is not None:
+                try:
+                    return next(script)
+                except StopIteration:
+                    del self._scripts[channel]
+        channel_func = self._channel_funcs.get(channel)
+        if channel_func is None:
+            return 0
+        raw_value = channel_func() + self._rng.gauss(0.0, ADC_NOISE)
+        return int(round(min(ADC_MAX_VALUE, max(0, raw_value))))
+
+
+class SimulatedDht22(object):
+    """Simulates Adafruit_DHT.read_retry on a DHT22.
+
+    Each read attempt takes a random time and fails with a fixed probability.
+    Failed attempts are retried after a delay, as read_retry does, and a read
+    whose every attempt fails returns (None, None).
+    """
+
+    def __init__(self,
+                 model,
+                 clock,
+                 latency_seconds=DEFAULT_DHT22_LATENCY_SECONDS,
+                 failure_rate=DEFAULT_DHT22_FAILURE_RATE,
+                 rng=None):
+        """Creates a new SimulatedDht22 instance.
+
+        Args:
+            model: The PlantModel whose air the sensor measures.
+            clock: A clock interface used to wait out read latencies.
+            latency_seconds: Mean duration of a read attempt.
+            failure_rate: Probability that a read attempt fails.
+            rng: A random.Random for latencies and failures.
+        """
+        self._model = model
+        self._clock = clock
+        self._latency_seconds = latency_seconds
+        self._failure_rate = failure_rate
+        self._rng = rng or random.Random()
+
+    def read(self):
+        """Returns a (humidity, temperature) tuple."""
+        for attempt in range(DHT22_RETRIES):
+            self._clock.wait(
+                self._rng.uniform(0.5, 1.5) * self._latency_seconds)
+            if self._rng.random() >= self._failure_rate:
+                return self._model.humidity(), self._model.temperature()
+            if attempt < DHT22_RETRIES - 1:
+                self._clock.wait(DHT22_RETRY_DELAY_SECONDS)
+        logger.warning('simulated DHT22 read failed %d times', DHT22_RETRIES)
+        return None, None
+
+
+class FakeCamera(object):
+    """Stand-in for picamera.PiCamera that saves placeholder images."""
+
+    MAX_RESOLUTION = (2592, 1944)
+
+    def __init__(self, clock, capture_seconds=DEFAULT_CAPTURE_SECONDS):
+        """Creates a new FakeCamera instance.
+
+        Args:
+            clock: A clock interface used to wait out captures.
+            capture_seconds: Duration of a capture.
+        """
+        self._clock = clock
+        self._capture_seconds = capture_seconds
+        self.resolution = self.MAX_RESOLUTION
+        self.rotation = 0
+        self.closed = False
+
+    def capture(self, output, resize=None):
+        self._clock.wait(self._capture_seconds)
+        with open(output, 'wb') as image_file:
+            image_file.write(_PLACEHOLDER_JPEG)
+
+    def close(self):
+        self.closed = True
+
+
+class SimulatedHardware(object):
+    """Hardware backend that simulates the GreenPiThumb on any machine.
+
+    Wires simulated devices to the pins and ADC channels of the wiring config:
+    the pump pin drives the plant model's pump, the sonar pin echoes the
+    reservoir level, and the ADC channels read the model's soil moisture,
+    drainage and light.
+    """
+
+    def __init__(self, wiring_config, clock, rng=None):
+        """Creates a new SimulatedHardware instance.
+
+        Args:
+            wiring_config: Wiring configuration for the GreenPiThumb.
+            clock: A clock interface that drives the simulation.
+            rng: A random.Random for noise, latencies and failures.
+        """
+        self._clock = clock
+        rng = rng or random.Random()
+        self.model = PlantModel(clock, rng=rng)
+
+        gpio_pins = wiring_config.gpio_pins
+        self._gpio = SimulatedGpio()
+        self._gpio.add_output_listener(
+            gpio_pins.pump,
+            lambda value: self.model.set_pump(value == SimulatedGpio.HIGH))
+        sonar = SonarEchoModel(
+            lambda: _sonar_distance(self.model.reservoir_liters()))
+        self._gpio.add_output_listener(gpio_pins.sonar, sonar.trigger)
+        self._gpio.add_input_source(gpio_pins.sonar, sonar.echo)
+
+        adc_channels = wiring_config.adc_channels
+        self._adc = SimulatedAdc({
+            adc_channels.soil_moisture_sensor:
+            lambda: 100.0 * _vh400_voltage(self.model.soil_moisture()),
+            adc_channels.drain_sensor:
+            lambda: _drain_sensor_value(self.model.water_draining()),
+            adc_channels.light_sensor:
+            lambda: ADC_MAX_VALUE * self.model.light() / 100.0,
+        }, rng)
+        self._dht22 = SimulatedDht22(self.model, clock, rng=rng)
+
+    def gpio(self):
+        return self._gpio
+
+    def adc(self):
+        return self._adc
+
+    def dht22_read_func(self):
+        return self._dht22.read
+
+    def camera(self):
+        return FakeCamera(self._clock)
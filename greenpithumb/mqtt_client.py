@@ -1,6 +1,5 @@
 import logging
 import threading
-import paho.mqtt.client as mqtt
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +19,10 @@ class MqttClient(object):
         Args:
             mqtt_broker: IP address of the mqtt broker.
         """
+        # Imported here, so that code that only needs NullMqttClient runs
+        # without paho installed.
+        import paho.mqtt.client as mqtt
+
         self._mqtt_broker = mqtt_broker
 
         self._mqtt_client = mqtt.Client()
@@ -27,7 +30,7 @@ class MqttClient(object):
         self._mqtt_client.on_message = self.on_message
         self._mqtt_client.connect(self._mqtt_broker, 1883, 60)
         self._mqtt_client.loop_start()
-        
+
         self._lock = threading.Lock()
 
 
@@ -39,8 +42,15 @@ class MqttClient(object):
 
     def on_message(self, client, userdata, msg):
         logger.info('Received mqtt message: %s', msg.payload)
-        
+
     def publish(self, topic, payload):
         logger.info('Publish %s: %s', topic, payload)
         self._mqtt_client.publish(topic, payload)
-        
+
+
+
+class NullMqttClient(object):
+    """Stand-in for MqttClient that discards what it publishes."""
+
+    def publish(self, topic, payload):
+        logger.debug('Discard %s: %s', topic, payload)
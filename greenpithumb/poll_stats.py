@@ -0,0 +1,179 @@
+import bisect
+import threading
+
+# Upper bounds (in seconds) of the latency histogram buckets. Latencies above
+# the last bound fall into an overflow bucket.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   300.0)
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies with fixed bucket boundaries."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Creates a new LatencyHistogram instance.
+
+        Args:
+            buckets: Ascending upper bounds of the buckets, in seconds.
+        """
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        """Adds a latency to the histogram."""
+        self._counts[bisect.bisect_left(self._buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Estimates a percentile of the latencies.
+
+        Args:
+            percent: The percentile to estimate, between 0 and 100.
+
+        Returns:
+            The upper bound of the bucket that contains the percentile, or the
+            maximum latency if it falls in the overflow bucket. Returns 0.0 if
+            the histogram is empty.
+        """
+        if not self.count:
+            return 0.0
+        target = percent / 100.0 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= target:
+                if index < len(self._buckets):
+                    return min(self._buckets[index], self.maximum)
+                break
+        return self.maximum
+
+    def bucket_counts(self):
+        """Returns a list of (upper bound, count) pairs for each bucket.
+
+        The overflow bucket's upper bound is None.
+        """
+        return zip(list(self._buckets) + [None], self._counts)
+
+
+class WorkerStats(object):
+    """Timing statistics for one poll worker. This class is thread-safe."""
+
+    def __init__(self, name):
+        """Creates a new WorkerStats instance.
+
+        Args:
+            name: Name of the poll worker.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self._start_delay = LatencyHistogram()
+        self._polls = 0
+        self._failures = 0
+        self._timeouts = 0
+        self._quarantined_polls = 0
+        self._missed_deadlines = 0
+        self._skipped_ticks = 0
+        self._hardware_seconds = 0.0
+        self._publish_seconds = 0.0
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+
+    def record_poll(self,
+                    start_delay,
+                    latency,
+                    publish_seconds,
+                    skipped_ticks,
+                    failed,
+                    queue_depth,
+                    timed_out=False,
+                    quarantined=False):
+        """Records the timing of a single poll.
+
+        Args:
+            start_delay: Seconds between the scheduled poll time and the start
+                of the poll.
+            latency: Seconds the poll took.
+            publish_seconds: Seconds of the poll spent publishing results to
+                MQTT and the record queue. The rest is counted as time spent
+                in hardware calls.
+            skipped_ticks: Number of scheduled polls that were skipped because
+                this poll ran past them.
+            failed: True if the poll raised an exception.
+            queue_depth: Number of records in the record queue after the poll.
+            timed_out: True if a sensor read in the poll missed its deadline.
+            quarantined: True if the poll was skipped because its sensor is
+                quarantined.
+        """
+        with self._lock:
+            self._polls += 1
+            self._latency.add(latency)
+            self._start_delay.add(start_delay)
+            self._publish_seconds += publish_seconds
+            self._hardware_seconds += max(0.0, latency - publish_seconds)
+            if skipped_ticks:
+                self._missed_deadlines += 1
+                self._skipped_ticks += skipped_ticks
+            if failed:
+                self._failures += 1
+            if timed_out:
+                self._timeouts += 1
+            if quarantined:
+                self._quarantined_polls += 1
+            self._queue_depth = queue_depth
+            self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+
+    def snapshot(self):
+        """Returns the current statistics as a dict."""
+        with self._lock:
+            return {
+                'polls': self._polls,
+                'failures': self._failures,
+                'timeouts': self._timeouts,
+                'quarantined_polls': self._quarantined_polls,
+                'missed_deadlines': self._missed_deadlines,
+                'skipped_ticks': self._skipped_ticks,
+                'latency_mean': self._latency.mean(),
+                'latency_p50': self._latency.percentile(50),
+                'latency_p99': self._latency.percentile(99),
+                'latency_max': self._latency.maximum,
+                'start_delay_mean': self._start_delay.mean(),
+                'start_delay_max': self._start_delay.maximum,
+                'hardware_seconds': self._hardware_seconds,
+                'publish_seconds': self._publish_seconds,
+                'queue_depth': self._queue_depth,
+                'max_queue_depth': self._max_queue_depth,
+            }
+
+
+class PollStats(object):
+    """Registry of the statistics of every poll worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._worker_stats = []
+
+    def register(self, worker_stats):
+        """Adds a worker's statistics to the registry.
+
+        Args:
+            worker_stats: The WorkerStats to add.
+        """
+        with self._lock:
+            self._worker_stats.append(worker_stats)
+
+    def snapshot(self):
+        """Returns a dict mapping each worker's name to its statistics."""
+        with self._lock:
+            worker_stats = list(self._worker_stats)
+        return {stats.name: stats.snapshot() for stats in worker_stats}
@@ -1,72 +1,123 @@
 import datetime
+import heapq
+import itertools
+import json
 import logging
+import Queue
 import threading
 import time
 import pytz
+import bounded_queue
+import clock
 import db_store
+import poll_stats
+import read_executor
+import reading_cache
 
 logger = logging.getLogger(__name__)
 
 _SECONDS_PER_MINUTE = 60
-# Number of seconds to idle between checks for whether a poller needs to poll or
-# a poller needs to stop (note that this is NOT the total time a poller sleeps
-# between polls).
-_IDLE_SECONDS = 0.5
-
-
-# Wait some time so that the time sensitive sensor reading do 
-# not take place with the other sensor readings.
-TEMPERATURE_POLL_DELAY   =  0.0
-HUMIDITY_POLL_DELAY      =  5.0
-WATER_LEVEL_POLL_DELAY   = 10.0
-LIGHT_POLL_DELAY         = 15.0
-SOIL_WATERING_POLL_DELAY = 20.0
-CAMERA_POLL_DELAY        = 25.0
+# Number of threads on which the poll engine runs polls. Polls that are due at
+# the same time and do not share a resource run in parallel up to this limit.
+DEFAULT_DISPATCH_THREADS = 3
+# Maximum number of seconds the poll engine waits on shutdown for running polls
+# to finish.
+_STOP_GRACE_SECONDS = 1.0
+
+# Shared hardware that poll workers use. The poll engine never runs two polls
+# that use the same resource at the same time.
+RESOURCE_DHT22 = 'dht22'
+RESOURCE_SONAR = 'sonar'
+RESOURCE_ADC = 'mcp3008'
+RESOURCE_CAMERA = 'camera'
+# Held by reads whose accuracy depends on precise software timing (the DHT22
+# and sonar protocols), so that they do not compete with each other for the
+# CPU.
+RESOURCE_TIMING = 'timing'
 
 class SensorPollerFactory(object):
     """Factory for creating sensor poller objects."""
 
-    def __init__(self, make_scheduler_func, record_queue, mqtt_client):
+    def __init__(self,
+                 make_scheduler_func,
+                 record_queue,
+                 mqtt_client,
+                 latest_readings=None,
+                 poll_engine=None,
+                 stats_registry=None,
+                 sensor_read_executor=None):
         """Create a new SensorPollerFactory instance.
 
         Args:
             make_scheduler_func: A function for creating a polling scheduler.
             record_queue: Queue on which to place database records.
+            latest_readings: If not None, a ReadingCache in which pollers
+                store every reading they take.
+            poll_engine: PollEngine that runs the pollers' polls. If None, the
+                factory's pollers share a new PollEngine.
+            stats_registry: If not None, a PollStats registry to which each
+                poller's timing statistics are added.
+            sensor_read_executor: If not None, a ReadExecutor on which
+                pollers read their sensors, giving up on reads that hang.
         """
         self._make_scheduler_func = make_scheduler_func
         self._record_queue = record_queue
         self._mqtt_client = mqtt_client
+        self._latest_readings = latest_readings
+        self._poll_engine = poll_engine or PollEngine(clock.Clock())
+        self._stats_registry = stats_registry
+        self._sensor_read_executor = sensor_read_executor
+
+    def _make_poller(self, poll_worker):
+        if self._stats_registry:
+            self._stats_registry.register(poll_worker.stats)
+        return _SensorPoller(poll_worker, self._poll_engine)
 
     def create_temperature_poller(self, temperature_sensor):
-        return _SensorPoller(
+        return self._make_poller(
             _TemperaturePollWorker(self._make_scheduler_func(),
-                                   self._record_queue, self._mqtt_client, temperature_sensor))
+                                   self._record_queue, self._mqtt_client, temperature_sensor, self._latest_readings,
+                                   self._sensor_read_executor))
 
     def create_humidity_poller(self, humidity_sensor):
-        return _SensorPoller(
+        return self._make_poller(
             _HumidityPollWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
-                                humidity_sensor))
+                                humidity_sensor, self._latest_readings,
+                                self._sensor_read_executor))
                                 
     def create_water_level_poller(self, water_level_sensor):
-        return _SensorPoller(
+        return self._make_poller(
             _WaterLevelPollWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
-                                water_level_sensor))                                
+                                water_level_sensor, self._latest_readings,
+                                self._sensor_read_executor))
 
     def create_light_poller(self, light_sensor):
-        return _SensorPoller(
+        return self._make_poller(
             _LightPollWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
-                             light_sensor))
+                             light_sensor, self._latest_readings,
+                             self._sensor_read_executor))
 
     def create_soil_watering_poller(self, soil_moisture_sensor, drain_sensor, pump_manager):
-        return _SensorPoller(
+        return self._make_poller(
             _SoilWateringPollWorker(self._make_scheduler_func(
-            ), self._record_queue, self._mqtt_client, soil_moisture_sensor, drain_sensor, pump_manager))
+            ), self._record_queue, self._mqtt_client, soil_moisture_sensor, drain_sensor, pump_manager, self._latest_readings,
+            self._sensor_read_executor))
 
     def create_camera_poller(self, camera_manager):
-        return _SensorPoller(
+        return self._make_poller(
             _CameraPollWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
                               camera_manager))
 
+    def create_poll_stats_poller(self, stats_registry):
+        return self._make_poller(
+            _PollStatsWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
+                             stats_registry))
+
+    def create_retention_poller(self, retention_compactor):
+        return self._make_poller(
+            _RetentionPollWorker(self._make_scheduler_func(), self._record_queue, self._mqtt_client,
+                                 retention_compactor))
+
 
 def _datetime_to_unix_time(dt):
     """Converts a datetime into seconds since UNIX epoch."""
@@ -74,6 +125,12 @@ def _datetime_to_unix_time(dt):
     return int((dt - unix_epoch).total_seconds())
 
 
+def _datetime_to_unix_seconds(dt):
+    """Converts a datetime into fractional seconds since UNIX epoch."""
+    unix_epoch = datetime.datetime(year=1970, month=1, day=1, tzinfo=pytz.utc)
+    return (dt - unix_epoch).total_seconds()
+
+
 def _unix_time_to_datetime(unix_time):
     """Converts a UNIX timestamp to a UTC datetime."""
     return datetime.datetime.fromtimestamp(unix_time, tz=pytz.utc)
@@ -110,22 +167,45 @@ class Scheduler(object):
     def _next_poll_time_unix(self):
         """Calculates time of next poll in UNIX time.
 
-        Calculates time of next poll so that it is a multiple of
-        self._poll_interval. If the next multiple is the same as the last poll
-        time, returns a poll time that is the current time + one poll interval.
+        Calculates time of next poll so that it is a multiple of the poll
+        interval. If the next multiple is the same as the last poll time,
+        returns a poll time that is the current time + one poll interval.
 
         Returns:
             UNIX time of next scheduled poll.
         """
-        next_poll_time_unix = _round_up_to_multiple(
-            self._unix_now(), int(self._poll_interval.total_seconds()))
+        interval_seconds = int(self.poll_interval().total_seconds())
+        next_poll_time_unix = _round_up_to_multiple(self._unix_now(),
+                                                    interval_seconds)
         if self._last_poll_time and (
                 next_poll_time_unix == _datetime_to_unix_time(
                     self._last_poll_time)):
-            next_poll_time_unix += int(self._poll_interval.total_seconds())
+            next_poll_time_unix += interval_seconds
 
         return next_poll_time_unix
 
+    def poll_interval(self):
+        """Returns the current poll interval, as a timedelta."""
+        return self._poll_interval
+
+    def record_reading(self, value):
+        """Reports the sensor reading taken at the last poll.
+
+        The fixed-interval scheduler ignores readings.
+
+        Args:
+            value: The sensor reading.
+        """
+        pass
+
+    def next_poll_time(self):
+        """Returns the time of the next scheduled poll, as a datetime."""
+        return _unix_time_to_datetime(self._next_poll_time_unix())
+
+    def set_last_poll_time(self, poll_time):
+        """Records that the poll scheduled for poll_time has started."""
+        self._last_poll_time = poll_time
+
     def wait_until_poll_time(self, timeout):
         """Waits until the next poll time.
 
@@ -152,6 +232,64 @@ class Scheduler(object):
         return self._last_poll_time
 
 
+class AdaptiveScheduler(Scheduler):
+    """Scheduler that polls less often while a sensor's readings are stable.
+
+    Each reading that is within a tolerance of the previous one doubles the
+    poll interval, up to a maximum. A reading that moves further than the
+    tolerance drops the interval back to the minimum. Polls stay aligned to
+    multiples of the current interval.
+    """
+
+    def __init__(self,
+                 clock,
+                 min_poll_interval,
+                 max_poll_interval,
+                 tolerance,
+                 fast_polling_func=None):
+        """Creates a new AdaptiveScheduler instance.
+
+        Args:
+            clock: A clock interface.
+            min_poll_interval: A timedelta of the shortest interval between
+                polls, used while readings are changing.
+            max_poll_interval: A timedelta of the longest interval between
+                polls, used while readings are stable. Should be a power-of-two
+                multiple of min_poll_interval.
+            tolerance: The largest change between consecutive readings that
+                still counts as stable.
+            fast_polling_func: If not None, a function that returns True while
+                the sensor should be polled at the minimum interval regardless
+                of its readings, such as during a pump event.
+
+        Raises:
+            ValueError if max_poll_interval is shorter than min_poll_interval.
+        """
+        if max_poll_interval < min_poll_interval:
+            raise ValueError(
+                'Maximum poll interval cannot be shorter than the minimum')
+        super(AdaptiveScheduler, self).__init__(clock, min_poll_interval)
+        self._min_poll_interval = min_poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._tolerance = tolerance
+        self._fast_polling_func = fast_polling_func
+        self._last_reading = None
+
+    def poll_interval(self):
+        if self._fast_polling_func and self._fast_polling_func():
+            return self._min_poll_interval
+        return self._poll_interval
+
+    def record_reading(self, value):
+        if (self._last_reading is not None and
+                abs(value - self._last_reading) <= self._tolerance):
+            self._poll_interval = min(self._poll_interval * 2,
+                                      self._max_poll_interval)
+        else:
+            self._poll_interval = self._min_poll_interval
+        self._last_reading = value
+
+
 class _SensorPollWorkerBase(object):
     """Base class for sensor poll worker.
 
@@ -159,7 +297,19 @@ class _SensorPollWorkerBase(object):
     background polling thread.
     """
 
-    def __init__(self, scheduler, record_queue, mqtt_client, sensor):
+    # Resources the worker uses while polling.
+    resources = frozenset()
+    # Number of seconds a single sensor read may take before it is abandoned
+    # when reads run on a ReadExecutor.
+    read_timeout = 10.0
+
+    def __init__(self,
+                 scheduler,
+                 record_queue,
+                 mqtt_client,
+                 sensor,
+                 latest_readings=None,
+                 sensor_read_executor=None):
         """Create a new _SensorPollWorkerBase instance
 
         Args:
@@ -167,78 +317,171 @@ class _SensorPollWorkerBase(object):
             record_queue: Queue on which to place database records.
             sensor: A sensor to poll for status. The particular type of sensor
                 will vary depending on the poll worker subclass.
+            latest_readings: If not None, a ReadingCache in which to store
+                every reading taken.
+            sensor_read_executor: If not None, a ReadExecutor on which to
+                read the sensor. Otherwise sensor reads run on the polling
+                thread with no timeout.
         """
         self._scheduler = scheduler
         self._record_queue = record_queue
         self._mqtt_client = mqtt_client
         self._sensor = sensor        
-        self._stopped = threading.Event()
+        self._latest_readings = latest_readings
+        self._sensor_read_executor = sensor_read_executor
+        self.stats = poll_stats.WorkerStats(self.__class__.__name__)
+        # Seconds the current poll has spent publishing its results.
+        self._publish_seconds = 0.0
 
-    def _is_stopped(self):
-        return self._stopped.is_set()
+    def _cache_reading(self, sensor, value):
+        """Stores a reading in the latest reading cache, if there is one."""
+        if self._latest_readings:
+            self._latest_readings.update(sensor, value)
 
-    def _wait_until_poll_time_or_stop(self):
-        while not self._is_stopped():
-            if self._scheduler.wait_until_poll_time(_IDLE_SECONDS):
-                return
+    def _read(self, read_func, *args, **kwargs):
+        """Reads the sensor, on the read executor if there is one.
 
-    def poll(self):
-        """Polls at a fixed interval until caller calls stop()."""
-        logger.info('polling starting for %s', self.__class__.__name__)
-        while True:
-            self._wait_until_poll_time_or_stop()
-            if self._is_stopped():
-                break
+        Args:
+            read_func: Function that reads the sensor.
+            args: Positional arguments for read_func.
+            sensor: Keyword-only. Name of the sensor that read_func reads, for
+                workers that read more than one sensor. The executor tracks
+                the timeouts and quarantine of each named sensor separately.
+
+        Raises:
+            ReadTimeoutError if the read exceeds the worker's read timeout.
+            QuarantinedError if the sensor is quarantined after hanging.
+        """
+        sensor = kwargs.pop('sensor', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % kwargs.keys())
+        if not self._sensor_read_executor:
+            return read_func(*args)
+        name = self.stats.name
+        if sensor:
+            name = '%s.%s' % (name, sensor)
+        return self._sensor_read_executor.read(name, self.read_timeout,
+                                               read_func, *args)
+
+    def _publish(self, topic, payload):
+        """Publishes a value over MQTT, timing the publish."""
+        start_time = time.time()
+        self._mqtt_client.publish(topic, payload)
+        self._publish_seconds += time.time() - start_time
+
+    def _put_record(self, record):
+        """Places a record on the record queue, timing the put."""
+        start_time = time.time()
+        self._record_queue.put(record)
+        self._publish_seconds += time.time() - start_time
+
+    def next_poll_time(self):
+        """Returns the next scheduled poll time, as a datetime."""
+        return self._scheduler.next_poll_time()
+
+    def poll(self, poll_time):
+        """Performs the poll scheduled for a given time and records its timing.
+
+        Args:
+            poll_time: The scheduled time of the poll, as a datetime.
+        """
+        start_time = time.time()
+        self._scheduler.set_last_poll_time(poll_time)
+        self._publish_seconds = 0.0
+        failed = True
+        timed_out = False
+        quarantined = False
+        try:
             self._poll_once()
-        logger.info('polling terminating for %s', self.__class__.__name__)
+            failed = False
+        except read_executor.ReadTimeoutError as e:
+            logger.warning('%s poll abandoned: %s', self.stats.name, e)
+            timed_out = True
+        except read_executor.QuarantinedError as e:
+            logger.info('%s poll skipped: %s', self.stats.name, e)
+            failed = False
+            quarantined = True
+        finally:
+            end_time = time.time()
+            scheduled_time = _datetime_to_unix_seconds(poll_time)
+            interval_seconds = self._scheduler.poll_interval().total_seconds()
+            self.stats.record_poll(
+                start_delay=max(0.0, start_time - scheduled_time),
+                latency=end_time - start_time,
+                publish_seconds=self._publish_seconds,
+                skipped_ticks=int(
+                    max(0.0, end_time - scheduled_time) // interval_seconds),
+                failed=failed,
+                queue_depth=self._record_queue.qsize(),
+                timed_out=timed_out,
+                quarantined=quarantined)
 
     def stop(self):
-        """End worker polling."""
-        self._stopped.set()
+        """Releases any resources the worker holds once polling ends."""
+        pass
 
 
 class _TemperaturePollWorker(_SensorPollWorkerBase):
     """Polls a temperature sensor and stores the readings."""
 
+    resources = frozenset([RESOURCE_DHT22, RESOURCE_TIMING])
+    # Adafruit_DHT.read_retry retries for up to 30 seconds.
+    read_timeout = 45.0
+
     def _poll_once(self):
         """Polls for current temperature and queues DB record."""
-        time.sleep(TEMPERATURE_POLL_DELAY)   # Apply poll delay
-        temperature = self._sensor.temperature()
-        self._record_queue.put(db_store.TemperatureRecord(self._scheduler.last_poll_time(), temperature))
-        self._mqtt_client.publish("greenpi/temperature", temperature)
+        temperature = self._read(self._sensor.temperature)
+        self._cache_reading(reading_cache.TEMPERATURE, temperature)
+        self._scheduler.record_reading(temperature)
+        self._put_record(db_store.TemperatureRecord(self._scheduler.last_poll_time(), temperature))
+        self._publish("greenpi/temperature", temperature)
 
 
 class _HumidityPollWorker(_SensorPollWorkerBase):
     """Polls a humidity sensor and stores the readings."""
 
+    resources = frozenset([RESOURCE_DHT22, RESOURCE_TIMING])
+    # Adafruit_DHT.read_retry retries for up to 30 seconds.
+    read_timeout = 45.0
+
     def _poll_once(self):
         """Polls for and stores current relative humidity."""
-        time.sleep(HUMIDITY_POLL_DELAY)   # Apply poll delay
-        humidity = self._sensor.humidity()
-        self._record_queue.put(db_store.HumidityRecord(self._scheduler.last_poll_time(), humidity))
-        self._mqtt_client.publish("greenpi/humidity", humidity)
+        humidity = self._read(self._sensor.humidity)
+        self._cache_reading(reading_cache.HUMIDITY, humidity)
+        self._scheduler.record_reading(humidity)
+        self._put_record(db_store.HumidityRecord(self._scheduler.last_poll_time(), humidity))
+        self._publish("greenpi/humidity", humidity)
             
             
 class _WaterLevelPollWorker(_SensorPollWorkerBase):
     """Polls a water level sensor and stores the readings."""
 
+    resources = frozenset([RESOURCE_SONAR, RESOURCE_TIMING])
+    # Each of the sonar's two echo loops gives up after one second.
+    read_timeout = 5.0
+
     def _poll_once(self):
         """Polls for and stores current water level."""
-        time.sleep(WATER_LEVEL_POLL_DELAY)   # Apply poll delay
-        water_level = self._sensor.water_level()
+        water_level = self._read(self._sensor.water_level)
         if(water_level >= 0.0):
-            self._record_queue.put(db_store.WaterLevelRecord(self._scheduler.last_poll_time(), water_level))            
-            self._mqtt_client.publish("greenpi/water_level", water_level)
+            self._cache_reading(reading_cache.WATER_LEVEL, water_level)
+            self._scheduler.record_reading(water_level)
+            self._put_record(db_store.WaterLevelRecord(self._scheduler.last_poll_time(), water_level))            
+            self._publish("greenpi/water_level", water_level)
 
 
 class _LightPollWorker(_SensorPollWorkerBase):
     """Polls a light sensor and stores the readings."""
 
+    resources = frozenset([RESOURCE_ADC])
+    read_timeout = 2.0
+
     def _poll_once(self):
-        time.sleep(LIGHT_POLL_DELAY)   # Apply poll delay
-        light = self._sensor.light()
-        self._record_queue.put(db_store.LightRecord(self._scheduler.last_poll_time(), light))
-        self._mqtt_client.publish("greenpi/light", light)
+        light = self._read(self._sensor.light)
+        self._cache_reading(reading_cache.LIGHT, light)
+        self._scheduler.record_reading(light)
+        self._put_record(db_store.LightRecord(self._scheduler.last_poll_time(), light))
+        self._publish("greenpi/light", light)
 
 
 class _SoilWateringPollWorker(_SensorPollWorkerBase):
@@ -246,10 +489,17 @@ class _SoilWateringPollWorker(_SensorPollWorkerBase):
 
     Polls soil moisture sensor and oversees a water pump based to add water when
     the moisture drops too low. Records both soil moisture and watering events.
+    A watering runs on the poll engine alongside later polls, and each burst of
+    the pump is recorded as its own watering event.
     """
 
+    resources = frozenset([RESOURCE_ADC])
+    # Each sensor powers up for 2 seconds before its ADC channel is sampled,
+    # which leaves plenty of time for the samples of an oversampled read.
+    read_timeout = 10.0
+
     def __init__(self, scheduler, record_queue, mqtt_client, soil_moisture_sensor, drain_sensor, 
-                 pump_manager):
+                 pump_manager, latest_readings=None, sensor_read_executor=None):
         """Creates a new SoilWateringPoller object.
 
         Args:
@@ -260,9 +510,14 @@ class _SoilWateringPollWorker(_SensorPollWorkerBase):
                 level.
             drain_sensor: An interface for reading the drain sensor.
             pump_manager: An interface to manage a water pump.
+            latest_readings: If not None, a ReadingCache in which to store
+                every reading taken.
+            sensor_read_executor: If not None, a ReadExecutor on which to
+                read the soil moisture and drain sensors.
         """
         super(_SoilWateringPollWorker, self).__init__(scheduler, record_queue, mqtt_client,
-                                                      soil_moisture_sensor)
+                                                      soil_moisture_sensor, latest_readings,
+                                                      sensor_read_executor)
         self._drain_sensor = drain_sensor
         self._pump_manager = pump_manager
 
@@ -271,31 +526,60 @@ class _SoilWateringPollWorker(_SensorPollWorkerBase):
 
         Checks soil moisture levels and records the current level. Using the
         current soil moisture level, checks if the pump needs to run, and if so,
-        runs the pump and records the watering event.
+        starts a pump event without waiting for it to finish.
+        """
+        soil_moisture = self._read(
+            self._sensor.soil_moisture, sensor=reading_cache.SOIL_MOISTURE)
+        water_present = self._read(
+            self._drain_sensor.water_present,
+            sensor=reading_cache.WATER_PRESENT)
+        self._cache_reading(reading_cache.SOIL_MOISTURE, soil_moisture)
+        self._cache_reading(reading_cache.WATER_PRESENT, water_present)
+        self._scheduler.record_reading(soil_moisture)
+        self._put_record(db_store.SoilMoistureRecord(self._scheduler.last_poll_time(), soil_moisture, water_present))
+        self._publish("greenpi/soil_moisture", soil_moisture)
+        self._publish("greenpi/water_present", water_present)
+        self._pump_manager.start_pump_event_if_needed(
+            soil_moisture, self._drain_sensor, self._record_pump_progress)
+
+    def _record_pump_progress(self, progress):
+        """Records and publishes the progress of a pump event.
+
+        Pump events usually progress between polls, so this bypasses the poll
+        timing of _put_record and _publish.
+
+        Args:
+            progress: A PumpProgress of the pump event.
         """
-        time.sleep(SOIL_WATERING_POLL_DELAY)   # Apply poll delay
-        soil_moisture = self._sensor.soil_moisture()
-        water_present = self._drain_sensor.water_present()
-        self._record_queue.put(db_store.SoilMoistureRecord(self._scheduler.last_poll_time(), soil_moisture, water_present))
-        self._mqtt_client.publish("greenpi/soil_moisture", soil_moisture)
-        self._mqtt_client.publish("greenpi/water_present", water_present)
-        ml_pumped = self._pump_manager.pump_if_needed(soil_moisture, self._drain_sensor)
-        if ml_pumped > 0:
-            self._record_queue.put(db_store.WateringEventRecord(self._scheduler.last_poll_time(), ml_pumped))
-            self._mqtt_client.publish("greenpi/ml_pumped", ml_pumped)
+        self._mqtt_client.publish("greenpi/pump_state", progress.state)
+        if progress.ml_pumped > 0:
+            self._record_queue.put(
+                db_store.WateringEventRecord(progress.timestamp,
+                                             progress.ml_pumped))
+            self._mqtt_client.publish("greenpi/ml_pumped",
+                                      progress.total_ml_pumped)
+
+    def stop(self):
+        """End worker polling and stop any pump event it started."""
+        self._pump_manager.cancel_pump_event()
+        super(_SoilWateringPollWorker, self).stop()
 
 
 class _CameraPollWorker(_SensorPollWorkerBase):
     """Captures and stores pictures pictures from a camera."""
 
+    # Only the camera is held for the capture, which can take seconds. The
+    # light check may read the light sensor, but that single read is
+    # serialized with other ADC reads by the thread-safe ADC.
+    resources = frozenset([RESOURCE_CAMERA])
+
     def _poll_once(self):
         """Captures and stores an image."""
-        time.sleep(CAMERA_POLL_DELAY)   # Apply poll delay
         if self._sensor.sufficient_light():
             self._sensor.save_photo_full_res()
             self._sensor.save_photo_reduced_res()
             #self._sensor.create_timelapse()
-            self._mqtt_client.publish("greenpi/image_taken", "TRIGGER")
+            self._publish("greenpi/image_taken", "TRIGGER")
 
     def stop(self):
         """End worker polling and close camera."""
@@ -303,23 +587,336 @@ class _CameraPollWorker(_SensorPollWorkerBase):
         super(_CameraPollWorker, self).stop()
 
 
+class _RetentionPollWorker(_SensorPollWorkerBase):
+    """Periodically purges expired records from the database."""
+
+    def _poll_once(self):
+        """Purges expired records and reports the result."""
+        result = self._sensor.compact()
+        self._publish("greenpi/retention_rows_deleted",
+                      sum(result.rows_deleted.values()))
+        self._publish("greenpi/retention_seconds", result.elapsed_seconds)
+
+
+class _PollStatsWorker(_SensorPollWorkerBase):
+    """Periodically reports the timing statistics of every poll worker.
+
+    Also reports the depth and overflow counters of the record queue if it is
+    a bounded RecordQueue.
+    """
+
+    def _poll_once(self):
+        """Logs and publishes a snapshot of the poll statistics."""
+        for name, stats in sorted(self._sensor.snapshot().items()):
+            logger.info(
+                '%s: %d polls (%d failed, %d timed out, %d quarantined), '
+                'latency p50=%.2fs p99=%.2fs max=%.2fs, %d missed deadlines (%d ticks skipped), '
+                'hardware=%.1fs publish=%.1fs, queue depth=%d (max %d)', name,
+                stats['polls'], stats['failures'], stats['timeouts'],
+                stats['quarantined_polls'], stats['latency_p50'],
+                stats['latency_p99'], stats['latency_max'],
+                stats['missed_deadlines'], stats['skipped_ticks'],
+                stats['hardware_seconds'], stats['publish_seconds'],
+                stats['queue_depth'], stats['max_queue_depth'])
+            self._publish("greenpi/poll_stats/" + name, json.dumps(stats))
+        if isinstance(self._record_queue, bounded_queue.RecordQueue):
+            queue_stats = self._record_queue.stats()
+            logger.info(
+                'record queue: depth=%d (max %d) of %d, %d dropped, '
+                '%d coalesced, %d blocked puts', queue_stats['depth'],
+                queue_stats['max_depth'], queue_stats['capacity'],
+                queue_stats['dropped'], queue_stats['coalesced'],
+                queue_stats['blocked_puts'])
+            self._publish("greenpi/record_queue", json.dumps(queue_stats))
+
+
+class TimerHandle(object):
+    """A callback scheduled to run once on a PollEngine."""
+
+    def __init__(self, callback, args, resources, urgent=False):
+        self._callback = callback
+        self._args = args
+        self.resources = resources
+        self.urgent = urgent
+        self._cancelled = False
+
+    def cancel(self):
+        """Prevents the callback from running if it has not started yet."""
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def run(self):
+        self._callback(*self._args)
+
+    def __str__(self):
+        return getattr(self._callback, '__name__', repr(self._callback))
+
+
+class _ScheduledPoll(object):
+    """A poll of a worker at a scheduled poll time."""
+
+    urgent = False
+
+    def __init__(self, engine, worker, poll_time):
+        self._engine = engine
+        self.worker = worker
+        self.poll_time = poll_time
+        self.resources = worker.resources
+
+    def cancelled(self):
+        return not self._engine.is_scheduled(self.worker)
+
+    def run(self):
+        self.worker.poll(self.poll_time)
+
+    def __str__(self):
+        return self.worker.__class__.__name__
+
+
+class PollEngine(object):
+    """Event loop that runs poll workers and timed callbacks.
+
+    The engine keeps a heap of upcoming jobs: each scheduled worker's next poll
+    and any callbacks registered with call_later(). A single scheduling thread
+    sleeps until the earliest job is due. Due jobs are handed to a small pool
+    of dispatch threads, which act as a bounded executor for blocking hardware
+    calls, so a slow job does not hold up jobs that are due at the same time.
+    A worker's next poll is scheduled once its current poll finishes, so a
+    worker never has two polls running at once. One more dispatch thread is
+    reserved for urgent callbacks, such as turning off the pump, which must
+    run on time even while slow jobs occupy every other dispatch thread.
+
+    Due jobs that use a resource held by a running job wait until it is
+    released and then start immediately, in the order they became due. Jobs
+    that share no resources run in parallel.
+    """
+
+    def __init__(self, utc_clock, dispatch_threads=DEFAULT_DISPATCH_THREADS):
+        """Creates a new PollEngine instance.
+
+        Args:
+            utc_clock: A clock interface.
+            dispatch_threads: Number of threads on which to run jobs.
+        """
+        self._clock = utc_clock
+        self._dispatch_thread_count = dispatch_threads
+        self._lock = threading.RLock()
+        # Set to wake the scheduling thread when the heap changes or the
+        # engine stops.
+        self._wakeup = clock.WakeupEvent()
+        # Heap of (unix time, sequence number, job) tuples ordered by the time
+        # at which each job is due. The sequence number breaks ties so that
+        # jobs are never compared.
+        self._heap = []
+        self._sequence = itertools.count()
+        self._workers = set()
+        # Jobs that are due but waiting for a resource, in the order they
+        # became due.
+        self._ready = []
+        # Resources used by jobs that have been dispatched.
+        self._busy_resources = set()
+        self._dispatch_queue = Queue.Queue()
+        self._urgent_dispatch_queue = Queue.Queue()
+        self._threads = []
+        self._stopped = False
+
+    def _unix_now(self):
+        return _datetime_to_unix_seconds(self._clock.now())
+
+    def _push(self, due_time, job):
+        """Adds a job to the heap. Caller must hold the lock."""
+        if self._stopped:
+            raise ValueError('Cannot schedule a job on a stopped engine')
+        heapq.heappush(self._heap, (due_time, next(self._sequence), job))
+        self._wakeup.set()
+        if not self._threads:
+            self._start_threads()
+
+    def _push_next_poll(self, worker):
+        """Adds a worker's next poll to the heap. Caller must hold the lock."""
+        poll_time = worker.next_poll_time()
+        self._push(
+            _datetime_to_unix_seconds(poll_time),
+            _ScheduledPoll(self, worker, poll_time))
+
+    def _dispatch_ready(self):
+        """Dispatches every due job whose resources are free.
+
+        A waiting job also holds back later jobs that need any of its
+        resources, so that it is not starved by them. Caller must hold the
+        lock.
+        """
+        waiting = []
+        claimed_resources = set()
+        for job in self._ready:
+            if job.cancelled():
+                continue
+            if job.resources & (self._busy_resources | claimed_resources):
+                claimed_resources.update(job.resources)
+                waiting.append(job)
+                continue
+            self._busy_resources.update(job.resources)
+            if job.urgent:
+                self._urgent_dispatch_queue.put(job)
+            else:
+                self._dispatch_queue.put(job)
+        self._ready = waiting
+
+    def schedule(self, worker):
+        """Starts polling a worker, starting the engine if necessary.
+
+        Args:
+            worker: The poll worker to add.
+        """
+        with self._lock:
+            self._workers.add(worker)
+            self._push_next_poll(worker)
+
+    def unschedule(self, worker):
+        """Stops polling a worker.
+
+        A poll of the worker that is already running is allowed to finish.
+
+        Args:
+            worker: The poll worker to remove.
+        """
+        with self._lock:
+            self._workers.discard(worker)
+
+    def is_scheduled(self, worker):
+        """Returns True if the engine is polling the given worker."""
+        with self._lock:
+            return worker in self._workers
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        """Runs a callback once on the engine after a delay.
+
+        May be called from any thread, including from within a job.
+
+        Args:
+            delay: Number of seconds to wait before running the callback.
+            callback: Function to call.
+            args: Positional arguments for the callback.
+            resources: Keyword-only. Resources the callback uses, which it
+                will not share with any job running at the same time.
+            urgent: Keyword-only. If True, the callback runs on the dispatch
+                thread reserved for urgent callbacks, so slow jobs cannot
+                delay it. Urgent callbacks must return quickly.
+
+        Returns:
+            A TimerHandle that can cancel the callback.
+        """
+        handle = TimerHandle(callback, args,
+                             frozenset(kwargs.pop('resources', ())),
+                             kwargs.pop('urgent', False))
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % kwargs.keys())
+        with self._lock:
+            self._push(self._unix_now() + delay, handle)
+        return handle
+
+    def _start_threads(self):
+        dispatch_queues = ([self._dispatch_queue] * self._dispatch_thread_count
+                           + [self._urgent_dispatch_queue])
+        threads = [threading.Thread(target=self._run_scheduler)]
+        for dispatch_queue in dispatch_queues:
+            threads.append(
+                threading.Thread(
+                    target=self._run_dispatcher, args=(dispatch_queue,)))
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _run_scheduler(self):
+        """Hands each job to the dispatch threads when it is due."""
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                now = self._unix_now()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, job = heapq.heappop(self._heap)
+                    if not job.cancelled():
+                        self._ready.append(job)
+                self._dispatch_ready()
+                next_due_time = self._heap[0][0] if self._heap else None
+                self._wakeup.clear()
+            if next_due_time is None:
+                self._wakeup.wait()
+            else:
+                self._clock.wait_until(
+                    _unix_time_to_datetime(next_due_time), self._wakeup)
+
+    def _run_dispatcher(self, dispatch_queue):
+        """Runs jobs from a dispatch queue until the engine stops."""
+        while True:
+            job = dispatch_queue.get()
+            if job is None:
+                return
+            try:
+                job.run()
+            except Exception:
+                logger.exception('job failed: %s', job)
+            with self._lock:
+                self._busy_resources.difference_update(job.resources)
+                if self._stopped:
+                    continue
+                if isinstance(job, _ScheduledPoll) and not job.cancelled():
+                    self._push_next_poll(job.worker)
+                self._dispatch_ready()
+
+    def stop(self):
+        """Stops polling all workers and cancels pending callbacks.
+
+        Waits briefly for jobs that are already running to finish. Longer
+        jobs, such as a pump run, are left to finish in the background.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._workers.clear()
+            self._heap = []
+            self._ready = []
+            self._wakeup.set()
+            threads, self._threads = self._threads, []
+        if not threads:
+            self._wakeup.close()
+            return
+        for _ in range(self._dispatch_thread_count):
+            self._dispatch_queue.put(None)
+        self._urgent_dispatch_queue.put(None)
+        threads[0].join()
+        self._wakeup.close()
+        deadline = time.time() + _STOP_GRACE_SECONDS
+        for dispatch_thread in threads[1:]:
+            dispatch_thread.join(max(0.0, deadline - time.time()))
+
+
 class _SensorPoller(object):
-    """Spawns and manages poll workers in background threads."""
+    """Polls a single worker on a PollEngine."""
 
-    def __init__(self, poll_worker):
+    def __init__(self, poll_worker, poll_engine):
         """Creates a new _SensorPoller object for polling sensors.
 
         Args:
             poll_worker: Worker object that handles the polling work.
+            poll_engine: PollEngine that runs the worker's polls.
         """
         self._worker = poll_worker
+        self._poll_engine = poll_engine
 
     def start_polling_async(self):
-        """Starts a new thread to begin polling."""
-        t = threading.Thread(target=self._worker.poll)
-        t.setDaemon(True)
-        t.start()
+        """Starts polling in the background."""
+        logger.info('polling starting for %s', self._worker.__class__.__name__)
+        self._poll_engine.schedule(self._worker)
 
     def close(self):
         """Stops polling."""
+        self._poll_engine.unschedule(self._worker)
         self._worker.stop()
+        logger.info('polling terminating for %s',
+                    self._worker.__class__.__name__)
@@ -1,6 +1,11 @@
+import collections
+import datetime
 import logging
+import threading
+import clock
 import email_notification
-import time
+import poller
+import reading_cache
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +21,43 @@ INTERVAL_DURATION = 60   # In [s]
 # Send email notification if water level drops below this value [l]
 WATER_LEVEL_THRESHOLD = 5.0
 
+# States of a pump event. An event checks the drain sensor, pumps a burst of
+# INTERVAL_PUMP_AMOUNT and lets it soak for INTERVAL_DURATION, then checks the
+# drain sensor again, until it has pumped the total amount or water drains.
+#
+# No pump event is running.
+IDLE = 'idle'
+# The pump is on.
+PUMPING = 'pumping'
+# The pump is off while the last burst soaks in.
+SOAKING = 'soaking'
+# The drain sensor is being read before the next burst.
+CHECKING_DRAIN = 'checking_drain'
+# The pump event has finished.
+DONE = 'done'
+
+# Progress of a pump event, reported on each change of state. timestamp is a
+# datetime of the change, ml_pumped is the amount of water pumped by a burst
+# that just ended (0 otherwise) and total_ml_pumped is the amount pumped by
+# the event so far.
+PumpProgress = collections.namedtuple(
+    'PumpProgress', ['state', 'timestamp', 'ml_pumped', 'total_ml_pumped'])
+
+# Resources that a pump event's drain checks and low water check use, which
+# they do not share with polls running at the same time.
+_DRAIN_RESOURCES = (poller.RESOURCE_ADC,)
+_WATER_LEVEL_RESOURCES = (poller.RESOURCE_SONAR, poller.RESOURCE_TIMING)
+
+# Name under which the read executor tracks a pump event's drain sensor reads,
+# and the deadline of each read. The sensor powers up for 2 seconds before it
+# is read.
+_DRAIN_SENSOR_NAME = 'PumpManager.water_present'
+_DRAIN_READ_TIMEOUT = 10.0
+
+
+def _send_email(subject, body):
+    email_notification.EmailNotification(subject, body).send()
+
 
 class Pump(object):
     """Wrapper for a Seaflo 12V water pump."""
@@ -31,6 +73,34 @@ class Pump(object):
         self._pi_io = pi_io
         self._clock = clock
         self._pump_pin = pump_pin
+        self._on_since = None
+
+    def seconds_to_pump(self, amount_ml):
+        """Returns how long the pump must run to pump the specified amount."""
+        return amount_ml / _PUMP_RATE_ML_PER_SEC
+
+    def turn_on(self):
+        """Turns the pump on, if it is not on already."""
+        if self._on_since is not None:
+            return
+        logger.info('Turning pump on (with GPIO pin %d)', self._pump_pin)
+        self._pi_io.turn_pin_on(self._pump_pin)
+        self._on_since = self._clock.now()
+
+    def turn_off(self):
+        """Turns the pump off.
+
+        Returns:
+            The amount of water (in ml) pumped since the pump was turned on,
+            judged by how long it ran.
+        """
+        logger.info('Turning pump off (with GPIO pin %d)', self._pump_pin)
+        self._pi_io.turn_pin_off(self._pump_pin)
+        if self._on_since is None:
+            return 0.0
+        run_seconds = (self._clock.now() - self._on_since).total_seconds()
+        self._on_since = None
+        return run_seconds * _PUMP_RATE_ML_PER_SEC
 
     def pump_water(self, amount_ml):
         """Pumps the specified amount of water.
@@ -46,23 +116,55 @@ class Pump(object):
         elif amount_ml < 0.0:
             raise ValueError('Cannot pump a negative amount of water')
         else:
-            logger.info('Turning pump on (with GPIO pin %d)', self._pump_pin)
-            self._pi_io.turn_pin_on(self._pump_pin)
+            self.turn_on()
 
-            wait_time_seconds = amount_ml / _PUMP_RATE_ML_PER_SEC
-            self._clock.wait(wait_time_seconds)
+            # The length of the run sets the dose, so time it on the clock's
+            # monotonic wait rather than a plain sleep.
+            self._clock.wait_until(self._clock.now() + datetime.timedelta(
+                seconds=self.seconds_to_pump(amount_ml)))
 
-            logger.info('Turning pump off (with GPIO pin %d)', self._pump_pin)
-            self._pi_io.turn_pin_off(self._pump_pin)
+            self.turn_off()
             logger.info('Pumped %.f ml of water', amount_ml)
 
         return
 
 
+class _BlockingDriver(object):
+    """Runs the steps of a pump event on the calling thread.
+
+    Has the call_later interface of a PollEngine, but waits out each delay on
+    a clock and then runs the callback before returning.
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        self._clock.wait(delay)
+        callback(*args)
+
+
+class _PumpEvent(object):
+    """State of a single pump event."""
+
+    def __init__(self, drain_sensor, progress_func, driver):
+        self.drain_sensor = drain_sensor
+        self.progress_func = progress_func
+        self.driver = driver
+        self.state = IDLE
+        self.bursts = 0
+        self.ml_pumped = 0.0
+        self.pump_one_more_time = False
+        # PumpProgress to report once the manager's lock is released.
+        self.pending_progress = []
+
+
 class PumpManager(object):
     """Pump Manager manages the water pump."""
 
-    def __init__(self, pump, pump_scheduler, moisture_threshold, total_pump_amount, timer, water_level_sensor):
+    def __init__(self, pump, pump_scheduler, moisture_threshold, total_pump_amount, timer, water_level_sensor,
+                 latest_readings=None, utc_clock=None, send_notification=None,
+                 poll_engine=None, sensor_read_executor=None):
         """Creates a PumpManager object, which manages a water pump.
 
         Args:
@@ -76,6 +178,17 @@ class PumpManager(object):
                 this timer expires, the pump manager runs the pump once,
                 regardless of the moisture level.
             water_level_sensor: Interface to the water level sensor.
+            latest_readings: If not None, a ReadingCache whose recent water
+                level readings are used instead of reading the water level
+                sensor.
+            utc_clock: A clock interface used to wait between pump runs.
+                Defaults to the system clock.
+            send_notification: Function called with the subject and body of
+                a notification to send. Defaults to sending an email.
+            poll_engine: If not None, a PollEngine on which pump events
+                started by start_pump_event_if_needed run their timed steps.
+            sensor_read_executor: If not None, a ReadExecutor on which pump
+                events read the drain sensor.
         """
         self._pump = pump
         self._pump_scheduler = pump_scheduler
@@ -84,12 +197,28 @@ class PumpManager(object):
         self._timer = timer
         self._pump_event_in_progress = False
         self._water_level_sensor = water_level_sensor
-        
-    def pump_event_in_progress():
+        self._latest_readings = latest_readings
+        self._clock = utc_clock or clock.Clock()
+        self._send_notification = send_notification or _send_email
+        self._poll_engine = poll_engine
+        self._sensor_read_executor = sensor_read_executor
+        # Guards the current pump event, whose steps may run on other threads.
+        # Steps never hold it while they read sensors, report progress or
+        # schedule the next step.
+        self._lock = threading.RLock()
+        self._event = None
+
+    def pump_event_in_progress(self):
+        """Returns True while the pump manager is running a pump event."""
         return self._pump_event_in_progress
 
+    def pump_state(self):
+        """Returns the state of the current pump event, or IDLE if none."""
+        with self._lock:
+            return self._event.state if self._event else IDLE
+
     def pump_if_needed(self, moisture, drain_sensor):
-        """Run the water pump if required.
+        """Run the water pump if required, waiting for the pump event to end.
 
         Args:
             moisture: Soil moisture level.
@@ -98,61 +227,228 @@ class PumpManager(object):
         Returns:
             The amount of water pumped, in ml.
         """
-        accumulated_pump_amount = 0
-        i = 0
-        pump_one_more_time = False
-        if self.should_pump(moisture):
-            # Loop until total water amount to be pumped is reached
-            self._pump_event_in_progress = True
-            
-            while(True):
-                # Safety check: Do not pump if water is present
-                if(not drain_sensor.water_present() or pump_one_more_time):
-                    accumulated_pump_amount += INTERVAL_PUMP_AMOUNT
-                    i += 1                 
-                    logger.info("({}.) Pumping {} ml of water ({} ml of {} ml)".format(i, INTERVAL_PUMP_AMOUNT, accumulated_pump_amount, self._total_pump_amount))
-                    
-                    # Turn pump on
-                    self._pump.pump_water(INTERVAL_PUMP_AMOUNT)
-                    
-                    # Check fail conditions
-                    if(accumulated_pump_amount >= self._total_pump_amount):
-                        logger.info("Total pump amount reached, END TASK")
-                        break
-                    if pump_one_more_time:
-                        logger.info("Pumped for one more time, END TASK")
-                        break
-                    
-                    logger.info("Sleep for {} s to allow water to drain and soak".format(INTERVAL_DURATION))
-                    time.sleep(INTERVAL_DURATION)
-                    logger.info("Continue water pump event...")
-                else:
-                    if(accumulated_pump_amount > 0):
-                        logger.info("Water detected by drain sensor during pump task, will pump ONE MORE TIME")
-                        pump_one_more_time = True          
-                    else:
-                        logger.warn("Water detected by drain sensor at the beginning of a pump task, CANCEL TASK")
-                        break
-            
+        with self._lock:
+            if not self.should_pump(moisture):
+                return 0
+            event = self._start_event(drain_sensor, None,
+                                      _BlockingDriver(self._clock))
+        # The blocking driver runs the whole event before this returns.
+        self._schedule_drain_check(event, 0)
+        return event.ml_pumped
+
+    def start_pump_event_if_needed(self, moisture, drain_sensor,
+                                   progress_func=None):
+        """Starts a pump event if required, without waiting for it to end.
+
+        The event's steps run as timed callbacks on the poll engine, so the
+        caller can go on polling while the pump runs and the water soaks in.
+        The pump is turned off on the engine's urgent dispatch thread, so that
+        slow polls cannot delay it. Without a poll engine, the event runs to
+        completion before this returns.
+
+        Args:
+            moisture: Soil moisture level.
+            drain_sensor: Interface to the drain sensor.
+            progress_func: If not None, a function called with a PumpProgress
+                on each change of the event's state. It is called from the
+                thread running the event's steps.
+
+        Returns:
+            True if a pump event started.
+        """
+        with self._lock:
+            if not self.should_pump(moisture):
+                return False
+            event = self._start_event(drain_sensor, progress_func,
+                                      self._poll_engine or
+                                      _BlockingDriver(self._clock))
+        self._schedule_drain_check(event, 0)
+        return True
+
+    def cancel_pump_event(self):
+        """Stops the current pump event, if any, and turns the pump off.
+
+        Steps of the event that are already scheduled do nothing when they
+        run.
+        """
+        with self._lock:
+            event = self._event
+            if event is None:
+                return
+            self._event = None
             self._pump_event_in_progress = False
-            logger.info("==> Pump event complete, total amount pumped {} ml".format(accumulated_pump_amount))
-            self._timer.reset()
-            self.low_water_notification() 
-            
-        return accumulated_pump_amount
+            if event.state == PUMPING:
+                self._pump.turn_off()
+            logger.warn("Pump event cancelled after pumping {} ml".format(
+                event.ml_pumped))
+
+    def _start_event(self, drain_sensor, progress_func, driver):
+        """Makes a new pump event the current one. Caller must hold lock."""
+        self._pump_event_in_progress = True
+        self._event = _PumpEvent(drain_sensor, progress_func, driver)
+        return self._event
+
+    def _set_state(self, event, state, ml_pumped=0):
+        """Moves an event to a new state and queues a report of its progress.
+
+        Caller must hold lock.
+        """
+        event.state = state
+        event.pending_progress.append(
+            PumpProgress(state, self._clock.now(), ml_pumped, event.ml_pumped))
+
+    def _report_progress(self, event):
+        """Reports an event's queued progress. Caller must not hold lock."""
+        with self._lock:
+            progress, event.pending_progress = event.pending_progress, []
+        if event.progress_func:
+            for pump_progress in progress:
+                event.progress_func(pump_progress)
+
+    def _schedule_drain_check(self, event, delay):
+        """Schedules an event's next drain check. Caller must not hold lock,
+        since a blocking driver runs the rest of the event before returning.
+        """
+        event.driver.call_later(
+            delay, self._check_drain, event, resources=_DRAIN_RESOURCES)
+
+    def _schedule_low_water_check(self, event):
+        """Schedules a check of the water level after an event ends."""
+        event.driver.call_later(
+            0, self.low_water_notification, resources=_WATER_LEVEL_RESOURCES)
+
+    def _water_present(self, drain_sensor):
+        """Reads the drain sensor, on the read executor if there is one.
+
+        Returns:
+            Whether water is present, or None if the sensor could not be read.
+        """
+        try:
+            if not self._sensor_read_executor:
+                return drain_sensor.water_present()
+            return self._sensor_read_executor.read(
+                _DRAIN_SENSOR_NAME, _DRAIN_READ_TIMEOUT,
+                drain_sensor.water_present)
+        except Exception:
+            logger.exception('Failed to read drain sensor')
+            return None
+
+    def _check_drain(self, event):
+        """Reads the drain sensor and pumps a burst unless water drained."""
+        with self._lock:
+            if event is not self._event:
+                return
+            self._set_state(event, CHECKING_DRAIN)
+        self._report_progress(event)
+        # Safety check: Do not pump if water is present
+        water_present = self._water_present(event.drain_sensor)
+        with self._lock:
+            if event is not self._event:
+                return
+            if water_present is None:
+                logger.error("Drain sensor could not be read, END TASK")
+                self._finish(event)
+            elif not water_present:
+                self._start_burst(event)
+            elif event.ml_pumped > 0:
+                logger.info("Water detected by drain sensor during pump task, will pump ONE MORE TIME")
+                event.pump_one_more_time = True
+                self._start_burst(event)
+            else:
+                logger.warn("Water detected by drain sensor at the beginning of a pump task, CANCEL TASK")
+                self._finish(event)
+            pumping = event.state == PUMPING
+        self._report_progress(event)
+        if not pumping:
+            self._schedule_low_water_check(event)
+            return
+        try:
+            event.driver.call_later(
+                self._pump.seconds_to_pump(INTERVAL_PUMP_AMOUNT),
+                self._end_burst,
+                event,
+                urgent=True)
+        except:
+            # Never leave the pump running without a way to turn it off.
+            self.cancel_pump_event()
+            raise
+
+    def _start_burst(self, event):
+        """Turns the pump on for one burst. Caller must hold lock."""
+        event.bursts += 1
+        logger.info("({}.) Pumping {} ml of water ({} ml of {} ml)".format(event.bursts, INTERVAL_PUMP_AMOUNT, event.ml_pumped + INTERVAL_PUMP_AMOUNT, self._total_pump_amount))
+        self._pump.turn_on()
+        self._set_state(event, PUMPING)
+
+    def _end_burst(self, event):
+        """Turns the pump off at the end of a burst.
+
+        Runs on the poll engine's urgent dispatch thread, so it only turns the
+        pump off and leaves the rest of the step to _after_burst.
+        """
+        with self._lock:
+            if event is not self._event:
+                return
+            ml_run = self._pump.turn_off()
+        if ml_run > INTERVAL_PUMP_AMOUNT + _PUMP_RATE_ML_PER_SEC:
+            logger.warn("Pump ran over its dose: {:.0f} ml instead of {} ml".format(ml_run, INTERVAL_PUMP_AMOUNT))
+        event.driver.call_later(0, self._after_burst, event)
+
+    def _after_burst(self, event):
+        """Records a burst and either lets the water soak or finishes."""
+        with self._lock:
+            if event is not self._event:
+                return
+            event.ml_pumped += INTERVAL_PUMP_AMOUNT
+
+            # Check fail conditions
+            if event.ml_pumped >= self._total_pump_amount:
+                logger.info("Total pump amount reached, END TASK")
+                self._finish(event, INTERVAL_PUMP_AMOUNT)
+            elif event.pump_one_more_time:
+                logger.info("Pumped for one more time, END TASK")
+                self._finish(event, INTERVAL_PUMP_AMOUNT)
+            else:
+                logger.info("Soak for {} s to allow water to drain".format(INTERVAL_DURATION))
+                self._set_state(event, SOAKING, INTERVAL_PUMP_AMOUNT)
+            soaking = event.state == SOAKING
+        self._report_progress(event)
+        if soaking:
+            self._schedule_drain_check(event, INTERVAL_DURATION)
+        else:
+            self._schedule_low_water_check(event)
+
+    def _finish(self, event, ml_pumped=0):
+        """Ends a pump event. Caller must hold lock.
+
+        Args:
+            event: The pump event to end.
+            ml_pumped: Amount of water pumped by a burst that just ended.
+        """
+        self._event = None
+        self._pump_event_in_progress = False
+        logger.info("==> Pump event complete, total amount pumped {} ml".format(event.ml_pumped))
+        self._timer.reset()
+        self._set_state(event, DONE, ml_pumped)
 
-    
     def low_water_notification(self):    
         """
         Read water level and check if a notification email should be sent
         """
-        if (self._water_level_sensor.water_level() < WATER_LEVEL_THRESHOLD):
+        water_level = None
+        if self._latest_readings:
+            water_level = self._latest_readings.fresh_value(reading_cache.WATER_LEVEL)
+        if water_level is None:
+            water_level = self._water_level_sensor.water_level()
+        if water_level < 0.0:
+            logger.warn("Failed to read water level, skipping low water check")
+            return
+        if (water_level < WATER_LEVEL_THRESHOLD):
             subject = "GreenPiThumb low water tank level"
             body = "The water tank fill level has dropped below the set alert threshold of {0:0.1f} liters.\n\n".format(WATER_LEVEL_THRESHOLD) + \
-                   "The current fill level is {0:0.1f} liters.".format(self._water_level_sensor._last_reading)
-            logger.info("Low water tank level detected: {0:0.1f} liters (threshold={0:0.1f} liters), sending notification email".format(self._water_level_sensor._last_reading, WATER_LEVEL_THRESHOLD))
-            notifier = email_notification.EmailNotification(subject, body)
-            notifier.send()      
+                   "The current fill level is {0:0.1f} liters.".format(water_level)
+            logger.info("Low water tank level detected: {0:0.1f} liters (threshold={1:0.1f} liters), sending notification email".format(water_level, WATER_LEVEL_THRESHOLD))
+            self._send_notification(subject, body)
 
 
     def should_pump(self, moisture):
@@ -8,8 +8,22 @@ def last_pump_time(watering_event_store):
     Returns:
         Timestamp of most recent pump watering event, as a datetime.
     """
-    watering_history = watering_event_store.get()
-    if len(watering_history) == 0:
+    last_watering_event = watering_event_store.latest()
+    if last_watering_event is None:
         return None
-    watering_history.sort(key=lambda record: record.timestamp)
-    return watering_history[-1].timestamp
+    return last_watering_event.timestamp
+
+
+def water_pumped_since(watering_event_store, start):
+    """Returns the total volume of water pumped since a given time.
+
+    Args:
+        watering_event_store: Database store from which to retrieve watering
+            event history.
+        start: Time (inclusive) from which to total watering events, as a
+            datetime.
+
+    Returns:
+        Volume of water pumped (in mL) since start.
+    """
+    return watering_event_store.total_water_pumped(start=start)
@@ -0,0 +1,245 @@
+import datetime
+import logging
+import Queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of threads on which sensor reads run. A read that hangs keeps its
+# thread busy until it returns, but each sensor has at most one hung read, so
+# this leaves threads free for the other sensors.
+DEFAULT_READ_THREADS = 8
+# Number of consecutive timeouts after which a sensor is quarantined.
+DEFAULT_QUARANTINE_THRESHOLD = 3
+# Length of a sensor's first quarantine. Each consecutive quarantine doubles
+# it, up to DEFAULT_MAX_QUARANTINE.
+DEFAULT_INITIAL_QUARANTINE = datetime.timedelta(minutes=5)
+DEFAULT_MAX_QUARANTINE = datetime.timedelta(hours=4)
+# Maximum number of seconds close() waits for the read threads to exit.
+_CLOSE_GRACE_SECONDS = 1.0
+
+
+class Error(Exception):
+    pass
+
+
+class ReadTimeoutError(Error):
+    pass
+
+
+class QuarantinedError(Error):
+    pass
+
+
+class _ReadTask(object):
+    """A sensor read waiting to run or running on a read thread."""
+
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self._lock = threading.Lock()
+        self._started = False
+        self._abandoned = False
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        with self._lock:
+            if self._abandoned:
+                return
+            self._started = True
+        try:
+            self.result = self._func(*self._args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def abandon(self):
+        """Prevents the read from running if it has not started yet."""
+        with self._lock:
+            self._abandoned = True
+            return not self._started
+
+
+class _SensorHealth(object):
+    """Timeout history of one sensor."""
+
+    def __init__(self, initial_quarantine):
+        self.timeouts = 0
+        self.consecutive_timeouts = 0
+        self.quarantine = initial_quarantine
+        self.quarantined_until = None
+        # A timed out read that is still running on a read thread.
+        self.hung_task = None
+
+
+class ReadExecutor(object):
+    """Runs sensor reads on a bounded pool of threads with deadlines.
+
+    A read that misses its deadline is abandoned: the caller gets a
+    ReadTimeoutError right away and the hung call is left to finish on its
+    read thread, whose result is discarded. While it runs, further reads of
+    the same sensor time out immediately rather than pile up behind it on
+    other threads. A sensor whose reads time out repeatedly is quarantined,
+    and its reads fail fast with QuarantinedError until the quarantine ends.
+    Each consecutive quarantine of a sensor lasts twice as long as the one
+    before it. This class is thread-safe.
+    """
+
+    def __init__(self,
+                 clock,
+                 threads=DEFAULT_READ_THREADS,
+                 quarantine_threshold=DEFAULT_QUARANTINE_THRESHOLD,
+                 initial_quarantine=DEFAULT_INITIAL_QUARANTINE,
+                 max_quarantine=DEFAULT_MAX_QUARANTINE):
+        """Creates a new ReadExecutor instance.
+
+        Args:
+            clock: A clock interface used to time quarantines.
+            threads: Number of threads on which to run reads.
+            quarantine_threshold: Number of consecutive timeouts after which a
+                sensor is quarantined.
+            initial_quarantine: A timedelta of how long a sensor's first
+                quarantine lasts.
+            max_quarantine: A timedelta of the longest quarantine.
+        """
+        self._clock = clock
+        self._thread_count = threads
+        self._quarantine_threshold = quarantine_threshold
+        self._initial_quarantine = initial_quarantine
+        self._max_quarantine = max_quarantine
+        self._lock = threading.Lock()
+        self._health = {}
+        self._task_queue = Queue.Queue()
+        self._threads = []
+
+    def _sensor_health(self, sensor):
+        """Returns a sensor's health record. Caller must hold the lock."""
+        if sensor not in self._health:
+            self._health[sensor] = _SensorHealth(self._initial_quarantine)
+        return self._health[sensor]
+
+    def _start_threads(self):
+        """Starts the read threads. Caller must hold the lock."""
+        for _ in range(self._thread_count):
+            t = threading.Thread(target=self._run_reads)
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _run_reads(self):
+        while True:
+            task = self._task_queue.get()
+            if task is None:
+                return
+            task.run()
+
+    def read(self, sensor, timeout, func, *args):
+        """Calls a sensor read function, giving up if it takes too long.
+
+        Args:
+            sensor: Name of the sensor, used to track its timeouts.
+            timeout: Number of seconds to wait for the read, including any
+                time it waits for a free read thread.
+            func: The function that reads the sensor.
+            args: Positional arguments for func.
+
+        Returns:
+            The value returned by func.
+
+        Raises:
+            ReadTimeoutError if the read did not finish before the deadline.
+            QuarantinedError if the sensor is quarantined.
+            Any exception that func raises.
+        """
+        with self._lock:
+            health = self._sensor_health(sensor)
+            if (health.quarantined_until is not None and
+                    self._clock.now() < health.quarantined_until):
+                raise QuarantinedError('%s is quarantined until %s' %
+                                       (sensor, health.quarantined_until))
+            hung = (health.hung_task is not None and
+                    not health.hung_task.done.is_set())
+            if not hung and not self._threads:
+                self._start_threads()
+        if hung:
+            self._record_timeout(sensor, None)
+            raise ReadTimeoutError(
+                '%s has a previous read still running' % sensor)
+        task = _ReadTask(func, args)
+        self._task_queue.put(task)
+        task.done.wait(timeout)
+        if not task.done.is_set():
+            if task.abandon():
+                logger.warning('%s read never started within %.1f s', sensor,
+                               timeout)
+                task = None
+            self._record_timeout(sensor, task)
+            message = '%s read timed out after %.1f s' % (sensor, timeout)
+            raise ReadTimeoutError(message)
+        with self._lock:
+            health = self._sensor_health(sensor)
+            health.consecutive_timeouts = 0
+            health.quarantine = self._initial_quarantine
+            health.quarantined_until = None
+            health.hung_task = None
+        if task.exc_info:
+            raise task.exc_info[0], task.exc_info[1], task.exc_info[2]
+        return task.result
+
+    def _record_timeout(self, sensor, hung_task):
+        """Counts a timeout against a sensor, quarantining it if necessary.
+
+        Args:
+            sensor: Name of the sensor.
+            hung_task: The timed out read if it is still running, or None.
+        """
+        with self._lock:
+            health = self._sensor_health(sensor)
+            if hung_task:
+                health.hung_task = hung_task
+            health.timeouts += 1
+            health.consecutive_timeouts += 1
+            if health.consecutive_timeouts < self._quarantine_threshold:
+                return
+            health.quarantined_until = self._clock.now() + health.quarantine
+            logger.error('%s timed out %d times in a row, quarantined until %s',
+                         sensor, health.consecutive_timeouts,
+                         health.quarantined_until)
+            health.quarantine = min(health.quarantine * 2, self._max_quarantine)
+
+    def timeouts(self, sensor):
+        """Returns the number of reads of a sensor that have timed out."""
+        with self._lock:
+            return self._sensor_health(sensor).timeouts
+
+    def quarantined_until(self, sensor):
+        """Returns the end of a sensor's current quarantine.
+
+        Returns:
+            A datetime, or None if the sensor is not quarantined.
+        """
+        with self._lock:
+            health = self._sensor_health(sensor)
+            if (health.quarantined_until is None or
+                    self._clock.now() >= health.quarantined_until):
+                return None
+            return health.quarantined_until
+
+    def close(self):
+        """Stops the read threads once their current reads finish.
+
+        Waits briefly for the read threads to exit. Read threads stuck in a
+        hung read are left behind, but they are daemon threads and do not keep
+        the process alive.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._task_queue.put(None)
+        deadline = time.time() + _CLOSE_GRACE_SECONDS
+        for read_thread in threads:
+            read_thread.join(max(0.0, deadline - time.time()))
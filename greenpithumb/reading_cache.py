@@ -0,0 +1,93 @@
+import collections
+import datetime
+import threading
+
+# Names under which poll workers publish their readings.
+TEMPERATURE = 'temperature'
+HUMIDITY = 'humidity'
+WATER_LEVEL = 'water_level'
+LIGHT = 'light'
+SOIL_MOISTURE = 'soil_moisture'
+WATER_PRESENT = 'water_present'
+
+# Maximum age at which a cached reading is used in place of reading the sensor
+# again.
+DEFAULT_MAX_AGE = datetime.timedelta(minutes=5)
+
+# value is the sensor reading. timestamp is the time at which it was cached,
+# as a datetime.
+Reading = collections.namedtuple('Reading', ['value', 'timestamp'])
+
+
+class ReadingCache(object):
+    """Holds the latest reading of each sensor.
+
+    Poll workers store every reading they take so that other components can
+    use a recent value instead of reading the hardware again. All methods are
+    safe to call from multiple threads.
+    """
+
+    def __init__(self, clock):
+        """Creates a new ReadingCache instance.
+
+        Args:
+            clock: A clock interface used to timestamp readings.
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._readings = {}
+
+    def update(self, sensor, value):
+        """Stores the latest reading of a sensor.
+
+        Args:
+            sensor: Name of the sensor that produced the reading.
+            value: The sensor reading.
+        """
+        reading = Reading(value, self._clock.now())
+        with self._lock:
+            self._readings[sensor] = reading
+
+    def get(self, sensor):
+        """Retrieves the latest reading of a sensor.
+
+        Args:
+            sensor: Name of the sensor.
+
+        Returns:
+            The sensor's latest Reading, or None if it has no reading.
+        """
+        with self._lock:
+            return self._readings.get(sensor)
+
+    def age(self, sensor):
+        """Returns how long ago a sensor's latest reading was taken.
+
+        Args:
+            sensor: Name of the sensor.
+
+        Returns:
+            A timedelta, or None if the sensor has no reading.
+        """
+        reading = self.get(sensor)
+        if reading is None:
+            return None
+        return self._clock.now() - reading.timestamp
+
+    def fresh_value(self, sensor, max_age=DEFAULT_MAX_AGE):
+        """Retrieves a sensor's latest value if it is recent enough.
+
+        Args:
+            sensor: Name of the sensor.
+            max_age: A timedelta of the maximum age of a usable reading.
+
+        Returns:
+            The value of the sensor's latest reading, or None if the sensor has
+            no reading or its latest reading is older than max_age.
+        """
+        reading = self.get(sensor)
+        if reading is None:
+            return None
+        if self._clock.now() - reading.timestamp > max_age:
+            return None
+        return reading.value
@@ -1,7 +1,20 @@
+import datetime
 import Queue
+import sys
+import threading
 
+import clock
 import db_store
 
+# Number of pending records at which a batch is committed to the database.
+DEFAULT_BATCH_SIZE = 64
+# Age of the oldest pending record at which a batch is committed to the
+# database.
+DEFAULT_BATCH_MAX_AGE = datetime.timedelta(seconds=2)
+
+# Placed on the record queue to tell run() to stop.
+SHUTDOWN = object()
+
 
 class Error(Exception):
     pass
@@ -11,11 +24,98 @@ class UnsupportedRecordError(Error):
     pass
 
 
+class TaskTimeoutError(Error):
+    pass
+
+
+class DatabaseTask(object):
+    """A function that the record processor runs on its database connection.
+
+    The record processor is the database's only writer. Other threads that
+    need to write to the database place a task on the record queue instead of
+    opening a connection of their own, which would contend with the processor
+    for the database's write lock.
+    """
+
+    def __init__(self, func):
+        """Creates a new DatabaseTask instance.
+
+        Args:
+            func: Function to call with the processor's database connection.
+                It is responsible for committing its own writes.
+        """
+        self._func = func
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self, connection):
+        """Calls the task's function. Called by the record processor."""
+        try:
+            self._result = self._func(connection)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def result(self, timeout=None):
+        """Waits for the record processor to run the task.
+
+        Args:
+            timeout: Maximum number of seconds to wait, or None to wait
+                indefinitely.
+
+        Returns:
+            The value returned by the task's function.
+
+        Raises:
+            TaskTimeoutError if the task did not run within the timeout.
+            Any exception that the task's function raised.
+        """
+        if not self._done.wait(timeout):
+            raise TaskTimeoutError(
+                'Database task did not run within %s s' % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
 class RecordProcessor(object):
     """Stores records from a queue into database stores."""
 
-    def __init__(self, record_queue, soil_moisture_store, light_store,
-                 humidity_store, temperature_store, water_level_store, watering_event_store):
+    def __init__(self,
+                 record_queue,
+                 soil_moisture_store,
+                 light_store,
+                 humidity_store,
+                 temperature_store,
+                 water_level_store,
+                 watering_event_store,
+                 rollup_store=None,
+                 connection=None,
+                 utc_clock=None,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 batch_max_age=DEFAULT_BATCH_MAX_AGE):
+        """Creates a new RecordProcessor instance.
+
+        Args:
+            record_queue: Queue from which to read records.
+            soil_moisture_store: Store for soil moisture records.
+            light_store: Store for light records.
+            humidity_store: Store for humidity records.
+            temperature_store: Store for temperature records.
+            water_level_store: Store for water level records.
+            watering_event_store: Store for watering event records.
+            rollup_store: If not None, store whose hourly and daily sensor
+                rollups are updated as records are stored.
+            connection: Database connection shared by the stores, on which
+                DatabaseTasks from the queue run. Required to process tasks.
+            utc_clock: A clock interface used to age pending batches. Defaults
+                to the system clock.
+            batch_size: Number of pending records at which process_batch()
+                commits the batch.
+            batch_max_age: A timedelta. When the oldest pending record has
+                waited this long, process_batch() commits the batch.
+        """
         self._record_queue = record_queue
         self._soil_moisture_store = soil_moisture_store
         self._light_store = light_store
@@ -23,6 +123,41 @@ class RecordProcessor(object):
         self._temperature_store = temperature_store
         self._water_level_store = water_level_store
         self._watering_event_store = watering_event_store
+        self._rollup_store = rollup_store
+        self._connection = connection
+        self._clock = utc_clock or clock.Clock()
+        self._batch_size = batch_size
+        self._batch_max_age = batch_max_age
+        # Records waiting to be committed, in the order they were dequeued.
+        self._pending_records = []
+        # Time at which the oldest pending record was dequeued.
+        self._batch_start_time = None
+        # True once the shutdown sentinel has been dequeued.
+        self._shutdown = False
+
+    def _store_for_record(self, record):
+        """Returns the store that holds the given record's type.
+
+        A CoalescedRecord is held by the store of the record it wraps.
+
+        Raises:
+            UnsupportedRecordError if the record is of an unexpected type.
+        """
+        record = db_store.unwrap_record(record)
+        if isinstance(record, db_store.SoilMoistureRecord):
+            return self._soil_moisture_store
+        elif isinstance(record, db_store.LightRecord):
+            return self._light_store
+        elif isinstance(record, db_store.HumidityRecord):
+            return self._humidity_store
+        elif isinstance(record, db_store.TemperatureRecord):
+            return self._temperature_store
+        elif isinstance(record, db_store.WaterLevelRecord):
+            return self._water_level_store
+        elif isinstance(record, db_store.WateringEventRecord):
+            return self._watering_event_store
+        raise UnsupportedRecordError(
+            'Unrecognized record type: %s' % str(record))
 
     def try_process_next_record(self):
         """Processes the next record from the queue, placing it in a store.
@@ -46,19 +181,165 @@ class RecordProcessor(object):
         except Queue.Empty:
             return False
 
-        if isinstance(record, db_store.SoilMoistureRecord):
-            self._soil_moisture_store.insert(record)
-        elif isinstance(record, db_store.LightRecord):
-            self._light_store.insert(record)
-        elif isinstance(record, db_store.HumidityRecord):
-            self._humidity_store.insert(record)
-        elif isinstance(record, db_store.TemperatureRecord):
-            self._temperature_store.insert(record)
-        elif isinstance(record, db_store.WaterLevelRecord):
-            self._water_level_store.insert(record)            
-        elif isinstance(record, db_store.WateringEventRecord):
-            self._watering_event_store.insert(record)
-        else:
-            raise UnsupportedRecordError(
-                'Unrecognized record type: %s' % str(record))
+        if isinstance(record, DatabaseTask):
+            self._run_task(record)
+            return True
+        self._store_for_record(record).insert(db_store.unwrap_record(record))
+        if self._rollup_store:
+            self._rollup_store.add([record])
         return True
+
+    def process_batch(self, timeout=0):
+        """Drains the queue into the pending batch, committing when it is due.
+
+        Removes every record currently in the queue and adds it to the batch
+        of pending records. If the batch has reached its size threshold or its
+        oldest record has reached the age threshold, writes the whole batch to
+        the database in a single transaction. A DatabaseTask in the queue runs
+        as soon as it is dequeued, after the records queued before it are
+        committed.
+
+        Must be called from the same thread from which the database connections
+        were created.
+
+        Args:
+            timeout: Number of seconds to wait for a record if the queue is
+                empty, or None to wait until a record arrives. The wait ends
+                early when the pending batch comes due.
+
+        Returns:
+            The number of records and tasks removed from the queue.
+
+        Raises:
+            UnsupportedRecordError if the queue contains an unexpected record
+                type.
+        """
+        wait_seconds = self._wait_seconds(timeout)
+        drained = 0
+        while not self._shutdown:
+            try:
+                if wait_seconds is None and not drained:
+                    record = self._record_queue.get()
+                elif drained or wait_seconds <= 0:
+                    record = self._record_queue.get_nowait()
+                else:
+                    record = self._record_queue.get(timeout=wait_seconds)
+            except Queue.Empty:
+                break
+            if record is SHUTDOWN:
+                self._shutdown = True
+                break
+            if isinstance(record, DatabaseTask):
+                self.flush()
+                self._run_task(record)
+                drained += 1
+                continue
+            # Validate the record type now so that a bad record is reported
+            # when it's dequeued rather than when the batch is committed.
+            self._store_for_record(record)
+            if not self._pending_records:
+                self._batch_start_time = self._clock.now()
+            self._pending_records.append(record)
+            drained += 1
+
+        if self._batch_due():
+            self.flush()
+        return drained
+
+    def _run_task(self, task):
+        """Runs a DatabaseTask on the processor's connection.
+
+        Raises:
+            UnsupportedRecordError if the processor has no connection.
+        """
+        if self._connection is None:
+            raise UnsupportedRecordError(
+                'Cannot run a database task without a connection')
+        task.run(self._connection)
+
+    def _wait_seconds(self, timeout):
+        """Returns how long to wait for a record without delaying a commit.
+
+        Returns None to wait until a record arrives.
+        """
+        if not self._pending_records:
+            return timeout
+        until_due = (
+            self._batch_max_age -
+            (self._clock.now() - self._batch_start_time)).total_seconds()
+        if timeout is not None:
+            until_due = min(timeout, until_due)
+        return max(0.0, until_due)
+
+    def run(self):
+        """Stores records from the queue until shutdown() is called.
+
+        Sleeps on the queue while it is empty and stores each burst of records
+        as soon as it arrives. While no batch is pending, the wait has no
+        timeout, since shutdown() wakes it by queueing SHUTDOWN. On shutdown,
+        flushes every record queued before the shutdown request.
+
+        Must be called from the same thread from which the database connections
+        were created.
+
+        Raises:
+            UnsupportedRecordError if the queue contains an unexpected record
+                type.
+        """
+        while not self._shutdown:
+            self.process_batch(timeout=None)
+        self.flush()
+
+    def shutdown(self):
+        """Asks run() to return once it has stored the records queued so far.
+
+        May be called from any thread other than the one running run().
+        """
+        self._record_queue.put(SHUTDOWN)
+
+    def _batch_due(self):
+        if not self._pending_records:
+            return False
+        if len(self._pending_records) >= self._batch_size:
+            return True
+        return (self._clock.now() - self._batch_start_time >=
+                self._batch_max_age)
+
+    def flush(self):
+        """Writes all pending records to the database in one transaction.
+
+        Records of each type are written with a single bulk insert into their
+        store, and the sensor rollups are updated in the same transaction. If
+        any write fails, the whole batch is rolled back and the pending
+        records are discarded.
+
+        Must be called from the same thread from which the database connections
+        were created.
+        """
+        if not self._pending_records:
+            return
+        records, self._pending_records = self._pending_records, []
+        self._batch_start_time = None
+
+        # Group records by store, preserving the order in which each store was
+        # first seen.
+        batches = []
+        records_by_store = {}
+        for record in records:
+            store = self._store_for_record(record)
+            if store not in records_by_store:
+                records_by_store[store] = []
+                batches.append((store, records_by_store[store]))
+            records_by_store[store].append(db_store.unwrap_record(record))
+
+        try:
+            for store, store_records in batches:
+                store.insert_many(store_records, commit=False)
+            if self._rollup_store:
+                self._rollup_store.add(records, commit=False)
+            # All stores share a single database connection, so one commit
+            # covers the inserts into every table.
+            batches[0][0].commit()
+        except:
+            batches[0][0].rollback()
+            raise
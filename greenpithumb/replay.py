@@ -0,0 +1,255 @@
+import collections
+import contextlib
+import datetime
+import heapq
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import clock
+import db_store
+import pump
+
+logger = logging.getLogger(__name__)
+
+# MQTT topics on which the poll workers publish each type of record, with the
+# record field published on each topic.
+_PUBLISHED_FIELDS = {
+    db_store.TemperatureRecord: [('greenpi/temperature', 'temperature')],
+    db_store.HumidityRecord: [('greenpi/humidity', 'humidity')],
+    db_store.WaterLevelRecord: [('greenpi/water_level', 'water_level')],
+    db_store.LightRecord: [('greenpi/light', 'light')],
+    db_store.SoilMoistureRecord: [('greenpi/soil_moisture', 'soil_moisture'),
+                                  ('greenpi/water_present', 'water_present')],
+    db_store.WateringEventRecord: [('greenpi/ml_pumped', 'water_pumped')],
+}
+
+
+@contextlib.contextmanager
+def current_schema_db(db_path):
+    """Provides a database to replay with the current schema.
+
+    Databases written by older versions of GreenPiThumb, such as those that
+    store timestamps as text, must be migrated before their records can be
+    read, but a replay never modifies the database it replays. Such a database
+    is copied to a temporary directory, and the copy is migrated and deleted
+    afterwards.
+
+    Args:
+        db_path: Path to an existing GreenPiThumb database.
+
+    Yields:
+        The path of the database, or of its migrated copy.
+
+    Raises:
+        db_store.UnsupportedSchemaError if the database has a newer schema
+            version than this code supports.
+    """
+    with contextlib.closing(sqlite3.connect(db_path)) as connection:
+        version = db_store.schema_version(connection)
+    if version > db_store.SCHEMA_VERSION:
+        raise db_store.UnsupportedSchemaError(
+            'Cannot replay %s: unsupported schema version %d, newest '
+            'supported version is %d' % (db_path, version,
+                                         db_store.SCHEMA_VERSION))
+    if version == db_store.SCHEMA_VERSION:
+        yield db_path
+        return
+    logger.info('migrating a copy of "%s" from schema version %d to %d',
+                db_path, version, db_store.SCHEMA_VERSION)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        copy_path = os.path.join(temp_dir, os.path.basename(db_path))
+        shutil.copy(db_path, copy_path)
+        # Records not yet checkpointed from the write-ahead log live only in
+        # the log, which SQLite replays when it opens the copy.
+        if os.path.exists(db_path + '-wal'):
+            shutil.copy(db_path + '-wal', copy_path + '-wal')
+        db_store.open_or_create_db(copy_path).close()
+        yield copy_path
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def _keyed_records(records, index):
+    """Pairs each record with a sort key for merging record streams."""
+    for record in records:
+        yield record.timestamp, index, record
+
+
+def iter_history(connection,
+                 start=None,
+                 end=None,
+                 chunk_size=db_store.DEFAULT_CHUNK_SIZE):
+    """Lazily iterates over every record in a database in timestamp order.
+
+    Merges the readings and watering events of all tables into a single
+    stream. Each table is read chunk_size rows at a time, so memory use is
+    bounded regardless of the size of the database. Records with the same
+    timestamp are yielded in table order.
+
+    Args:
+        connection: Connection to a GreenPiThumb database.
+        start: If not None, earliest timestamp (inclusive) to retrieve.
+        end: If not None, latest timestamp (exclusive) to retrieve.
+        chunk_size: Number of rows to fetch from each table at a time.
+
+    Returns:
+        A generator of records.
+    """
+    stores = [
+        db_store.SoilMoistureStore(connection),
+        db_store.LightStore(connection),
+        db_store.HumidityStore(connection),
+        db_store.TemperatureStore(connection),
+        db_store.WaterLevelStore(connection),
+        db_store.WateringEventStore(connection),
+    ]
+    # The index breaks timestamp ties, so records of different types are
+    # never compared.
+    streams = [
+        _keyed_records(store.iter_records(start, end, chunk_size), index)
+        for index, store in enumerate(stores)
+    ]
+    for _, _, record in heapq.merge(*streams):
+        yield record
+
+
+class Replayer(object):
+    """Feeds recorded history through the path of freshly polled records.
+
+    Each record goes on the record queue and is published over MQTT, just as
+    the poll workers do with new readings. Each soil moisture reading is also
+    put to the pump manager's should_pump check under the given watering
+    settings, on a clock that reads the time of the reading. A check that
+    passes counts as a watering and resets the forced watering timer, so
+    replaying with a different moisture threshold shows how often the pump
+    would have run. The readings themselves still reflect the waterings that
+    actually happened.
+    """
+
+    def __init__(self,
+                 record_queue,
+                 mqtt_client,
+                 moisture_threshold,
+                 pump_interval,
+                 sleep_windows,
+                 speed=None,
+                 wall_clock=None):
+        """Creates a new Replayer instance.
+
+        Args:
+            record_queue: Queue on which to place replayed records.
+            mqtt_client: MQTT client on which to publish replayed records.
+            moisture_threshold: Soil moisture below which the pump would run.
+            pump_interval: Maximum time between waterings, as a timedelta.
+            sleep_windows: Sleep windows during which the pump would not run,
+                as returned by sleep_windows.parse.
+            speed: Multiple of real time at which to replay records. If None,
+                records are replayed as fast as the pipeline accepts them.
+            wall_clock: A clock interface used to pace the replay. Defaults to
+                the system clock.
+
+        Raises:
+            ValueError if speed is not positive.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError('Replay speed must be positive: %s' % speed)
+        self._record_queue = record_queue
+        self._mqtt_client = mqtt_client
+        self._moisture_threshold = moisture_threshold
+        self._pump_interval = pump_interval
+        self._sleep_windows = sleep_windows
+        self._speed = speed
+        self._wall_clock = wall_clock or clock.Clock()
+
+    def _make_pump_manager(self, history_clock):
+        """Creates a pump manager that checks, but never runs, the pump."""
+        timer = clock.Timer(history_clock, self._pump_interval)
+        pump_manager = pump.PumpManager(None,
+                                        pump.PumpScheduler(
+                                            history_clock.local_clock(),
+                                            self._sleep_windows),
+                                        self._moisture_threshold, 0, timer,
+                                        None)
+        return pump_manager, timer
+
+    def replay(self, records):
+        """Replays records through the pipeline.
+
+        Args:
+            records: An iterable of records in timestamp order, such as from
+                iter_history.
+
+        Returns:
+            A dict of statistics for the replay, including the number of
+            records of each type, the time spent in each stage, and the number
+            of recorded and simulated waterings.
+        """
+        record_counts = collections.Counter()
+        stage_seconds = collections.Counter()
+        recorded_waterings = 0
+        simulated_waterings = 0
+        history_clock = None
+        first_timestamp = None
+        replay_start = self._wall_clock.now()
+        start_time = time.time()
+        records = iter(records)
+        while True:
+            stage_start = time.time()
+            record = next(records, None)
+            stage_seconds['read'] += time.time() - stage_start
+            if record is None:
+                break
+            if history_clock is None:
+                first_timestamp = record.timestamp
+                history_clock = clock.VirtualClock(first_timestamp)
+                pump_manager, timer = self._make_pump_manager(history_clock)
+            if self._speed is not None:
+                history_seconds = (
+                    record.timestamp - first_timestamp).total_seconds()
+                self._wall_clock.wait_until(replay_start + datetime.timedelta(
+                    seconds=history_seconds / self._speed))
+            history_clock.advance_to(record.timestamp)
+            record_counts[type(record).__name__] += 1
+
+            stage_start = time.time()
+            self._record_queue.put(record)
+            stage_seconds['queue'] += time.time() - stage_start
+
+            if isinstance(record, db_store.SoilMoistureRecord):
+                stage_start = time.time()
+                if pump_manager.should_pump(record.soil_moisture):
+                    simulated_waterings += 1
+                    timer.reset()
+                stage_seconds['should_pump'] += time.time() - stage_start
+            elif isinstance(record, db_store.WateringEventRecord):
+                recorded_waterings += 1
+
+            stage_start = time.time()
+            for topic, field in _PUBLISHED_FIELDS[type(record)]:
+                self._mqtt_client.publish(topic, getattr(record, field))
+            stage_seconds['publish'] += time.time() - stage_start
+        elapsed_seconds = time.time() - start_time
+        records_replayed = sum(record_counts.values())
+        logger.info('replayed %d records in %.1f s', records_replayed,
+                    elapsed_seconds)
+        return {
+            'records':
+            records_replayed,
+            'record_counts':
+            dict(record_counts),
+            'elapsed_seconds':
+            elapsed_seconds,
+            'records_per_second': (records_replayed / elapsed_seconds
+                                   if elapsed_seconds else None),
+            'stage_seconds':
+            dict(stage_seconds),
+            'recorded_waterings':
+            recorded_waterings,
+            'simulated_waterings':
+            simulated_waterings,
+        }
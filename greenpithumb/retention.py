@@ -0,0 +1,107 @@
+import collections
+import datetime
+import logging
+import time
+
+import db_store
+import record_processor
+
+logger = logging.getLogger(__name__)
+
+# rows_deleted is a dict mapping table name to the number of rows purged from
+# that table. elapsed_seconds is the wall time the purge took.
+CompactionResult = collections.namedtuple('CompactionResult',
+                                          ['rows_deleted', 'elapsed_seconds'])
+
+# Maximum number of seconds to wait for the record processor to run a purge.
+DEFAULT_PURGE_TIMEOUT = 300.0
+
+
+def parse(retention_args):
+    """Parses per-table retention overrides.
+
+    Args:
+        retention_args: A list of strings in the form "table=days", such as
+            "temperature=30".
+
+    Returns:
+        A dict mapping every table name to a timedelta of how long to keep its
+        records. Tables without an override use the default retention.
+
+    Raises:
+        ValueError if an override is malformed or names an unknown table.
+    """
+    retention = dict(db_store.DEFAULT_RETENTION)
+    for retention_arg in retention_args:
+        try:
+            table, days = retention_arg.split('=')
+            days = float(days)
+        except ValueError:
+            raise ValueError(
+                'Invalid retention "%s", expected table=days' % retention_arg)
+        if table not in retention:
+            raise ValueError('Unknown table for retention: %s' % table)
+        if days <= 0:
+            raise ValueError('Retention must be positive: %s' % retention_arg)
+        retention[table] = datetime.timedelta(days=days)
+    return retention
+
+
+class RetentionCompactor(object):
+    """Purges expired records from the GreenPiThumb database.
+
+    The purge runs on the record processor's connection, as a DatabaseTask
+    on the record queue, so that it can be requested from a background thread
+    without contending with the record processor for the database.
+    """
+
+    def __init__(self,
+                 record_queue,
+                 retention,
+                 clock,
+                 purge_timeout=DEFAULT_PURGE_TIMEOUT):
+        """Creates a new RetentionCompactor instance.
+
+        Args:
+            record_queue: Record queue of the record processor that writes to
+                the GreenPiThumb database.
+            retention: A dict mapping table names to a timedelta of how long
+                to keep records in that table.
+            clock: A clock interface.
+            purge_timeout: Maximum number of seconds to wait for the record
+                processor to run the purge.
+        """
+        self._record_queue = record_queue
+        self._retention = retention
+        self._clock = clock
+        self._purge_timeout = purge_timeout
+
+    def _purge(self, connection, now):
+        """Purges expired records, returning the rows deleted and time taken."""
+        start_time = time.time()
+        rows_deleted = db_store.purge_expired_records(connection,
+                                                      self._retention, now)
+        return rows_deleted, time.time() - start_time
+
+    def compact(self):
+        """Purges expired records from every table in one transaction.
+
+        Waits for the record processor to run the purge.
+
+        Returns:
+            A CompactionResult describing the purge.
+
+        Raises:
+            TaskTimeoutError if the record processor did not run the purge
+            within the purge timeout.
+        """
+        now = self._clock.now()
+        task = record_processor.DatabaseTask(
+            lambda connection: self._purge(connection, now))
+        self._record_queue.put(task)
+        rows_deleted, elapsed_seconds = task.result(self._purge_timeout)
+        logger.info('purged %d expired rows in %.3f s (%s)',
+                    sum(rows_deleted.values()), elapsed_seconds, ', '.join(
+                        '%s=%d' % (table, count)
+                        for table, count in sorted(rows_deleted.items())))
+        return CompactionResult(rows_deleted, elapsed_seconds)
@@ -0,0 +1,410 @@
+import argparse
+import datetime
+import heapq
+import itertools
+import logging
+import Queue
+import random
+
+import pytz
+
+import adc_thread_safe
+import clock
+import db_store
+import drain_sensor
+import hardware_sim
+import mqtt_client
+import pi_io
+import poller
+import pump
+import sleep_windows
+import vegetronix_vh400
+import water_level_sensor
+import wiring_config_parser
+
+logger = logging.getLogger(__name__)
+
+# Longest time between the ends of two bursts of the pump in one watering:
+# a soak, a drain check and a burst.
+_MAX_BURST_GAP = datetime.timedelta(seconds=2 * pump.INTERVAL_DURATION)
+
+
+class _SimulatedPoll(object):
+    """A poll of a worker at a scheduled poll time."""
+
+    def __init__(self, simulator, worker, poll_time):
+        self._simulator = simulator
+        self.worker = worker
+        self.poll_time = poll_time
+
+    def cancelled(self):
+        return not self._simulator.is_scheduled(self.worker)
+
+    def run(self):
+        try:
+            self.worker.poll(self.poll_time)
+        finally:
+            if not self.cancelled():
+                self._simulator._push_next_poll(self.worker)
+
+    def __str__(self):
+        return self.worker.__class__.__name__
+
+
+class Simulator(object):
+    """Event-driven simulator that fast-forwards a VirtualClock.
+
+    The simulator keeps a heap of upcoming jobs, as PollEngine does, but runs
+    them one at a time on the calling thread. Before each job, it moves the
+    clock forward to the time the job is due, so idle time between jobs costs
+    nothing. Waits within a job move the clock forward too, and jobs that
+    became due in the meantime run late, just as they would on a busy engine.
+
+    The simulator has the scheduling interface of a PollEngine, so pollers
+    created by a SensorPollerFactory can poll on it unchanged.
+    """
+
+    def __init__(self, virtual_clock):
+        """Creates a new Simulator instance.
+
+        Args:
+            virtual_clock: The VirtualClock that the simulated components
+                use.
+        """
+        self._clock = virtual_clock
+        # Heap of (due time, sequence number, job) tuples. The sequence number
+        # breaks ties so that jobs due at the same time run in the order they
+        # were scheduled.
+        self._heap = []
+        self._sequence = itertools.count()
+        self._workers = set()
+
+    def _push(self, due_time, job):
+        heapq.heappush(self._heap, (due_time, next(self._sequence), job))
+
+    def _push_next_poll(self, worker):
+        poll_time = worker.next_poll_time()
+        self._push(poll_time, _SimulatedPoll(self, worker, poll_time))
+
+    def now(self):
+        """Returns the current simulated time."""
+        return self._clock.now()
+
+    def schedule(self, worker):
+        """Starts polling a worker.
+
+        Args:
+            worker: The poll worker to add.
+        """
+        self._workers.add(worker)
+        self._push_next_poll(worker)
+
+    def unschedule(self, worker):
+        """Stops polling a worker.
+
+        Args:
+            worker: The poll worker to remove.
+        """
+        self._workers.discard(worker)
+
+    def is_scheduled(self, worker):
+        """Returns True if the simulator is polling the given worker."""
+        return worker in self._workers
+
+    def call_at(self, when, callback, *args):
+        """Runs a callback once at a given simulated time.
+
+        Args:
+            when: The time at which to run the callback, as a timezone-aware
+                datetime.
+            callback: Function to call.
+            args: Positional arguments for the callback.
+
+        Returns:
+            A TimerHandle that can cancel the callback.
+        """
+        handle = poller.TimerHandle(callback, args, frozenset())
+        self._push(when, handle)
+        return handle
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        """Runs a callback once after a delay in simulated time.
+
+        Args:
+            delay: Number of seconds to wait before running the callback.
+            callback: Function to call.
+            args: Positional arguments for the callback.
+            resources, urgent: Keyword-only. Accepted for compatibility with
+                PollEngine and ignored, since jobs never run at the same
+                time.
+
+        Returns:
+            A TimerHandle that can cancel the callback.
+        """
+        kwargs.pop('resources', None)
+        kwargs.pop('urgent', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % kwargs.keys())
+        return self.call_at(
+            self._clock.now() + datetime.timedelta(seconds=delay),
+            callback,
+            *args)
+
+    def run_until(self, end_time):
+        """Runs every job that is due up to a given simulated time.
+
+        Args:
+            end_time: The simulated time at which to stop, as a timezone-aware
+                datetime. The clock reads at least this time on return.
+
+        Returns:
+            The number of jobs run.
+        """
+        jobs_run = 0
+        while self._heap and self._heap[0][0] <= end_time:
+            due_time, _, job = heapq.heappop(self._heap)
+            if job.cancelled():
+                continue
+            self._clock.advance_to(due_time)
+            try:
+                job.run()
+            except Exception:
+                logger.exception('job failed: %s', job)
+            jobs_run += 1
+        self._clock.advance_to(end_time)
+        return jobs_run
+
+    def run_for(self, duration):
+        """Runs the simulation for a length of simulated time.
+
+        Args:
+            duration: A timedelta of simulated time to run for.
+
+        Returns:
+            The number of jobs run.
+        """
+        return self.run_until(self._clock.now() + duration)
+
+    def stop(self):
+        """Stops polling all workers and cancels pending callbacks."""
+        self._workers.clear()
+        self._heap = []
+
+
+def _summarize_season(records, moisture_threshold, sleep_windows_parsed,
+                      notifications):
+    """Summarizes the records of a simulated watering season.
+
+    Each burst of the pump has its own watering event record. Bursts that
+    follow one another within _MAX_BURST_GAP make up one watering, which is
+    attributed to the soil moisture poll that preceded it.
+
+    Args:
+        records: The records that the soil watering poller produced, in
+            order.
+        moisture_threshold: Soil moisture below which the pump runs.
+        sleep_windows_parsed: The pump's sleep windows.
+        notifications: Subjects of the notifications sent during the season.
+
+    Returns:
+        A dict of watering statistics.
+    """
+    moistures = []
+    # Soil moisture record of the poll that started each watering.
+    watering_polls = []
+    last_poll = None
+    last_burst_time = None
+    bursts = 0
+    water_pumped_ml = 0.0
+    for record in records:
+        if isinstance(record, db_store.SoilMoistureRecord):
+            last_poll = record
+            moistures.append(record.soil_moisture)
+        elif isinstance(record, db_store.WateringEventRecord):
+            if (last_burst_time is None or
+                    record.timestamp - last_burst_time > _MAX_BURST_GAP):
+                watering_polls.append(last_poll)
+            last_burst_time = record.timestamp
+            bursts += 1
+            water_pumped_ml += record.water_pumped
+    forced_waterings = 0
+    sleep_window_waterings = 0
+    for poll in watering_polls:
+        if poll.soil_moisture >= moisture_threshold:
+            forced_waterings += 1
+        # Check the watering time against the sleep windows just as the pump
+        # scheduler does, on a clock stopped at that time.
+        scheduler = pump.PumpScheduler(
+            clock.VirtualClock(poll.timestamp).local_clock(),
+            sleep_windows_parsed)
+        if scheduler.is_sleep_window():
+            sleep_window_waterings += 1
+    return {
+        'polls': len(moistures),
+        'waterings': len(watering_polls),
+        'pump_bursts': bursts,
+        'forced_waterings': forced_waterings,
+        'sleep_window_waterings': sleep_window_waterings,
+        'water_pumped_ml': water_pumped_ml,
+        'min_moisture': min(moistures) if moistures else None,
+        'mean_moisture': (sum(moistures) / len(moistures)
+                          if moistures else None),
+        'max_moisture': max(moistures) if moistures else None,
+        'low_water_notifications': len(notifications),
+    }
+
+
+def run_watering_season(wiring_config,
+                        start_time,
+                        duration,
+                        poll_interval,
+                        moisture_threshold,
+                        pump_amount,
+                        pump_interval,
+                        sleep_windows_parsed,
+                        rng=None):
+    """Simulates the GreenPiThumb's watering of a plant over a season.
+
+    Runs the real soil watering poller, pump manager, pump scheduler and
+    forced watering timer against simulated hardware on a virtual clock, so a
+    season passes in seconds.
+
+    Args:
+        wiring_config: Wiring configuration for the GreenPiThumb.
+        start_time: Time at which the season starts, as a timezone-aware
+            datetime.
+        duration: Length of the season, as a timedelta.
+        poll_interval: Time between soil moisture polls, as a timedelta.
+        moisture_threshold: Soil moisture below which the pump runs.
+        pump_amount: Amount of water (in mL) to pump each time the pump runs.
+        pump_interval: Maximum time between waterings, as a timedelta.
+        sleep_windows_parsed: Sleep windows during which the pump must not
+            run, as returned by sleep_windows.parse.
+        rng: A random.Random for the simulated hardware.
+
+    Returns:
+        A dict of watering statistics for the season.
+    """
+    virtual_clock = clock.VirtualClock(start_time)
+    backend = hardware_sim.SimulatedHardware(wiring_config, virtual_clock,
+                                             rng or random.Random())
+    raspberry_pi_io = pi_io.IO(backend.gpio())
+    adc = adc_thread_safe.Adc(backend.adc())
+    gpio_pins = wiring_config.gpio_pins
+    adc_channels = wiring_config.adc_channels
+    soil_moisture_sensor = vegetronix_vh400.SoilMoistureSensor(
+        adc, raspberry_pi_io, adc_channels.soil_moisture_sensor,
+        gpio_pins.soil_moisture_power, virtual_clock)
+    local_drain_sensor = drain_sensor.DrainSensor(
+        adc, raspberry_pi_io, adc_channels.drain_sensor,
+        gpio_pins.drain_sensor_power, virtual_clock)
+    notifications = []
+    simulator = Simulator(virtual_clock)
+    pump_manager = pump.PumpManager(
+        pump.Pump(raspberry_pi_io, virtual_clock, gpio_pins.pump),
+        pump.PumpScheduler(virtual_clock.local_clock(), sleep_windows_parsed),
+        moisture_threshold,
+        pump_amount,
+        clock.Timer(virtual_clock, pump_interval),
+        water_level_sensor.WaterLevelSensor(raspberry_pi_io, gpio_pins.sonar),
+        utc_clock=virtual_clock,
+        send_notification=lambda subject, body: notifications.append(subject),
+        poll_engine=simulator)
+
+    record_queue = Queue.Queue()
+    poller_factory = poller.SensorPollerFactory(
+        lambda: poller.Scheduler(virtual_clock, poll_interval),
+        record_queue,
+        mqtt_client.NullMqttClient(),
+        poll_engine=simulator)
+    soil_watering_poller = poller_factory.create_soil_watering_poller(
+        soil_moisture_sensor, local_drain_sensor, pump_manager)
+    soil_watering_poller.start_polling_async()
+    try:
+        simulator.run_for(duration)
+    finally:
+        soil_watering_poller.close()
+        simulator.stop()
+        raspberry_pi_io.close()
+
+    records = []
+    while not record_queue.empty():
+        records.append(record_queue.get_nowait())
+    return _summarize_season(records, moisture_threshold, sleep_windows_parsed,
+                             notifications)
+
+
+def main(args):
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s %(name)-15s %(levelname)-4s %(message)s')
+    with open(args.config_file) as config_file:
+        wiring_config = wiring_config_parser.parse(config_file.read())
+    start_time = pytz.utc.localize(
+        datetime.datetime.strptime(args.start_date, '%Y-%m-%d'))
+    summary = run_watering_season(
+        wiring_config,
+        start_time,
+        datetime.timedelta(days=args.days),
+        datetime.timedelta(minutes=args.poll_interval),
+        args.moisture_threshold,
+        args.pump_amount,
+        datetime.timedelta(hours=args.pump_interval),
+        sleep_windows.parse(args.sleep_window),
+        random.Random(args.seed))
+    for name, value in sorted(summary.items()):
+        print '%-24s %s' % (name, value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='GreenPiThumb Watering Simulation',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--days', type=float, help='Number of days to simulate', default=90)
+    parser.add_argument(
+        '--start_date',
+        help='Date (UTC, YYYY-MM-DD) on which the simulation starts',
+        default=datetime.date.today().isoformat())
+    parser.add_argument(
+        '-p',
+        '--poll_interval',
+        type=float,
+        help='Number of minutes between each soil moisture poll',
+        default=15)
+    parser.add_argument(
+        '-m',
+        '--moisture_threshold',
+        type=int,
+        help='Moisture threshold below which the pump turns on',
+        default=25)
+    parser.add_argument(
+        '-a',
+        '--pump_amount',
+        type=int,
+        help='Volume of water (in mL) to pump each time the water pump is run',
+        default=200)
+    parser.add_argument(
+        '-w',
+        '--pump_interval',
+        type=float,
+        help='Max number of hours between plant waterings',
+        default=(7 * 24))
+    parser.add_argument(
+        '-s',
+        '--sleep_window',
+        action='append',
+        type=str,
+        default=[],
+        help=('Time window during which the pump will not run, in the form '
+              '"03:15-03:45" (in the local time zone)'))
+    parser.add_argument(
+        '-c',
+        '--config_file',
+        help='Wiring config file',
+        default='greenpithumb/wiring_config.ini')
+    parser.add_argument(
+        '--seed', type=int, help='Seed for the simulated hardware', default=0)
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', help='Use verbose logging')
+    main(parser.parse_args())
@@ -1,14 +1,18 @@
 import logging
-import time
+
+import clock
 
 logger = logging.getLogger(__name__)
 
+# Number of seconds the sensor needs after power up before it can be read.
+STARTUP_SECONDS = 2.0
+
 
 class SoilMoistureSensor(object):
     """Wrapper for a moisture sensor."""
 
 
-    def __init__(self, adc, pi_io, channel, gpio_pin):
+    def __init__(self, adc, pi_io, channel, gpio_pin, utc_clock=None):
         """Creates a new SoilMoistureSensor instance.
 
         Args:
@@ -19,11 +23,14 @@ class SoilMoistureSensor(object):
                 be an int between 0 and 7.
             gpio_pin: The Raspberry Pi GPIO pin that the moisture sensor is
                 connected to. Must be an int between 2 and 27.
+            utc_clock: A clock interface used to wait for the sensor to start
+                up. Defaults to the system clock.
         """
         self._adc = adc
         self._pi_io = pi_io
         self._channel = channel
         self._gpio_pin = gpio_pin
+        self._clock = utc_clock or clock.Clock()
         
         
     def calc_vwc(self, V):
@@ -87,7 +94,7 @@ class SoilMoistureSensor(object):
         self._pi_io.turn_pin_on(self._gpio_pin)
         
         # Sensor startup time
-        time.sleep(2.0)   # Wait time in seconds
+        self._clock.wait(STARTUP_SECONDS)
 
         # Take sensor reading
         raw_value = self._adc.read_adc(self._channel)
@@ -35,3 +35,35 @@ class AdcTest(unittest.TestCase):
             t.join()
         # Check that the threads incremented the counter correctly.
         self.assertEqual(10 * 5, self.counter)
+
+    def test_read_adc_returns_single_sample_as_read(self):
+        raw_adc = mock.Mock()
+        raw_adc.read_adc.return_value = 512
+        self.assertEqual(512, adc_thread_safe.Adc(raw_adc).read_adc(3))
+        raw_adc.read_adc.assert_called_once_with(3)
+
+    def test_read_adc_uses_default_oversampling(self):
+        raw_adc = mock.Mock()
+        raw_adc.read_adc.side_effect = [500, 900, 510]
+        adc = adc_thread_safe.Adc(raw_adc, samples=3)
+        self.assertEqual(510.0, adc.read_adc(3))
+
+    def test_read_adc_median_of_even_number_of_samples(self):
+        raw_adc = mock.Mock()
+        raw_adc.read_adc.side_effect = [100, 102, 101, 900]
+        adc = adc_thread_safe.Adc(raw_adc, samples=4)
+        self.assertEqual(101.5, adc.read_adc(1))
+        self.assertEqual([mock.call(1)] * 4, raw_adc.read_adc.call_args_list)
+
+    def test_read_adc_mean_reduction(self):
+        raw_adc = mock.Mock()
+        raw_adc.read_adc.side_effect = [400, 900]
+        adc = adc_thread_safe.Adc(
+            raw_adc, samples=2, reduction=adc_thread_safe.MEAN)
+        self.assertEqual(650.0, adc.read_adc(4))
+
+    def test_rejects_invalid_sampling(self):
+        with self.assertRaises(ValueError):
+            adc_thread_safe.Adc(mock.Mock(), samples=0)
+        with self.assertRaises(ValueError):
+            adc_thread_safe.Adc(mock.Mock(), reduction='dummy')
@@ -0,0 +1,125 @@
+import datetime
+import Queue
+import threading
+import unittest
+
+import pytz
+
+from greenpithumb import bounded_queue
+from greenpithumb import db_store
+
+TIMESTAMP_A = datetime.datetime(2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc)
+
+
+def light_record(minutes, light):
+    return db_store.LightRecord(
+        timestamp=TIMESTAMP_A + datetime.timedelta(minutes=minutes),
+        light=light)
+
+
+def temperature_record(minutes, temperature):
+    return db_store.TemperatureRecord(
+        timestamp=TIMESTAMP_A + datetime.timedelta(minutes=minutes),
+        temperature=temperature)
+
+
+def watering_event_record(minutes):
+    return db_store.WateringEventRecord(
+        timestamp=TIMESTAMP_A + datetime.timedelta(minutes=minutes),
+        water_pumped=200.0)
+
+
+def drain(record_queue):
+    records = []
+    while not record_queue.empty():
+        records.append(record_queue.get_nowait())
+    return records
+
+
+class RecordQueueTest(unittest.TestCase):
+
+    def test_rejects_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            bounded_queue.RecordQueue(0)
+        with self.assertRaises(ValueError):
+            bounded_queue.RecordQueue(10, 'dummy_policy')
+
+    def test_block_policy_raises_Full_when_not_blocking(self):
+        record_queue = bounded_queue.RecordQueue(1, bounded_queue.BLOCK)
+        record_queue.put(light_record(0, 10.0))
+        with self.assertRaises(Queue.Full):
+            record_queue.put(light_record(1, 20.0), block=False)
+        with self.assertRaises(Queue.Full):
+            record_queue.put(light_record(1, 20.0), timeout=0.01)
+        self.assertEqual(2, record_queue.stats()['blocked_puts'])
+
+    def test_block_policy_waits_for_room(self):
+        record_queue = bounded_queue.RecordQueue(1, bounded_queue.BLOCK)
+        record_queue.put(light_record(0, 10.0))
+        threading.Timer(0.05, record_queue.get).start()
+        record_queue.put(light_record(1, 20.0), timeout=1.0)
+        self.assertEqual([light_record(1, 20.0)], drain(record_queue))
+
+    def test_drop_oldest_discards_oldest_reading(self):
+        record_queue = bounded_queue.RecordQueue(3, bounded_queue.DROP_OLDEST)
+        record_queue.put(watering_event_record(0))
+        record_queue.put(light_record(1, 10.0))
+        record_queue.put(light_record(2, 20.0))
+        record_queue.put(light_record(3, 30.0))
+        self.assertEqual([
+            watering_event_record(0),
+            light_record(2, 20.0),
+            light_record(3, 30.0)
+        ], drain(record_queue))
+        self.assertEqual(1, record_queue.stats()['dropped'])
+
+    def test_watering_events_are_never_dropped(self):
+        record_queue = bounded_queue.RecordQueue(1, bounded_queue.DROP_OLDEST)
+        record_queue.put(watering_event_record(0))
+        with self.assertRaises(Queue.Full):
+            record_queue.put(light_record(1, 10.0), block=False)
+        self.assertEqual([watering_event_record(0)], drain(record_queue))
+
+    def test_coalesce_merges_oldest_readings_of_new_records_sensor(self):
+        record_queue = bounded_queue.RecordQueue(4, bounded_queue.COALESCE)
+        record_queue.put(temperature_record(0, 20.0))
+        record_queue.put(light_record(0, 10.0))
+        record_queue.put(temperature_record(1, 24.0))
+        record_queue.put(light_record(1, 30.0))
+        record_queue.put(light_record(2, 50.0))
+        self.assertEqual([
+            temperature_record(0, 20.0),
+            db_store.CoalescedRecord(
+                record=light_record(0, 20.0),
+                count=2,
+                minimum=10.0,
+                maximum=30.0),
+            temperature_record(1, 24.0),
+            light_record(2, 50.0),
+        ], drain(record_queue))
+        stats = record_queue.stats()
+        self.assertEqual(1, stats['coalesced'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(4, stats['max_depth'])
+
+    def test_coalesce_falls_back_to_other_sensors(self):
+        record_queue = bounded_queue.RecordQueue(2, bounded_queue.COALESCE)
+        record_queue.put(temperature_record(0, 20.0))
+        record_queue.put(temperature_record(1, 24.0))
+        record_queue.put(light_record(2, 50.0))
+        self.assertEqual([
+            db_store.CoalescedRecord(
+                record=temperature_record(0, 22.0),
+                count=2,
+                minimum=20.0,
+                maximum=24.0),
+            light_record(2, 50.0),
+        ], drain(record_queue))
+
+    def test_coalesce_blocks_when_no_readings_can_merge(self):
+        record_queue = bounded_queue.RecordQueue(2, bounded_queue.COALESCE)
+        record_queue.put(watering_event_record(0))
+        record_queue.put(light_record(1, 10.0))
+        with self.assertRaises(Queue.Full):
+            record_queue.put(light_record(2, 20.0), block=False)
+        self.assertEqual(1, record_queue.stats()['blocked_puts'])
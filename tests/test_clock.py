@@ -1,4 +1,6 @@
 import datetime
+import select
+import threading
 import time
 import unittest
 
@@ -33,6 +35,141 @@ class ClockTest(unittest.TestCase):
         """now() should always return a tz-aware datetime."""
         self.assertIsNotNone(self.clock.now().tzinfo)
 
+    @mock.patch.object(time, 'sleep')
+    def test_wait_until_past_deadline_returns_immediately(self, mock_sleep):
+        deadline = self.clock.now() - datetime.timedelta(seconds=1)
+        self.assertTrue(self.clock.wait_until(deadline))
+        mock_sleep.assert_not_called()
+
+    def test_wait_until_waits_for_deadline(self):
+        start_time = clock.monotonic()
+        deadline = self.clock.now() + datetime.timedelta(seconds=0.05)
+        self.assertTrue(self.clock.wait_until(deadline))
+        self.assertGreaterEqual(clock.monotonic() - start_time, 0.05)
+
+    def test_wait_until_with_cancel_event_waits_for_deadline(self):
+        start_time = clock.monotonic()
+        self.assertTrue(
+            self.clock.wait_until(
+                self.clock.now() + datetime.timedelta(seconds=0.05),
+                clock.WakeupEvent()))
+        self.assertGreaterEqual(clock.monotonic() - start_time, 0.05)
+
+    def test_wait_until_returns_when_cancelled(self):
+        cancel_event = clock.WakeupEvent()
+        threading.Timer(0.05, cancel_event.set).start()
+        start_time = clock.monotonic()
+        self.assertFalse(
+            self.clock.wait_until(
+                self.clock.now() + datetime.timedelta(hours=1), cancel_event))
+        self.assertLess(clock.monotonic() - start_time, 1.0)
+
+    @mock.patch.object(select, 'select')
+    def test_wait_until_with_cancel_event_sleeps_without_polling(
+            self, mock_select):
+        mock_select.side_effect = lambda *args: time.sleep(0.05)
+        self.assertTrue(
+            self.clock.wait_until(
+                self.clock.now() + datetime.timedelta(seconds=0.05),
+                clock.WakeupEvent()))
+        self.assertEqual(1, mock_select.call_count)
+
+    def test_monotonic_never_goes_backwards(self):
+        first = clock.monotonic()
+        self.assertLessEqual(first, clock.monotonic())
+
+
+class WakeupEventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.event = clock.WakeupEvent()
+
+    def tearDown(self):
+        self.event.close()
+
+    def test_wait_returns_immediately_when_set(self):
+        self.event.set()
+        self.event.set()
+        self.assertTrue(self.event.is_set())
+        self.assertTrue(self.event.wait(60))
+
+    def test_wait_times_out_when_not_set(self):
+        start_time = clock.monotonic()
+        self.assertFalse(self.event.wait(0.05))
+        self.assertGreaterEqual(clock.monotonic() - start_time, 0.05)
+
+    def test_set_from_another_thread_wakes_wait(self):
+        threading.Timer(0.05, self.event.set).start()
+        start_time = clock.monotonic()
+        self.assertTrue(self.event.wait(60))
+        self.assertLess(clock.monotonic() - start_time, 1.0)
+
+    def test_clear_resets_flag(self):
+        self.event.set()
+        self.event.clear()
+        self.assertFalse(self.event.is_set())
+        self.assertFalse(self.event.wait(0.01))
+
+    @mock.patch.object(select, 'select')
+    def test_timed_wait_blocks_in_a_single_select(self, mock_select):
+        self.assertFalse(self.event.wait(60))
+        mock_select.assert_called_once_with(mock.ANY, [], [], 60)
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start_time = datetime.datetime(
+            2016, 7, 23, 10, 0, 0, tzinfo=pytz.utc)
+        self.clock = clock.VirtualClock(self.start_time)
+
+    def test_now_returns_start_time_until_advanced(self):
+        self.assertEqual(self.start_time, self.clock.now())
+        self.assertEqual(self.start_time, self.clock.now())
+
+    @mock.patch.object(time, 'sleep')
+    def test_wait_advances_time_without_sleeping(self, mock_sleep):
+        self.clock.wait(3600.5)
+        self.assertEqual(
+            self.start_time + datetime.timedelta(seconds=3600.5),
+            self.clock.now())
+        mock_sleep.assert_not_called()
+
+    def test_negative_wait_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            self.clock.wait(-1.0)
+
+    def test_wait_until_advances_to_deadline(self):
+        deadline = self.start_time + datetime.timedelta(days=7)
+        self.assertTrue(self.clock.wait_until(deadline))
+        self.assertEqual(deadline, self.clock.now())
+
+    def test_wait_until_cancelled_leaves_time_unchanged(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertFalse(
+            self.clock.wait_until(
+                self.start_time + datetime.timedelta(days=7), cancel_event))
+        self.assertEqual(self.start_time, self.clock.now())
+
+    def test_advance_to_past_time_does_not_run_backwards(self):
+        self.clock.advance_to(self.start_time - datetime.timedelta(hours=1))
+        self.assertEqual(self.start_time, self.clock.now())
+
+    def test_local_clock_shares_time_in_another_time_zone(self):
+        local_clock = self.clock.local_clock(pytz.timezone('America/New_York'))
+        local_clock.wait(60)
+        self.assertEqual(self.clock.now(), local_clock.now())
+        self.assertEqual(6, local_clock.now().hour)
+        self.assertEqual(1, local_clock.now().minute)
+
+    def test_timer_expires_on_virtual_time(self):
+        timer = clock.Timer(self.clock, datetime.timedelta(days=3))
+        self.clock.wait(3 * 24 * 60 * 60 - 1)
+        self.assertFalse(timer.expired())
+        self.clock.wait(1)
+        self.assertTrue(timer.expired())
+
 
 class TimerTest(unittest.TestCase):
 
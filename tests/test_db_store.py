@@ -1,6 +1,7 @@
 import contextlib
 import datetime
 import os
+import Queue
 import shutil
 import sqlite3
 import tempfile
@@ -18,6 +19,16 @@ UTC_MINUS_5 = tz.tzoffset(None, -18000)
 
 class OpenOrCreateTest(unittest.TestCase):
 
+    # Schema of databases created before schema versioning existed.
+    LEGACY_SCHEMA = """
+        CREATE TABLE temperature (timestamp TEXT, temperature REAL);
+        CREATE TABLE humidity (timestamp TEXT, humidity REAL);
+        CREATE TABLE water_level (timestamp TEXT, water_level REAL);
+        CREATE TABLE soil_moisture (timestamp TEXT, soil_moisture REAL);
+        CREATE TABLE light (timestamp TEXT, light REAL);
+        CREATE TABLE watering_events (timestamp TEXT, water_pumped REAL);
+        """
+
     def setUp(self):
         self._temp_dir = tempfile.mkdtemp()
 
@@ -27,16 +38,45 @@ class OpenOrCreateTest(unittest.TestCase):
     @mock.patch.object(sqlite3, 'connect')
     def test_does_not_initialize_existing_db_file(self, mock_connect):
         mock_connection = mock.Mock()
+        mock_cursor = mock.Mock()
+        mock_cursor.fetchone.return_value = (db_store.SCHEMA_VERSION,)
+        mock_connection.cursor.return_value = mock_cursor
         mock_connect.return_value = mock_connection
         # Simulate an existing database file
         with tempfile.NamedTemporaryFile() as temp_file:
             with contextlib.closing(db_store.open_or_create_db(temp_file.name)):
                 mock_connect.assert_called_once_with(temp_file.name)
-        # If the database already existed, we should not do anything except
-        # call sqlite3.connect().
-        mock_connection.cursor.assert_not_called()
+        # If the database already existed and is up to date, we should not do
+        # anything except check its schema version.
+        mock_cursor.execute.assert_called_once_with('PRAGMA user_version')
         mock_connection.commit.assert_not_called()
 
+    def test_adds_missing_indexes_to_existing_db_file(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        db_store.open_or_create_db(db_path).close()
+        # Simulate a database created before timestamp indexes existed.
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            connection.execute('DROP INDEX light_timestamp')
+            connection.execute('PRAGMA user_version = %d' %
+                               (db_store.SCHEMA_VERSION - 1))
+            connection.commit()
+        with contextlib.closing(
+                db_store.open_or_create_db(db_path)) as connection:
+            indexes = connection.execute(
+                'SELECT name FROM sqlite_master WHERE type = "index" '
+                'AND name NOT LIKE "sqlite_autoindex_%"').fetchall()
+        self.assertIn(('light_timestamp',), indexes)
+        self.assertEqual(6, len(indexes))
+
+    @mock.patch.object(db_store, 'logger')
+    def test_logs_creation_of_new_db(self, mock_logger):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        db_store.open_or_create_db(db_path).close()
+        messages = [args[0] for args, _ in mock_logger.info.call_args_list]
+        self.assertIn('creating new greenpithumb database at "%s"', messages)
+        self.assertNotIn('opening existing greenpithumb database at "%s"',
+                         messages)
+
     def test_creates_file_and_tables_when_db_does_not_already_exist(self):
         # Create a path for a file that does not already exist.
         db_path = os.path.join(self._temp_dir, 'test.db')
@@ -45,17 +85,156 @@ class OpenOrCreateTest(unittest.TestCase):
             cursor = connection.cursor()
             # Insertions into all tables should work after initialization.
             cursor.execute('INSERT INTO temperature VALUES (?, ?)',
-                           ('2016-07-23T10:51Z', 98.6))
+                           (1469271060, 98.6))
             cursor.execute('INSERT INTO humidity VALUES (?, ?)',
-                           ('2016-07-23T10:51Z', 93.7))
+                           (1469271060, 93.7))
             cursor.execute('INSERT INTO soil_moisture VALUES (?, ?)',
-                           ('2016-07-23T10:51Z', 57))
+                           (1469271060, 57))
             cursor.execute('INSERT INTO light VALUES (?, ?)',
-                           ('2016-07-23T10:51Z', 75.2))
+                           (1469271060, 75.2))
             cursor.execute('INSERT INTO watering_events VALUES (?, ?)',
-                           ('2016-07-23T10:51Z', 258.9))
+                           (1469271060, 258.9))
             connection.commit()
 
+    def test_migrates_text_timestamps_to_integers(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        # Simulate a database created before integer timestamps, including a
+        # soil_moisture table that predates the water_present column.
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            connection.executescript(self.LEGACY_SCHEMA + """
+                INSERT INTO temperature VALUES ('2016-07-23T10:51Z', 21.5);
+                INSERT INTO soil_moisture VALUES ('2016-07-23T10:52Z', 42.0);
+                """)
+        with contextlib.closing(
+                db_store.open_or_create_db(db_path)) as connection:
+            self.assertEqual([
+                db_store.TemperatureRecord(
+                    timestamp=datetime.datetime(
+                        2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+                    temperature=21.5)
+            ], db_store.TemperatureStore(connection).get())
+            self.assertEqual([
+                db_store.SoilMoistureRecord(
+                    timestamp=1469271120, soil_moisture=42.0,
+                    water_present=None)
+            ], db_store.SoilMoistureStore(connection).get(
+                raw_timestamps=True))
+            self.assertEqual(
+                'INTEGER',
+                connection.execute('PRAGMA table_info(light)').fetchone()[2])
+
+    def test_new_db_has_current_schema_version(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(
+                db_store.open_or_create_db(db_path)) as connection:
+            self.assertEqual(
+                db_store.SCHEMA_VERSION,
+                connection.execute('PRAGMA user_version').fetchone()[0])
+
+    def test_migrates_legacy_db_to_current_schema_version(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            connection.executescript(self.LEGACY_SCHEMA)
+        with contextlib.closing(
+                db_store.open_or_create_db(db_path)) as connection:
+            self.assertEqual(
+                db_store.SCHEMA_VERSION,
+                connection.execute('PRAGMA user_version').fetchone()[0])
+            self.assertEqual(
+                [], db_store.RollupStore(connection).get_rollup('light', 'day'))
+
+    def test_failed_migration_leaves_db_unchanged(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            connection.executescript(self.LEGACY_SCHEMA)
+
+        def failing_migration(_):
+            raise ValueError('dummy migration failure')
+
+        migrations = [db_store._MIGRATIONS[0], failing_migration
+                     ] + db_store._MIGRATIONS[2:]
+        with mock.patch.object(db_store, '_MIGRATIONS', migrations):
+            with self.assertRaises(ValueError):
+                db_store.open_or_create_db(db_path)
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            self.assertEqual(
+                0, connection.execute('PRAGMA user_version').fetchone()[0])
+            # The first migration's new column was rolled back too.
+            self.assertEqual(
+                2,
+                len(
+                    connection.execute(
+                        'PRAGMA table_info(soil_moisture)').fetchall()))
+
+    def test_rejects_db_with_newer_schema_version(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            connection.execute(
+                'PRAGMA user_version = %d' % (db_store.SCHEMA_VERSION + 1))
+        with self.assertRaises(db_store.UnsupportedSchemaError):
+            db_store.open_or_create_db(db_path)
+
+    def test_wal_mode_sets_journal_and_tuning_pragmas(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(db_store.open_or_create_db(
+                db_path, wal=True)) as connection:
+            self.assertEqual(
+                'wal',
+                connection.execute('PRAGMA journal_mode').fetchone()[0])
+            # 1 is NORMAL.
+            self.assertEqual(
+                1, connection.execute('PRAGMA synchronous').fetchone()[0])
+            self.assertEqual(
+                -db_store.WAL_CACHE_SIZE_KB,
+                connection.execute('PRAGMA cache_size').fetchone()[0])
+
+    def test_default_mode_keeps_rollback_journal(self):
+        db_path = os.path.join(self._temp_dir, 'test.db')
+        with contextlib.closing(
+                db_store.open_or_create_db(db_path)) as connection:
+            self.assertEqual(
+                'delete',
+                connection.execute('PRAGMA journal_mode').fetchone()[0])
+
+
+class ReadConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self._temp_dir, 'test.db')
+        self.write_connection = db_store.open_or_create_db(
+            self.db_path, wal=True)
+        self.pool = db_store.ReadConnectionPool(self.db_path, size=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.write_connection.close()
+        shutil.rmtree(self._temp_dir)
+
+    def test_reads_records_committed_by_writer(self):
+        record = db_store.LightRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+            light=50.0)
+        db_store.LightStore(self.write_connection).insert(record)
+        with self.pool.connection() as connection:
+            self.assertEqual([record], db_store.LightStore(connection).get())
+
+    def test_connections_are_read_only(self):
+        with self.pool.connection() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                connection.execute('DELETE FROM light')
+
+    def test_connection_is_returned_to_pool(self):
+        with self.pool.connection() as connection:
+            first_connection = connection
+            # The only connection is borrowed, so none are available.
+            with self.assertRaises(Queue.Empty):
+                with self.pool.connection(timeout=0.01):
+                    pass
+        with self.pool.connection(timeout=0.01) as connection:
+            self.assertIs(first_connection, connection)
+
 
 class StoreClassesTest(unittest.TestCase):
 
@@ -73,7 +252,7 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.SoilMoistureStore(self.mock_connection)
         store.insert(record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO soil_moisture VALUES (?, ?)', ('2016-07-23T10:51Z',
+            'INSERT INTO soil_moisture VALUES (?, ?)', (1469271060,
                                                         300))
         self.mock_connection.commit.assert_called_once()
 
@@ -86,14 +265,14 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.SoilMoistureStore(self.mock_connection)
         store.insert(record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO soil_moisture VALUES (?, ?)', ('2016-07-23T15:51Z',
+            'INSERT INTO soil_moisture VALUES (?, ?)', (1469289060,
                                                         300))
         self.mock_connection.commit.assert_called_once()
 
     def test_get_soil_moisture(self):
         store = db_store.SoilMoistureStore(self.mock_connection)
-        self.mock_cursor.fetchall.return_value = [('2016-07-23T10:51Z', 300),
-                                                  ('2016-07-23T10:52Z', 400)]
+        self.mock_cursor.fetchall.return_value = [(1469271060, 300),
+                                                  (1469271120, 400)]
         soil_moisture_data = store.get()
         soil_moisture_data.sort(
             key=lambda SoilMoistureRecord: SoilMoistureRecord.timestamp)
@@ -122,7 +301,7 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.LightStore(self.mock_connection)
         store.insert(light_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO light VALUES (?, ?)', ('2016-07-23T10:51Z', 50.0))
+            'INSERT INTO light VALUES (?, ?)', (1469271060, 50.0))
         self.mock_connection.commit.assert_called_once()
 
     def test_insert_light_with_non_utc_time(self):
@@ -134,13 +313,13 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.LightStore(self.mock_connection)
         store.insert(light_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO light VALUES (?, ?)', ('2016-07-23T15:51Z', 50.0))
+            'INSERT INTO light VALUES (?, ?)', (1469289060, 50.0))
         self.mock_connection.commit.assert_called_once()
 
     def test_get_light(self):
         store = db_store.LightStore(self.mock_connection)
-        self.mock_cursor.fetchall.return_value = [('2016-07-23T10:51Z', 300),
-                                                  ('2016-07-23T10:52Z', 400)]
+        self.mock_cursor.fetchall.return_value = [(1469271060, 300),
+                                                  (1469271120, 400)]
         light_data = store.get()
         light_data.sort(key=lambda LightRecord: LightRecord.timestamp)
 
@@ -168,7 +347,7 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.HumidityStore(self.mock_connection)
         store.insert(humidity_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO humidity VALUES (?, ?)', ('2016-07-23T10:51Z', 50.0))
+            'INSERT INTO humidity VALUES (?, ?)', (1469271060, 50.0))
         self.mock_connection.commit.assert_called_once()
 
     def test_insert_humidity_with_non_utc_time(self):
@@ -180,13 +359,13 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.HumidityStore(self.mock_connection)
         store.insert(humidity_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO humidity VALUES (?, ?)', ('2016-07-23T15:51Z', 50.0))
+            'INSERT INTO humidity VALUES (?, ?)', (1469289060, 50.0))
         self.mock_connection.commit.assert_called_once()
 
     def test_get_humidity(self):
         store = db_store.HumidityStore(self.mock_connection)
-        self.mock_cursor.fetchall.return_value = [('2016-07-23T10:51Z', 50),
-                                                  ('2016-07-23T10:52Z', 51)]
+        self.mock_cursor.fetchall.return_value = [(1469271060, 50),
+                                                  (1469271120, 51)]
         humidity_data = store.get()
         humidity_data.sort(key=lambda HumidityRecord: HumidityRecord.timestamp)
 
@@ -214,7 +393,7 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.TemperatureStore(self.mock_connection)
         store.insert(temperature_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO temperature VALUES (?, ?)', ('2016-07-23T10:51Z',
+            'INSERT INTO temperature VALUES (?, ?)', (1469271060,
                                                       21.1))
         self.mock_connection.commit.assert_called_once()
 
@@ -227,14 +406,14 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.TemperatureStore(self.mock_connection)
         store.insert(temperature_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO temperature VALUES (?, ?)', ('2016-07-23T15:51Z',
+            'INSERT INTO temperature VALUES (?, ?)', (1469289060,
                                                       21.1))
         self.mock_connection.commit.assert_called_once()
 
     def test_get_temperature(self):
         store = db_store.TemperatureStore(self.mock_connection)
-        self.mock_cursor.fetchall.return_value = [('2016-07-23T10:51Z', 21.0),
-                                                  ('2016-07-23T10:52Z', 21.5)]
+        self.mock_cursor.fetchall.return_value = [(1469271060, 21.0),
+                                                  (1469271120, 21.5)]
         temperature_data = store.get()
         temperature_data.sort(
             key=lambda TemperatureRecord: TemperatureRecord.timestamp)
@@ -263,7 +442,7 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.WateringEventStore(self.mock_connection)
         store.insert(watering_event_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO watering_events VALUES (?, ?)', ('2016-07-23T10:51Z',
+            'INSERT INTO watering_events VALUES (?, ?)', (1469271060,
                                                           200.0))
         self.mock_connection.commit.assert_called_once()
 
@@ -276,14 +455,74 @@ class StoreClassesTest(unittest.TestCase):
         store = db_store.WateringEventStore(self.mock_connection)
         store.insert(watering_event_record)
         self.mock_cursor.execute.assert_called_once_with(
-            'INSERT INTO watering_events VALUES (?, ?)', ('2016-07-23T15:51Z',
+            'INSERT INTO watering_events VALUES (?, ?)', (1469289060,
                                                           200.0))
         self.mock_connection.commit.assert_called_once()
 
+    def test_insert_many_light(self):
+        """Should insert a batch of light records with one statement."""
+        light_records = [
+            db_store.LightRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+                light=50.0),
+            db_store.LightRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 52, 0, tzinfo=UTC_MINUS_5),
+                light=51.0),
+        ]
+        store = db_store.LightStore(self.mock_connection)
+        store.insert_many(light_records)
+        self.mock_cursor.executemany.assert_called_once_with(
+            'INSERT INTO light VALUES (?, ?)',
+            [(1469271060, 50.0), (1469289120, 51.0)])
+        self.mock_connection.commit.assert_called_once()
+
+    def test_insert_many_soil_moisture_without_commit(self):
+        """Should leave the batch uncommitted when commit is False."""
+        soil_moisture_records = [
+            db_store.SoilMoistureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+                soil_moisture=300,
+                water_present=False),
+        ]
+        store = db_store.SoilMoistureStore(self.mock_connection)
+        store.insert_many(soil_moisture_records, commit=False)
+        self.mock_cursor.executemany.assert_called_once_with(
+            'INSERT INTO soil_moisture VALUES (?, ?, ?)',
+            [(1469271060, 300, False)])
+        self.mock_connection.commit.assert_not_called()
+
+    def test_get_light_time_range(self):
+        store = db_store.LightStore(self.mock_connection)
+        self.mock_cursor.fetchall.return_value = []
+        store.get(
+            start=datetime.datetime(2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+            end=datetime.datetime(2016, 7, 23, 10, 0, 0, tzinfo=UTC_MINUS_5),
+            limit=10,
+            order='desc')
+        self.mock_cursor.execute.assert_called_once_with(
+            ('SELECT * FROM light WHERE timestamp >= ? AND timestamp < ? '
+             'ORDER BY timestamp DESC LIMIT ?'),
+            (1469271060, 1469286000, 10))
+
+    def test_get_light_raw_timestamps(self):
+        store = db_store.LightStore(self.mock_connection)
+        self.mock_cursor.fetchall.return_value = [(1469271060, 300)]
+        self.assertEqual(
+            [db_store.LightRecord(timestamp=1469271060, light=300)],
+            store.get(raw_timestamps=True))
+
+    def test_get_rejects_invalid_order(self):
+        store = db_store.LightStore(self.mock_connection)
+        with self.assertRaises(ValueError):
+            store.get(order='sideways')
+
     def test_get_water_pumped(self):
         store = db_store.WateringEventStore(self.mock_connection)
-        self.mock_cursor.fetchall.return_value = [('2016-07-23T10:51Z', 300),
-                                                  ('2016-07-23T10:52Z', 301)]
+        self.mock_cursor.fetchall.return_value = [(1469271060, 300),
+                                                  (1469271120, 301)]
         watering_event_data = store.get()
         watering_event_data.sort(
             key=lambda WaterintEventRecord: WaterintEventRecord.timestamp)
@@ -302,3 +541,297 @@ class StoreClassesTest(unittest.TestCase):
         self.mock_cursor.fetchall.return_value = []
         watering_event_data = store.get()
         self.assertEqual(watering_event_data, [])
+
+
+class TimeRangeQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.connection = db_store.open_or_create_db(
+            os.path.join(self._temp_dir, 'test.db'))
+        self.store = db_store.TemperatureStore(self.connection)
+        self.records = [
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, minute, 0, tzinfo=pytz.utc),
+                temperature=20.0 + minute) for minute in (53, 51, 52, 54)
+        ]
+        self.store.insert_many(self.records)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self._temp_dir)
+
+    def test_get_without_arguments_returns_all_records_in_order(self):
+        self.assertEqual(
+            sorted(self.records, key=lambda record: record.timestamp),
+            self.store.get())
+
+    def test_get_start_is_inclusive_and_end_is_exclusive(self):
+        self.assertEqual([72.0, 73.0], [
+            record.temperature
+            for record in self.store.get(
+                start=datetime.datetime(
+                    2016, 7, 23, 10, 52, 0, tzinfo=pytz.utc),
+                end=datetime.datetime(
+                    2016, 7, 23, 10, 54, 0, tzinfo=pytz.utc))
+        ])
+
+    def test_get_newest_records_with_limit(self):
+        self.assertEqual([74.0, 73.0], [
+            record.temperature
+            for record in self.store.get(limit=2, order='desc')
+        ])
+
+    def test_iter_records_streams_records_in_chunks(self):
+        self.assertEqual(
+            sorted(self.records, key=lambda record: record.timestamp),
+            list(self.store.iter_records(chunk_size=3)))
+
+    def test_iter_records_time_range_with_raw_timestamps(self):
+        records = self.store.iter_records(
+            start=datetime.datetime(2016, 7, 23, 10, 52, 0, tzinfo=pytz.utc),
+            end=datetime.datetime(2016, 7, 23, 10, 53, 0, tzinfo=pytz.utc),
+            raw_timestamps=True)
+        self.assertEqual([
+            db_store.TemperatureRecord(timestamp=1469271120, temperature=72.0)
+        ], list(records))
+
+    def test_iter_records_is_lazy(self):
+        records = self.store.iter_records(chunk_size=1)
+        self.assertEqual(71.0, next(records).temperature)
+        # Other queries on the store can run while iterating.
+        self.assertEqual(4, len(self.store.get()))
+        self.assertEqual(72.0, next(records).temperature)
+
+    def test_iter_records_rejects_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            list(self.store.iter_records(chunk_size=0))
+
+
+class WateringEventStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.connection = db_store.open_or_create_db(
+            os.path.join(self._temp_dir, 'test.db'))
+        self.store = db_store.WateringEventStore(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self._temp_dir)
+
+    def _insert_events(self):
+        self.store.insert_many([
+            db_store.WateringEventRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, hour, 0, 0, tzinfo=pytz.utc),
+                water_pumped=100.0 * hour) for hour in (11, 9, 12, 10)
+        ])
+
+    def test_latest_returns_None_when_store_is_empty(self):
+        self.assertIsNone(self.store.latest())
+
+    def test_latest_returns_newest_event(self):
+        self._insert_events()
+        self.assertEqual(
+            db_store.WateringEventRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 12, 0, 0, tzinfo=pytz.utc),
+                water_pumped=1200.0), self.store.latest())
+
+    def test_total_water_pumped_returns_zero_when_store_is_empty(self):
+        self.assertEqual(0.0, self.store.total_water_pumped())
+
+    def test_total_water_pumped_over_all_events(self):
+        self._insert_events()
+        self.assertEqual(4200.0, self.store.total_water_pumped())
+
+    def test_total_water_pumped_within_time_range(self):
+        self._insert_events()
+        self.assertEqual(2100.0,
+                         self.store.total_water_pumped(
+                             start=datetime.datetime(
+                                 2016, 7, 23, 10, 0, 0, tzinfo=pytz.utc),
+                             end=datetime.datetime(
+                                 2016, 7, 23, 12, 0, 0, tzinfo=pytz.utc)))
+
+
+class RollupStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.connection = db_store.open_or_create_db(
+            os.path.join(self._temp_dir, 'test.db'))
+        self.store = db_store.RollupStore(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self._temp_dir)
+
+    def test_aggregates_readings_within_hour(self):
+        self.store.add([
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 5, 0, tzinfo=pytz.utc),
+                temperature=20.0),
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 35, 0, tzinfo=pytz.utc),
+                temperature=24.0),
+        ])
+        # A later batch updates the same rollup without rescanning.
+        self.store.add([
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 55, 0, tzinfo=pytz.utc),
+                temperature=19.0),
+        ])
+        self.assertEqual([
+            db_store.RollupRecord(
+                period_start=datetime.datetime(
+                    2016, 7, 23, 10, 0, 0, tzinfo=pytz.utc),
+                count=3,
+                minimum=19.0,
+                maximum=24.0,
+                mean=21.0)
+        ], self.store.get_rollup('temperature', 'hour'))
+
+    def test_daily_rollups_span_hours_and_sensors_are_separate(self):
+        self.store.add([
+            db_store.LightRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 1, 0, 0, tzinfo=pytz.utc),
+                light=10.0),
+            db_store.LightRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 23, 0, 0, tzinfo=pytz.utc),
+                light=30.0),
+            db_store.HumidityRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 1, 0, 0, tzinfo=pytz.utc),
+                humidity=50.0),
+            db_store.WateringEventRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 1, 0, 0, tzinfo=pytz.utc),
+                water_pumped=200.0),
+        ])
+        self.assertEqual([
+            db_store.RollupRecord(
+                period_start=datetime.datetime(
+                    2016, 7, 23, 0, 0, 0, tzinfo=pytz.utc),
+                count=2,
+                minimum=10.0,
+                maximum=30.0,
+                mean=20.0)
+        ], self.store.get_rollup('light', 'day'))
+        self.assertEqual(2, len(self.store.get_rollup('light', 'hour')))
+        self.assertEqual(1, len(self.store.get_rollup('humidity', 'day')))
+
+    def test_coalesced_record_counts_every_merged_reading(self):
+        self.store.add([
+            db_store.CoalescedRecord(
+                record=db_store.TemperatureRecord(
+                    timestamp=datetime.datetime(
+                        2016, 7, 23, 10, 5, 0, tzinfo=pytz.utc),
+                    temperature=21.0),
+                count=3,
+                minimum=19.0,
+                maximum=24.0),
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 55, 0, tzinfo=pytz.utc),
+                temperature=25.0),
+        ])
+        self.assertEqual([
+            db_store.RollupRecord(
+                period_start=datetime.datetime(
+                    2016, 7, 23, 10, 0, 0, tzinfo=pytz.utc),
+                count=4,
+                minimum=19.0,
+                maximum=25.0,
+                mean=22.0)
+        ], self.store.get_rollup('temperature', 'hour'))
+
+    def test_get_rollup_time_range(self):
+        self.store.add([
+            db_store.WaterLevelRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, hour, 0, 0, tzinfo=pytz.utc),
+                water_level=float(hour)) for hour in range(5)
+        ])
+        self.assertEqual([1.0, 2.0], [
+            rollup.mean
+            for rollup in self.store.get_rollup(
+                'water_level',
+                'hour',
+                start=datetime.datetime(2016, 7, 23, 1, 0, 0, tzinfo=pytz.utc),
+                end=datetime.datetime(2016, 7, 23, 3, 0, 0, tzinfo=pytz.utc))
+        ])
+
+    def test_get_rollup_rejects_unknown_sensor_or_resolution(self):
+        with self.assertRaises(ValueError):
+            self.store.get_rollup('water_pumped', 'hour')
+        with self.assertRaises(ValueError):
+            self.store.get_rollup('temperature', 'week')
+
+    def test_rollups_are_not_purged_by_retention(self):
+        self.store.add([
+            db_store.TemperatureRecord(
+                timestamp=datetime.datetime(
+                    2016, 7, 23, 10, 5, 0, tzinfo=pytz.utc),
+                temperature=20.0)
+        ])
+        db_store.purge_expired_records(
+            self.connection, db_store.DEFAULT_RETENTION,
+            datetime.datetime(2017, 7, 23, 10, 5, 0, tzinfo=pytz.utc))
+        self.assertEqual(1, len(self.store.get_rollup('temperature', 'day')))
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temperature_a = db_store.TemperatureRecord(
+            timestamp=datetime.datetime(2016, 7, 23, 10, 5, 0, tzinfo=pytz.utc),
+            temperature=20.0)
+        self.temperature_b = db_store.TemperatureRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 20, 0, tzinfo=pytz.utc),
+            temperature=24.0)
+        self.temperature_c = db_store.TemperatureRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 35, 0, tzinfo=pytz.utc),
+            temperature=25.0)
+
+    def test_coalesce_keeps_first_timestamp_and_mean(self):
+        self.assertEqual(
+            db_store.CoalescedRecord(
+                record=self.temperature_a._replace(temperature=22.0),
+                count=2,
+                minimum=20.0,
+                maximum=24.0),
+            db_store.coalesce(self.temperature_a, self.temperature_b))
+
+    def test_coalesce_weights_coalesced_records_by_count(self):
+        coalesced = db_store.coalesce(
+            db_store.coalesce(self.temperature_a, self.temperature_b),
+            self.temperature_c)
+        self.assertEqual(3, coalesced.count)
+        self.assertAlmostEqual(23.0, coalesced.record.temperature)
+        self.assertEqual(20.0, coalesced.minimum)
+        self.assertEqual(25.0, coalesced.maximum)
+
+    def test_coalesce_rejects_readings_from_different_sensors(self):
+        with self.assertRaises(ValueError):
+            db_store.coalesce(
+                self.temperature_a,
+                db_store.HumidityRecord(
+                    timestamp=self.temperature_b.timestamp, humidity=50.0))
+        with self.assertRaises(ValueError):
+            db_store.coalesce(
+                db_store.WateringEventRecord(
+                    timestamp=self.temperature_a.timestamp,
+                    water_pumped=200.0),
+                db_store.WateringEventRecord(
+                    timestamp=self.temperature_b.timestamp,
+                    water_pumped=200.0))
@@ -0,0 +1,185 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import drain_sensor
+from greenpithumb import hardware_sim
+from greenpithumb import pi_io
+from greenpithumb import vegetronix_vh400
+from greenpithumb import water_level_sensor
+from greenpithumb import wiring_config_parser
+
+TIMESTAMP_NOON = datetime.datetime(2016, 7, 23, 12, 0, 0, tzinfo=pytz.utc)
+TIMESTAMP_MIDNIGHT = datetime.datetime(2016, 7, 23, 0, 0, 0, tzinfo=pytz.utc)
+
+_WIRING_CONFIG = """
+[gpio_pins]
+pump: 26
+dht22: 21
+sonar: 20
+soil_moisture_power: 16
+drain_sensor_power: 12
+mcp3008_clk: 18
+mcp3008_dout: 23
+mcp3008_din: 24
+mcp3008_cs_shdn: 25
+
+[adc_channels]
+soil_moisture_sensor: 7
+drain_sensor: 6
+light_sensor: 0
+"""
+
+
+class PlantModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = TIMESTAMP_NOON
+        self.model = hardware_sim.PlantModel(
+            self.mock_clock,
+            reservoir_liters=20.0,
+            soil_moisture=30.0,
+            rng=random.Random(0))
+
+    def advance(self, **kwargs):
+        self.mock_clock.now.return_value += datetime.timedelta(**kwargs)
+
+    def test_soil_dries_over_time(self):
+        self.advance(days=1)
+        self.assertLess(self.model.soil_moisture(), 30.0)
+        self.assertEqual(20.0, self.model.reservoir_liters())
+
+    def test_pump_moves_water_from_reservoir_to_soil(self):
+        self.model.set_pump(True)
+        self.advance(seconds=60)
+        self.model.set_pump(False)
+        self.assertAlmostEqual(
+            20.0 - hardware_sim.PUMP_RATE_ML_PER_SEC * 60 / 1000.0,
+            self.model.reservoir_liters())
+        self.assertGreater(self.model.soil_moisture(), 30.0)
+
+    def test_saturated_soil_drains(self):
+        self.assertFalse(self.model.water_draining())
+        self.model.set_pump(True)
+        self.advance(minutes=5)
+        self.model.set_pump(False)
+        self.assertEqual(hardware_sim.SATURATION_MOISTURE,
+                         self.model.soil_moisture())
+        self.assertTrue(self.model.water_draining())
+        self.advance(hours=1)
+        self.assertFalse(self.model.water_draining())
+
+    def test_light_follows_the_sun(self):
+        self.assertAlmostEqual(100.0, self.model.light())
+        self.mock_clock.now.return_value = TIMESTAMP_MIDNIGHT
+        self.assertEqual(0.0, self.model.light())
+
+
+class SimulatedHardwareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = TIMESTAMP_NOON
+        self.wiring_config = wiring_config_parser.parse(_WIRING_CONFIG)
+        self.hardware = hardware_sim.SimulatedHardware(
+            self.wiring_config, self.mock_clock, rng=random.Random(0))
+        self.io = pi_io.IO(self.hardware.gpio())
+
+    def test_pump_pin_drives_plant_model_pump(self):
+        self.io.turn_pin_on(self.wiring_config.gpio_pins.pump)
+        self.mock_clock.now.return_value += datetime.timedelta(seconds=60)
+        self.io.turn_pin_off(self.wiring_config.gpio_pins.pump)
+        self.assertLess(self.hardware.model.reservoir_liters(), 20.0)
+
+    def test_sonar_echo_reads_reservoir_level(self):
+        sensor = water_level_sensor.WaterLevelSensor(
+            self.io, self.wiring_config.gpio_pins.sonar)
+        self.assertAlmostEqual(20.0, sensor.water_level(), delta=1.0)
+
+    def test_sonar_without_trigger_reads_low(self):
+        self.assertEqual(0,
+                         self.io.read_pin(self.wiring_config.gpio_pins.sonar))
+
+    def test_adc_channels_read_plant_model(self):
+        adc = self.hardware.adc()
+        channels = self.wiring_config.adc_channels
+        soil_moisture_sensor = vegetronix_vh400.SoilMoistureSensor(
+            adc, self.io, channels.soil_moisture_sensor,
+            self.wiring_config.gpio_pins.soil_moisture_power)
+        self.assertAlmostEqual(
+            30.0,
+            soil_moisture_sensor.calc_vwc(
+                adc.read_adc(channels.soil_moisture_sensor) / 100.0),
+            delta=1.0)
+        self.assertAlmostEqual(
+            drain_sensor.DRY_VALUE,
+            adc.read_adc(channels.drain_sensor),
+            delta=10)
+        self.assertGreater(
+            adc.read_adc(channels.light_sensor),
+            hardware_sim.ADC_MAX_VALUE - 10)
+
+    def test_adc_script_overrides_model_until_exhausted(self):
+        adc = self.hardware.adc()
+        light_channel = self.wiring_config.adc_channels.light_sensor
+        adc.script(light_channel, [100, 200])
+        self.assertEqual(100, adc.read_adc(light_channel))
+        self.assertEqual(200, adc.read_adc(light_channel))
+        self.assertGreater(
+            adc.read_adc(light_channel), hardware_sim.ADC_MAX_VALUE - 10)
+
+    def test_dht22_reads_model_air(self):
+        humidity, temperature = self.hardware.dht22_read_func()()
+        self.assertAlmostEqual(55.0, humidity, delta=10.0)
+        self.assertAlmostEqual(21.0, temperature, delta=5.0)
+        self.mock_clock.wait.assert_called()
+
+
+class SimulatedDht22Test(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_model = mock.Mock()
+        self.mock_model.humidity.return_value = 50.0
+        self.mock_model.temperature.return_value = 20.0
+
+    def test_read_returns_None_when_every_attempt_fails(self):
+        dht22 = hardware_sim.SimulatedDht22(
+            self.mock_model, self.mock_clock, failure_rate=1.0)
+        self.assertEqual((None, None), dht22.read())
+        # Each failed attempt but the last waits out the retry delay.
+        self.assertEqual(2 * hardware_sim.DHT22_RETRIES - 1,
+                         self.mock_clock.wait.call_count)
+
+    def test_read_succeeds_without_failures(self):
+        dht22 = hardware_sim.SimulatedDht22(
+            self.mock_model, self.mock_clock, failure_rate=0.0)
+        self.assertEqual((50.0, 20.0), dht22.read())
+        self.assertEqual(1, self.mock_clock.wait.call_count)
+
+
+class FakeCameraTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_capture_writes_placeholder_image(self):
+        mock_clock = mock.Mock()
+        camera = hardware_sim.FakeCamera(mock_clock, capture_seconds=1.5)
+        path = os.path.join(self._temp_dir, 'photo.jpg')
+        camera.capture(path, resize=(640, 480))
+        mock_clock.wait.assert_called_once_with(1.5)
+        with open(path, 'rb') as image_file:
+            self.assertTrue(image_file.read().startswith('\xff\xd8'))
+        camera.close()
+        self.assertTrue(camera.closed)
@@ -0,0 +1,71 @@
+import unittest
+
+from greenpithumb import poll_stats
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.histogram = poll_stats.LatencyHistogram(buckets=(0.1, 1.0, 10.0))
+
+    def test_empty_histogram(self):
+        self.assertEqual(0, self.histogram.count)
+        self.assertEqual(0.0, self.histogram.mean())
+        self.assertEqual(0.0, self.histogram.percentile(50))
+
+    def test_percentile_is_upper_bound_of_bucket(self):
+        for latency in (0.05, 0.5, 0.6, 0.7, 5.0):
+            self.histogram.add(latency)
+        self.assertEqual(1.0, self.histogram.percentile(50))
+        self.assertEqual(5.0, self.histogram.percentile(99))
+        self.assertEqual(5.0, self.histogram.maximum)
+        self.assertAlmostEqual(1.37, self.histogram.mean())
+
+    def test_overflow_percentile_is_maximum(self):
+        self.histogram.add(0.05)
+        self.histogram.add(42.0)
+        self.assertEqual(42.0, self.histogram.percentile(99))
+        self.assertEqual([(0.1, 1), (1.0, 0), (10.0, 0), (None, 1)],
+                         self.histogram.bucket_counts())
+
+
+class WorkerStatsTest(unittest.TestCase):
+
+    def test_snapshot_summarizes_polls(self):
+        stats = poll_stats.WorkerStats('DummyPollWorker')
+        stats.record_poll(
+            start_delay=0.5,
+            latency=2.0,
+            publish_seconds=0.25,
+            skipped_ticks=0,
+            failed=False,
+            queue_depth=3)
+        stats.record_poll(
+            start_delay=1.5,
+            latency=4.0,
+            publish_seconds=0.75,
+            skipped_ticks=2,
+            failed=True,
+            queue_depth=1)
+        snapshot = stats.snapshot()
+        self.assertEqual(2, snapshot['polls'])
+        self.assertEqual(1, snapshot['failures'])
+        self.assertEqual(1, snapshot['missed_deadlines'])
+        self.assertEqual(2, snapshot['skipped_ticks'])
+        self.assertEqual(3.0, snapshot['latency_mean'])
+        self.assertEqual(4.0, snapshot['latency_max'])
+        self.assertEqual(1.0, snapshot['start_delay_mean'])
+        self.assertEqual(5.0, snapshot['hardware_seconds'])
+        self.assertEqual(1.0, snapshot['publish_seconds'])
+        self.assertEqual(1, snapshot['queue_depth'])
+        self.assertEqual(3, snapshot['max_queue_depth'])
+
+
+class PollStatsTest(unittest.TestCase):
+
+    def test_snapshot_includes_every_registered_worker(self):
+        registry = poll_stats.PollStats()
+        registry.register(poll_stats.WorkerStats('FooPollWorker'))
+        registry.register(poll_stats.WorkerStats('BarPollWorker'))
+        self.assertEqual(['BarPollWorker', 'FooPollWorker'],
+                         sorted(registry.snapshot().keys()))
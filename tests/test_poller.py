@@ -1,14 +1,22 @@
 import contextlib
 import datetime
 import Queue
+import select
 import threading
+import time
 import unittest
 
 import mock
 import pytz
 
+from greenpithumb import clock
 from greenpithumb import db_store
+from greenpithumb import drain_sensor
+from greenpithumb import poll_stats
 from greenpithumb import poller
+from greenpithumb import pump
+from greenpithumb import read_executor
+from greenpithumb import vegetronix_vh400
 
 TEST_TIMEOUT_SECONDS = 0.5
 TIMESTAMP_A = datetime.datetime(2016, 7, 23, 10, 51, 9, 928000, tzinfo=pytz.utc)
@@ -111,6 +119,481 @@ class SchedulerTest(unittest.TestCase):
             scheduler.last_poll_time())
 
 
+class SchedulerNextPollTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.scheduler = poller.Scheduler(
+            self.mock_clock, poll_interval=datetime.timedelta(minutes=5))
+
+    def test_next_poll_time_rounds_up_to_interval(self):
+        self.mock_clock.now.return_value = datetime.datetime(
+            2017, 4, 9, 11, 43, 29, tzinfo=pytz.utc)
+        self.assertEqual(
+            datetime.datetime(2017, 4, 9, 11, 45, 0, tzinfo=pytz.utc),
+            self.scheduler.next_poll_time())
+        self.mock_clock.wait.assert_not_called()
+
+    def test_next_poll_time_skips_last_poll_time(self):
+        self.mock_clock.now.return_value = datetime.datetime(
+            2017, 4, 9, 11, 45, 0, tzinfo=pytz.utc)
+        self.scheduler.set_last_poll_time(
+            datetime.datetime(2017, 4, 9, 11, 45, 0, tzinfo=pytz.utc))
+        self.assertEqual(
+            datetime.datetime(2017, 4, 9, 11, 50, 0, tzinfo=pytz.utc),
+            self.scheduler.next_poll_time())
+        self.assertEqual(
+            datetime.datetime(2017, 4, 9, 11, 45, 0, tzinfo=pytz.utc),
+            self.scheduler.last_poll_time())
+
+
+class AdaptiveSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = datetime.datetime(
+            2017, 4, 9, 11, 43, 29, tzinfo=pytz.utc)
+        self.fast_polling = False
+        self.scheduler = poller.AdaptiveScheduler(
+            self.mock_clock,
+            min_poll_interval=datetime.timedelta(minutes=5),
+            max_poll_interval=datetime.timedelta(minutes=20),
+            tolerance=1.0,
+            fast_polling_func=lambda: self.fast_polling)
+
+    def test_starts_at_minimum_interval(self):
+        self.assertEqual(
+            datetime.timedelta(minutes=5), self.scheduler.poll_interval())
+
+    def test_stable_readings_double_interval_up_to_maximum(self):
+        intervals = []
+        for reading in (50.0, 50.5, 50.0, 51.0, 50.5):
+            self.scheduler.record_reading(reading)
+            intervals.append(self.scheduler.poll_interval())
+        self.assertEqual([
+            datetime.timedelta(minutes=5),
+            datetime.timedelta(minutes=10),
+            datetime.timedelta(minutes=20),
+            datetime.timedelta(minutes=20),
+            datetime.timedelta(minutes=20),
+        ], intervals)
+
+    def test_changing_reading_resets_interval_to_minimum(self):
+        for reading in (50.0, 50.0, 50.0):
+            self.scheduler.record_reading(reading)
+        self.scheduler.record_reading(52.0)
+        self.assertEqual(
+            datetime.timedelta(minutes=5), self.scheduler.poll_interval())
+
+    def test_fast_polling_uses_minimum_interval(self):
+        for reading in (50.0, 50.0, 50.0):
+            self.scheduler.record_reading(reading)
+        self.fast_polling = True
+        self.assertEqual(
+            datetime.timedelta(minutes=5), self.scheduler.poll_interval())
+        self.fast_polling = False
+        self.assertEqual(
+            datetime.timedelta(minutes=20), self.scheduler.poll_interval())
+
+    def test_next_poll_time_aligns_to_current_interval(self):
+        for reading in (50.0, 50.0, 50.0):
+            self.scheduler.record_reading(reading)
+        self.assertEqual(
+            datetime.datetime(2017, 4, 9, 12, 0, 0, tzinfo=pytz.utc),
+            self.scheduler.next_poll_time())
+
+    def test_rejects_maximum_interval_shorter_than_minimum(self):
+        with self.assertRaises(ValueError):
+            poller.AdaptiveScheduler(
+                self.mock_clock,
+                min_poll_interval=datetime.timedelta(minutes=5),
+                max_poll_interval=datetime.timedelta(minutes=1),
+                tolerance=1.0)
+
+
+class PollWorkerStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_scheduler = mock.Mock()
+        self.mock_scheduler.poll_interval.return_value = datetime.timedelta(
+            minutes=5)
+        self.record_queue = Queue.Queue()
+        self.mock_mqtt_client = mock.Mock()
+        self.mock_sensor = mock.Mock()
+        self.mock_sensor.temperature.return_value = 21.0
+        self.worker = poller._TemperaturePollWorker(
+            self.mock_scheduler, self.record_queue, self.mock_mqtt_client,
+            self.mock_sensor)
+
+    def test_poll_records_timing(self):
+        poll_time = datetime.datetime.now(tz=pytz.utc)
+        self.worker.poll(poll_time)
+        self.mock_scheduler.set_last_poll_time.assert_called_once_with(
+            poll_time)
+        stats = self.worker.stats.snapshot()
+        self.assertEqual(1, stats['polls'])
+        self.assertEqual(0, stats['failures'])
+        self.assertEqual(0, stats['skipped_ticks'])
+        self.assertEqual(1, stats['queue_depth'])
+
+    def test_poll_that_overruns_interval_skips_ticks(self):
+        self.worker.poll(
+            datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(
+                minutes=11))
+        stats = self.worker.stats.snapshot()
+        self.assertEqual(1, stats['missed_deadlines'])
+        self.assertEqual(2, stats['skipped_ticks'])
+
+    def test_failed_poll_is_recorded_and_raised(self):
+        self.mock_sensor.temperature.side_effect = ValueError('dummy error')
+        with self.assertRaises(ValueError):
+            self.worker.poll(datetime.datetime.now(tz=pytz.utc))
+        self.assertEqual(1, self.worker.stats.snapshot()['failures'])
+
+    def test_timed_out_read_is_recorded_and_not_raised(self):
+        mock_executor = mock.Mock()
+        mock_executor.read.side_effect = read_executor.ReadTimeoutError(
+            'dummy timeout')
+        worker = poller._TemperaturePollWorker(
+            self.mock_scheduler, self.record_queue, self.mock_mqtt_client,
+            self.mock_sensor, sensor_read_executor=mock_executor)
+        worker.poll(datetime.datetime.now(tz=pytz.utc))
+        mock_executor.read.assert_called_once_with(
+            '_TemperaturePollWorker', worker.read_timeout,
+            self.mock_sensor.temperature)
+        stats = worker.stats.snapshot()
+        self.assertEqual(1, stats['failures'])
+        self.assertEqual(1, stats['timeouts'])
+        self.assertTrue(self.record_queue.empty())
+
+    def test_quarantined_sensor_skips_poll(self):
+        mock_executor = mock.Mock()
+        mock_executor.read.side_effect = read_executor.QuarantinedError(
+            'dummy quarantine')
+        worker = poller._TemperaturePollWorker(
+            self.mock_scheduler, self.record_queue, self.mock_mqtt_client,
+            self.mock_sensor, sensor_read_executor=mock_executor)
+        worker.poll(datetime.datetime.now(tz=pytz.utc))
+        stats = worker.stats.snapshot()
+        self.assertEqual(0, stats['failures'])
+        self.assertEqual(1, stats['quarantined_polls'])
+        self.assertTrue(self.record_queue.empty())
+
+    def test_factory_registers_worker_stats(self):
+        registry = poll_stats.PollStats()
+        factory = poller.SensorPollerFactory(
+            lambda: self.mock_scheduler,
+            self.record_queue,
+            self.mock_mqtt_client,
+            poll_engine=mock.Mock(),
+            stats_registry=registry)
+        factory.create_temperature_poller(self.mock_sensor)
+        self.assertEqual(['_TemperaturePollWorker'], registry.snapshot().keys())
+
+
+class SoilWateringPollWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_scheduler = mock.Mock()
+        self.mock_scheduler.poll_interval.return_value = datetime.timedelta(
+            minutes=5)
+        self.mock_scheduler.last_poll_time.return_value = TIMESTAMP_A
+        self.record_queue = Queue.Queue()
+        self.mock_mqtt_client = mock.Mock()
+        self.mock_soil_moisture_sensor = mock.Mock()
+        self.mock_soil_moisture_sensor.soil_moisture.return_value = 100
+        self.mock_drain_sensor = mock.Mock()
+        self.mock_drain_sensor.water_present.return_value = False
+        self.mock_pump_manager = mock.Mock()
+        self.worker = poller._SoilWateringPollWorker(
+            self.mock_scheduler, self.record_queue, self.mock_mqtt_client,
+            self.mock_soil_moisture_sensor, self.mock_drain_sensor,
+            self.mock_pump_manager)
+
+    def poll(self):
+        self.worker.poll(datetime.datetime.now(tz=pytz.utc))
+        progress_func = (
+            self.mock_pump_manager.start_pump_event_if_needed.call_args[0][2])
+        return progress_func
+
+    def test_poll_starts_pump_event_without_recording_watering(self):
+        self.poll()
+        self.mock_pump_manager.start_pump_event_if_needed.assert_called_once_with(
+            100, self.mock_drain_sensor, mock.ANY)
+        self.assertEqual(
+            db_store.SoilMoistureRecord(TIMESTAMP_A, 100, False),
+            self.record_queue.get_nowait())
+        self.assertTrue(self.record_queue.empty())
+
+    def test_each_pump_burst_is_recorded(self):
+        progress_func = self.poll()
+        self.record_queue.get_nowait()
+        timestamp_b = TIMESTAMP_A + datetime.timedelta(seconds=30)
+        progress_func(pump.PumpProgress(pump.PUMPING, TIMESTAMP_A, 0, 0))
+        progress_func(pump.PumpProgress(pump.SOAKING, TIMESTAMP_A, 500, 500))
+        progress_func(pump.PumpProgress(pump.DONE, timestamp_b, 500, 1000))
+        self.assertEqual(
+            db_store.WateringEventRecord(TIMESTAMP_A, 500),
+            self.record_queue.get_nowait())
+        self.assertEqual(
+            db_store.WateringEventRecord(timestamp_b, 500),
+            self.record_queue.get_nowait())
+        self.assertTrue(self.record_queue.empty())
+        self.mock_mqtt_client.publish.assert_any_call('greenpi/pump_state',
+                                                      pump.PUMPING)
+        self.mock_mqtt_client.publish.assert_any_call('greenpi/ml_pumped',
+                                                      1000)
+
+    def test_stop_cancels_pump_event(self):
+        self.worker.stop()
+        self.mock_pump_manager.cancel_pump_event.assert_called_once_with()
+
+    def test_soil_and_drain_reads_time_out_separately(self):
+        mock_executor = mock.Mock()
+        mock_executor.read.side_effect = [100, False]
+        worker = poller._SoilWateringPollWorker(
+            self.mock_scheduler, self.record_queue, self.mock_mqtt_client,
+            self.mock_soil_moisture_sensor, self.mock_drain_sensor,
+            self.mock_pump_manager, sensor_read_executor=mock_executor)
+        worker.poll(datetime.datetime.now(tz=pytz.utc))
+        self.assertEqual([
+            mock.call('_SoilWateringPollWorker.soil_moisture',
+                      worker.read_timeout,
+                      self.mock_soil_moisture_sensor.soil_moisture),
+            mock.call('_SoilWateringPollWorker.water_present',
+                      worker.read_timeout,
+                      self.mock_drain_sensor.water_present),
+        ], mock_executor.read.call_args_list)
+
+    def test_sensors_powering_up_are_read_within_deadline(self):
+        mock_adc = mock.Mock()
+        mock_adc.read_adc.return_value = 100
+        mock_pi_io = mock.Mock()
+        executor = read_executor.ReadExecutor(clock.Clock())
+        self.addCleanup(executor.close)
+        worker = poller._SoilWateringPollWorker(
+            self.mock_scheduler,
+            self.record_queue,
+            self.mock_mqtt_client,
+            vegetronix_vh400.SoilMoistureSensor(mock_adc, mock_pi_io, 0, 5),
+            drain_sensor.DrainSensor(mock_adc, mock_pi_io, 1, 6),
+            self.mock_pump_manager,
+            sensor_read_executor=executor)
+        self.assertGreater(worker.read_timeout,
+                           vegetronix_vh400.STARTUP_SECONDS)
+        self.assertGreater(worker.read_timeout, drain_sensor.STARTUP_SECONDS)
+        worker.poll(datetime.datetime.now(tz=pytz.utc))
+        stats = worker.stats.snapshot()
+        self.assertEqual(0, stats['failures'])
+        self.assertEqual(0, stats['timeouts'])
+        self.assertIsInstance(self.record_queue.get_nowait(),
+                              db_store.SoilMoistureRecord)
+
+
+class PollEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime.datetime.now(tz=pytz.utc)
+        self.engine = poller.PollEngine(clock.Clock())
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def make_worker(self, poll_times, poll_side_effects=None):
+        """Creates a mock worker that polls at each of the given times.
+
+        After its last poll time, the worker's next poll is a day away. The
+        worker's done event is set once it has polled at every poll time.
+        """
+        worker = mock.Mock(resources=frozenset())
+        worker.next_poll_time.side_effect = (
+            poll_times + [self.now + datetime.timedelta(days=1)] * 100)
+        worker.done = threading.Event()
+        side_effects = list(poll_side_effects or [None] * len(poll_times))
+
+        def poll(_):
+            side_effect = side_effects.pop(0)
+            if not side_effects:
+                worker.done.set()
+            if side_effect:
+                raise side_effect
+
+        worker.poll.side_effect = poll
+        return worker
+
+    def wait_for_reschedule(self, workers):
+        """Waits until each worker has been rescheduled after one poll."""
+        for _ in range(10):
+            if all(worker.next_poll_time.call_count >= 2
+                   for worker in workers):
+                return
+            threading.Event().wait(TEST_TIMEOUT_SECONDS / 10)
+
+    def test_polls_worker_at_its_poll_times(self):
+        worker = self.make_worker([self.now, self.now])
+        self.engine.schedule(worker)
+        self.assertTrue(worker.done.wait(TEST_TIMEOUT_SECONDS))
+        self.assertEqual([mock.call(self.now), mock.call(self.now)],
+                         worker.poll.call_args_list)
+
+    def test_polls_workers_in_order_of_poll_time(self):
+        polls = []
+        later_worker = self.make_worker(
+            [self.now + datetime.timedelta(seconds=0.2)])
+        later_worker.poll.side_effect = lambda _: (polls.append('later'),
+                                                   later_worker.done.set())
+        sooner_worker = self.make_worker([self.now])
+        sooner_worker.poll.side_effect = lambda _: polls.append('sooner')
+        self.engine.schedule(later_worker)
+        self.engine.schedule(sooner_worker)
+        self.assertTrue(later_worker.done.wait(TEST_TIMEOUT_SECONDS))
+        self.assertEqual(['sooner', 'later'], polls)
+
+    def test_does_not_poll_unscheduled_worker(self):
+        worker = self.make_worker(
+            [self.now + datetime.timedelta(seconds=0.2)])
+        self.engine.schedule(worker)
+        self.engine.unschedule(worker)
+        self.assertFalse(worker.done.wait(TEST_TIMEOUT_SECONDS))
+        worker.poll.assert_not_called()
+
+    def test_continues_polling_after_failed_poll(self):
+        worker = self.make_worker(
+            [self.now, self.now],
+            poll_side_effects=[ValueError('dummy poll error'), None])
+        self.engine.schedule(worker)
+        self.assertTrue(worker.done.wait(TEST_TIMEOUT_SECONDS))
+        self.assertEqual(2, worker.poll.call_count)
+
+    def test_workers_sharing_a_resource_poll_back_to_back(self):
+        active = []
+        overlapped = []
+
+        def make_exclusive_worker():
+            worker = self.make_worker([self.now])
+
+            def poll(_):
+                active.append(worker)
+                if len(active) > 1:
+                    overlapped.append(worker)
+                threading.Event().wait(0.05)
+                active.remove(worker)
+                worker.done.set()
+
+            worker.poll.side_effect = poll
+            worker.resources = frozenset([poller.RESOURCE_ADC])
+            return worker
+
+        workers = [make_exclusive_worker() for _ in range(3)]
+        for worker in workers:
+            self.engine.schedule(worker)
+        for worker in workers:
+            self.assertTrue(worker.done.wait(TEST_TIMEOUT_SECONDS))
+        self.assertEqual([], overlapped)
+
+    def test_workers_without_shared_resources_poll_in_parallel(self):
+        started = [threading.Event(), threading.Event()]
+        workers = []
+        for resource in (poller.RESOURCE_ADC, poller.RESOURCE_SONAR):
+            worker = self.make_worker([self.now])
+            worker.resources = frozenset([resource])
+            workers.append(worker)
+
+        def make_poll(index):
+
+            def poll(_):
+                started[index].set()
+                # Each poll finishes only once the other has started.
+                if started[1 - index].wait(TEST_TIMEOUT_SECONDS):
+                    workers[index].done.set()
+
+            return poll
+
+        for index, worker in enumerate(workers):
+            worker.poll.side_effect = make_poll(index)
+            self.engine.schedule(worker)
+        for worker in workers:
+            self.assertTrue(worker.done.wait(TEST_TIMEOUT_SECONDS * 2))
+        self.wait_for_reschedule(workers)
+
+    def test_call_later_runs_callback_after_delay(self):
+        called = threading.Event()
+        self.engine.call_later(0.05, lambda value: called.set(), 'dummy')
+        self.assertTrue(called.wait(TEST_TIMEOUT_SECONDS))
+
+    def test_urgent_callback_runs_while_dispatch_threads_are_busy(self):
+        release_slow_jobs = threading.Event()
+        self.addCleanup(release_slow_jobs.set)
+        for _ in range(poller.DEFAULT_DISPATCH_THREADS):
+            self.engine.call_later(0.0, release_slow_jobs.wait)
+        not_urgent = threading.Event()
+        urgent = threading.Event()
+        self.engine.call_later(0.01, not_urgent.set)
+        self.engine.call_later(0.01, urgent.set, urgent=True)
+        self.assertTrue(urgent.wait(TEST_TIMEOUT_SECONDS))
+        self.assertFalse(not_urgent.is_set())
+        release_slow_jobs.set()
+        self.assertTrue(not_urgent.wait(TEST_TIMEOUT_SECONDS))
+
+    def test_call_later_passes_arguments_to_callback(self):
+        callback = mock.Mock()
+        called = threading.Event()
+        callback.side_effect = lambda *_: called.set()
+        self.engine.call_later(0.0, callback, 'a', 2)
+        self.assertTrue(called.wait(TEST_TIMEOUT_SECONDS))
+        callback.assert_called_once_with('a', 2)
+
+    def test_cancelled_callback_does_not_run(self):
+        callback = mock.Mock()
+        handle = self.engine.call_later(0.1, callback)
+        handle.cancel()
+        self.assertTrue(handle.cancelled())
+        threading.Event().wait(TEST_TIMEOUT_SECONDS)
+        callback.assert_not_called()
+
+    def test_callback_waits_for_poll_using_same_resource(self):
+        events = []
+        callback_done = threading.Event()
+        worker = self.make_worker([self.now])
+        worker.resources = frozenset([poller.RESOURCE_ADC])
+
+        def poll(_):
+            events.append('poll start')
+            threading.Event().wait(0.1)
+            events.append('poll end')
+
+        worker.poll.side_effect = poll
+        self.engine.schedule(worker)
+        self.engine.call_later(
+            0.05,
+            lambda: (events.append('callback'), callback_done.set()),
+            resources=[poller.RESOURCE_ADC])
+        self.assertTrue(callback_done.wait(TEST_TIMEOUT_SECONDS))
+        self.assertEqual(['poll start', 'poll end', 'callback'], events)
+
+    def test_call_later_rejects_unknown_keyword_arguments(self):
+        with self.assertRaises(TypeError):
+            self.engine.call_later(0.0, mock.Mock(), timeout=5)
+
+    def test_idle_engine_sleeps_until_next_poll(self):
+        worker = self.make_worker([self.now + datetime.timedelta(hours=1)])
+        with mock.patch.object(
+                select, 'select', wraps=select.select) as mock_select:
+            self.engine.schedule(worker)
+            time.sleep(0.2)
+        # The scheduler blocks in a single select() until the poll is due.
+        self.assertEqual(1, mock_select.call_count)
+
+    def test_stop_interrupts_wait_for_next_poll(self):
+        worker = self.make_worker([self.now + datetime.timedelta(hours=1)])
+        self.engine.schedule(worker)
+        stopper = threading.Thread(target=self.engine.stop)
+        stopper.start()
+        stopper.join(TEST_TIMEOUT_SECONDS)
+        self.assertFalse(stopper.is_alive())
+        worker.poll.assert_not_called()
+
+
 class PollerTest(unittest.TestCase):
 
     def setUp(self):
@@ -214,7 +697,9 @@ class SoilWateringPollerTest(PollerTest):
                     self.mock_pump_manager)) as soil_watering_poller:
             self.mock_is_poll_time = True
             self.mock_scheduler.last_poll_time.return_value = TIMESTAMP_A
-            self.mock_pump_manager.pump_if_needed.return_value = 200
+            self.mock_pump_manager.start_pump_event_if_needed.side_effect = (
+                lambda moisture, drain_sensor, progress_func: progress_func(
+                    pump.PumpProgress(pump.DONE, TIMESTAMP_A, 200, 200)))
             self.mock_soil_moisture_sensor.soil_moisture.return_value = 100
 
             soil_watering_poller.start_polling_async()
@@ -233,7 +718,8 @@ class SoilWateringPollerTest(PollerTest):
         self.assertItemsEqual(records_expected, records_actual)
         # Should be no more items in the queue.
         self.assertTrue(self.record_queue.empty())
-        self.mock_pump_manager.pump_if_needed.assert_called_with(100)
+        self.mock_pump_manager.start_pump_event_if_needed.assert_called_with(
+            100, mock.ANY, mock.ANY)
 
     def test_soil_watering_poller_when_pump_not_run(self):
         with contextlib.closing(
@@ -242,7 +728,8 @@ class SoilWateringPollerTest(PollerTest):
                     self.mock_pump_manager)) as soil_watering_poller:
             self.mock_is_poll_time = True
             self.mock_scheduler.last_poll_time.return_value = TIMESTAMP_A
-            self.mock_pump_manager.pump_if_needed.return_value = 0
+            self.mock_pump_manager.start_pump_event_if_needed.return_value = (
+                False)
             self.mock_soil_moisture_sensor.soil_moisture.return_value = 500
 
             soil_watering_poller.start_polling_async()
@@ -254,7 +741,8 @@ class SoilWateringPollerTest(PollerTest):
             self.record_queue.get(block=True, timeout=TEST_TIMEOUT_SECONDS))
         # Should be no more items in the queue.
         self.assertTrue(self.record_queue.empty())
-        self.mock_pump_manager.pump_if_needed.assert_called_with(500)
+        self.mock_pump_manager.start_pump_event_if_needed.assert_called_with(
+            500, mock.ANY, mock.ANY)
 
 
 class CameraPollerTest(PollerTest):
@@ -13,28 +13,23 @@ class TestPumpHistory(unittest.TestCase):
         self.mock_watering_event_store = mock.Mock()
 
     def test_last_pump_time_returns_None_when_db_is_empty(self):
-        self.mock_watering_event_store.get.return_value = []
+        self.mock_watering_event_store.latest.return_value = None
         self.assertEqual(
             None, pump_history.last_pump_time(self.mock_watering_event_store))
 
-    def test_last_pump_time_returns_timestamp_when_only_one_event_in_db(self):
-        self.mock_watering_event_store.get.return_value = [
-            mock.Mock(timestamp=datetime.datetime(
-                2017, 1, 1, 12, 45, 9, 123456, tzinfo=pytz.utc))
-        ]
+    def test_last_pump_time_returns_timestamp_of_latest_event(self):
+        self.mock_watering_event_store.latest.return_value = mock.Mock(
+            timestamp=datetime.datetime(2017, 3, 2, 0, 15, 59, tzinfo=pytz.utc))
         self.assertEqual(
-            datetime.datetime(2017, 1, 1, 12, 45, 9, 123456, tzinfo=pytz.utc),
-            pump_history.last_pump_time(self.mock_watering_event_store))
-
-    def test_last_pump_time_returns_timestamp_when_db_has_many_events(self):
-        self.mock_watering_event_store.get.return_value = [
-            mock.Mock(timestamp=datetime.datetime(
-                2016, 1, 1, 12, 45, 9, 123456, tzinfo=pytz.utc)),
-            mock.Mock(timestamp=datetime.datetime(
-                2017, 3, 2, 0, 15, 59, 987654, tzinfo=pytz.utc)),
-            mock.Mock(timestamp=datetime.datetime(
-                2015, 12, 5, 12, 45, 9, 555555, tzinfo=pytz.utc)),
-        ]
-        self.assertEqual(
-            datetime.datetime(2017, 3, 2, 0, 15, 59, 987654, tzinfo=pytz.utc),
+            datetime.datetime(2017, 3, 2, 0, 15, 59, tzinfo=pytz.utc),
             pump_history.last_pump_time(self.mock_watering_event_store))
+        self.mock_watering_event_store.get.assert_not_called()
+
+    def test_water_pumped_since_totals_events_from_start(self):
+        self.mock_watering_event_store.total_water_pumped.return_value = 350.0
+        start = datetime.datetime(2017, 3, 1, 0, 15, 59, tzinfo=pytz.utc)
+        self.assertEqual(350.0,
+                         pump_history.water_pumped_since(
+                             self.mock_watering_event_store, start))
+        self.mock_watering_event_store.total_water_pumped.assert_called_once_with(
+            start=start)
@@ -0,0 +1,253 @@
+import datetime
+import threading
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import clock
+from greenpithumb import pump
+from greenpithumb import read_executor
+from greenpithumb import simulation
+
+START_TIME = datetime.datetime(2016, 7, 23, 10, 0, 0, tzinfo=pytz.utc)
+PUMP_PIN = 26
+
+
+class PumpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(START_TIME)
+        self.mock_pi_io = mock.Mock()
+        self.pump = pump.Pump(self.mock_pi_io, self.clock, PUMP_PIN)
+
+    def test_pump_water_runs_for_dose(self):
+        self.pump.pump_water(500)
+        self.mock_pi_io.turn_pin_on.assert_called_once_with(PUMP_PIN)
+        self.mock_pi_io.turn_pin_off.assert_called_once_with(PUMP_PIN)
+        self.assertAlmostEqual(
+            self.pump.seconds_to_pump(500),
+            (self.clock.now() - START_TIME).total_seconds(),
+            places=3)
+
+    def test_turn_off_returns_amount_pumped_while_on(self):
+        self.pump.turn_on()
+        self.clock.wait(self.pump.seconds_to_pump(250))
+        self.assertAlmostEqual(250.0, self.pump.turn_off(), places=3)
+
+    def test_turn_off_when_off_returns_zero(self):
+        self.assertEqual(0.0, self.pump.turn_off())
+        self.mock_pi_io.turn_pin_off.assert_called_once_with(PUMP_PIN)
+
+    def test_negative_amount_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            self.pump.pump_water(-1)
+
+
+class PumpManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(START_TIME)
+        self.simulator = simulation.Simulator(self.clock)
+        self.mock_pi_io = mock.Mock()
+        self.pump = pump.Pump(self.mock_pi_io, self.clock, PUMP_PIN)
+        self.mock_pump_scheduler = mock.Mock()
+        self.mock_pump_scheduler.is_sleep_window.return_value = False
+        self.mock_timer = mock.Mock()
+        self.mock_timer.expired.return_value = False
+        self.mock_water_level_sensor = mock.Mock()
+        self.mock_water_level_sensor.water_level.return_value = 20.0
+        self.mock_drain_sensor = mock.Mock()
+        self.mock_drain_sensor.water_present.return_value = False
+        self.mock_send_notification = mock.Mock()
+        self.progress = []
+
+    def make_pump_manager(self,
+                          total_pump_amount,
+                          poll_engine=None,
+                          sensor_read_executor=None):
+        return pump.PumpManager(
+            self.pump,
+            self.mock_pump_scheduler,
+            moisture_threshold=25,
+            total_pump_amount=total_pump_amount,
+            timer=self.mock_timer,
+            water_level_sensor=self.mock_water_level_sensor,
+            utc_clock=self.clock,
+            send_notification=self.mock_send_notification,
+            poll_engine=poll_engine,
+            sensor_read_executor=sensor_read_executor)
+
+    def start_event(self, pump_manager, moisture=20):
+        return pump_manager.start_pump_event_if_needed(
+            moisture, self.mock_drain_sensor, self.progress.append)
+
+    def progress_states(self):
+        return [(p.state, p.ml_pumped, p.total_ml_pumped)
+                for p in self.progress]
+
+    def test_pump_event_runs_on_engine_without_blocking(self):
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.assertTrue(self.start_event(pump_manager))
+        self.assertEqual(START_TIME, self.clock.now())
+        self.assertTrue(pump_manager.pump_event_in_progress())
+        self.mock_pi_io.turn_pin_on.assert_not_called()
+
+        self.simulator.run_for(datetime.timedelta(seconds=1))
+        self.assertEqual(pump.PUMPING, pump_manager.pump_state())
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        self.assertEqual(pump.IDLE, pump_manager.pump_state())
+        self.assertFalse(pump_manager.pump_event_in_progress())
+        self.assertEqual([
+            (pump.CHECKING_DRAIN, 0, 0),
+            (pump.PUMPING, 0, 0),
+            (pump.SOAKING, 500, 500),
+            (pump.CHECKING_DRAIN, 0, 500),
+            (pump.PUMPING, 0, 500),
+            (pump.DONE, 500, 1000),
+        ], self.progress_states())
+        self.assertEqual(2, self.mock_pi_io.turn_pin_on.call_count)
+        self.assertEqual(2, self.mock_pi_io.turn_pin_off.call_count)
+        self.mock_timer.reset.assert_called_once_with()
+
+    def test_soak_lasts_interval_duration(self):
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        soak_start = self.progress[2].timestamp
+        soak_end = self.progress[3].timestamp
+        self.assertEqual(
+            datetime.timedelta(seconds=pump.INTERVAL_DURATION),
+            soak_end - soak_start)
+
+    def test_water_at_start_cancels_event(self):
+        self.mock_drain_sensor.water_present.return_value = True
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        self.mock_pi_io.turn_pin_on.assert_not_called()
+        self.assertEqual([(pump.CHECKING_DRAIN, 0, 0), (pump.DONE, 0, 0)],
+                         self.progress_states())
+        self.assertFalse(pump_manager.pump_event_in_progress())
+
+    def test_water_during_event_pumps_one_more_time(self):
+        self.mock_drain_sensor.water_present.side_effect = [False, True]
+        pump_manager = self.make_pump_manager(5000, self.simulator)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=10))
+        self.assertEqual(2, self.mock_pi_io.turn_pin_on.call_count)
+        self.assertEqual((pump.DONE, 500, 1000), self.progress_states()[-1])
+
+    def test_no_new_event_while_one_is_in_progress(self):
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.assertTrue(self.start_event(pump_manager))
+        self.assertFalse(self.start_event(pump_manager))
+
+    def test_no_event_when_moisture_is_above_threshold(self):
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.assertFalse(self.start_event(pump_manager, moisture=30))
+        self.assertEqual(pump.IDLE, pump_manager.pump_state())
+
+    def test_cancel_turns_pump_off_mid_burst(self):
+        pump_manager = self.make_pump_manager(1000, self.simulator)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(seconds=1))
+        pump_manager.cancel_pump_event()
+        self.mock_pi_io.turn_pin_off.assert_called_once_with(PUMP_PIN)
+        self.assertFalse(pump_manager.pump_event_in_progress())
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        self.assertEqual(1, self.mock_pi_io.turn_pin_on.call_count)
+        self.assertEqual(pump.PUMPING, self.progress[-1].state)
+
+    def test_low_water_is_notified_after_event(self):
+        self.mock_water_level_sensor.water_level.return_value = 2.0
+        pump_manager = self.make_pump_manager(500, self.simulator)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        self.assertEqual(1, self.mock_send_notification.call_count)
+
+    def test_pump_if_needed_waits_for_event_to_finish(self):
+        pump_manager = self.make_pump_manager(1000)
+        ml_pumped = pump_manager.pump_if_needed(20, self.mock_drain_sensor)
+        self.assertEqual(1000, ml_pumped)
+        self.assertEqual(2, self.mock_pi_io.turn_pin_off.call_count)
+        self.assertGreaterEqual(
+            self.clock.now() - START_TIME,
+            datetime.timedelta(seconds=pump.INTERVAL_DURATION))
+        self.assertFalse(pump_manager.pump_event_in_progress())
+
+    def test_drain_is_read_on_executor_with_deadline(self):
+        mock_executor = mock.Mock()
+        mock_executor.read.return_value = True
+        pump_manager = self.make_pump_manager(1000, self.simulator,
+                                              mock_executor)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        mock_executor.read.assert_called_once_with(
+            'PumpManager.water_present', pump._DRAIN_READ_TIMEOUT,
+            self.mock_drain_sensor.water_present)
+        self.mock_pi_io.turn_pin_on.assert_not_called()
+
+    def test_drain_read_timeout_ends_event_without_pumping(self):
+        mock_executor = mock.Mock()
+        mock_executor.read.side_effect = read_executor.ReadTimeoutError(
+            'timed out')
+        pump_manager = self.make_pump_manager(1000, self.simulator,
+                                              mock_executor)
+        self.start_event(pump_manager)
+        self.simulator.run_for(datetime.timedelta(minutes=5))
+        self.mock_pi_io.turn_pin_on.assert_not_called()
+        self.assertEqual([(pump.CHECKING_DRAIN, 0, 0), (pump.DONE, 0, 0)],
+                         self.progress_states())
+        self.assertFalse(pump_manager.pump_event_in_progress())
+
+    def test_pump_is_turned_off_by_urgent_callback(self):
+        mock_engine = mock.Mock()
+        pump_manager = self.make_pump_manager(1000, mock_engine)
+        self.start_event(pump_manager)
+        _, check_drain, event = mock_engine.call_later.call_args[0]
+        check_drain(event)
+        self.assertEqual(pump.PUMPING, pump_manager.pump_state())
+        delay, end_burst, _ = mock_engine.call_later.call_args[0]
+        self.assertEqual(
+            self.pump.seconds_to_pump(pump.INTERVAL_PUMP_AMOUNT), delay)
+        self.assertEqual({'urgent': True}, mock_engine.call_later.call_args[1])
+        end_burst(event)
+        self.mock_pi_io.turn_pin_off.assert_called_once_with(PUMP_PIN)
+
+    def test_pump_if_needed_does_not_hold_lock_during_event(self):
+        drain_read = threading.Event()
+        release_drain = threading.Event()
+
+        def water_present():
+            drain_read.set()
+            release_drain.wait(5.0)
+            return True
+
+        self.mock_drain_sensor.water_present.side_effect = water_present
+        pump_manager = self.make_pump_manager(1000)
+        event_thread = threading.Thread(
+            target=pump_manager.pump_if_needed,
+            args=(20, self.mock_drain_sensor))
+        event_thread.start()
+        try:
+            self.assertTrue(drain_read.wait(5.0))
+            result = []
+            state_thread = threading.Thread(
+                target=lambda: result.append(pump_manager.pump_state()))
+            state_thread.start()
+            state_thread.join(5.0)
+            self.assertEqual([pump.CHECKING_DRAIN], result)
+        finally:
+            release_drain.set()
+            event_thread.join(5.0)
+        self.assertFalse(pump_manager.pump_event_in_progress())
+
+    def test_pump_if_needed_returns_zero_when_not_needed(self):
+        pump_manager = self.make_pump_manager(1000)
+        ml_pumped = pump_manager.pump_if_needed(30, self.mock_drain_sensor)
+        self.assertEqual(0, ml_pumped)
+
+
+if __name__ == '__main__':
+    unittest.main()
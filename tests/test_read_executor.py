@@ -0,0 +1,124 @@
+import datetime
+import threading
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import read_executor
+
+TIMESTAMP_A = datetime.datetime(2016, 7, 23, 10, 51, 9, tzinfo=pytz.utc)
+# Read timeout short enough to keep the tests fast.
+TEST_TIMEOUT_SECONDS = 0.05
+
+
+class ReadExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = TIMESTAMP_A
+        self.executor = read_executor.ReadExecutor(
+            self.mock_clock,
+            threads=2,
+            quarantine_threshold=2,
+            initial_quarantine=datetime.timedelta(minutes=1),
+            max_quarantine=datetime.timedelta(minutes=3))
+        # Set at the end of each test to release reads that hang.
+        self.release_hung_reads = threading.Event()
+
+    def tearDown(self):
+        self.release_hung_reads.set()
+        self.executor.close()
+
+    def hung_read(self):
+        self.release_hung_reads.wait()
+        return 1.0
+
+    def test_read_returns_result(self):
+        self.assertEqual(3,
+                         self.executor.read('dummy_sensor',
+                                            TEST_TIMEOUT_SECONDS,
+                                            lambda a, b: a + b, 1, 2))
+        self.assertEqual(0, self.executor.timeouts('dummy_sensor'))
+
+    def test_read_raises_exception_from_read_func(self):
+        with self.assertRaises(ValueError):
+            self.executor.read(
+                'dummy_sensor',
+                TEST_TIMEOUT_SECONDS,
+                mock.Mock(side_effect=ValueError('dummy')))
+
+    def test_hung_read_times_out(self):
+        with self.assertRaises(read_executor.ReadTimeoutError):
+            self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS,
+                               self.hung_read)
+        self.assertEqual(1, self.executor.timeouts('dummy_sensor'))
+        self.assertIsNone(self.executor.quarantined_until('dummy_sensor'))
+
+    def test_hung_read_does_not_block_other_sensors(self):
+        with self.assertRaises(read_executor.ReadTimeoutError):
+            self.executor.read('hung_sensor', TEST_TIMEOUT_SECONDS,
+                               self.hung_read)
+        # The hung sensor's next read fails fast instead of taking the
+        # remaining read thread.
+        read_func = mock.Mock()
+        with self.assertRaises(read_executor.ReadTimeoutError):
+            self.executor.read('hung_sensor', TEST_TIMEOUT_SECONDS, read_func)
+        read_func.assert_not_called()
+        self.assertEqual(5.0,
+                         self.executor.read('dummy_sensor',
+                                            TEST_TIMEOUT_SECONDS, lambda: 5.0))
+
+    def test_repeated_timeouts_quarantine_sensor_with_backoff(self):
+        for _ in range(2):
+            with self.assertRaises(read_executor.ReadTimeoutError):
+                self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS,
+                                   self.hung_read)
+        self.assertEqual(
+            TIMESTAMP_A + datetime.timedelta(minutes=1),
+            self.executor.quarantined_until('dummy_sensor'))
+        read_func = mock.Mock()
+        with self.assertRaises(read_executor.QuarantinedError):
+            self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS, read_func)
+        read_func.assert_not_called()
+
+        # The sensor is still hung when its quarantine ends, so it is
+        # quarantined again for twice as long.
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(minutes=1))
+        with self.assertRaises(read_executor.ReadTimeoutError):
+            self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS, read_func)
+        self.assertEqual(
+            TIMESTAMP_A + datetime.timedelta(minutes=3),
+            self.executor.quarantined_until('dummy_sensor'))
+        self.assertEqual(3, self.executor.timeouts('dummy_sensor'))
+
+    def test_successful_read_ends_quarantine_backoff(self):
+        for _ in range(2):
+            with self.assertRaises(read_executor.ReadTimeoutError):
+                self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS,
+                                   self.hung_read)
+        self.release_hung_reads.set()
+        # Wait for the released read to finish, or the next read would time
+        # out behind it.
+        self.executor._health['dummy_sensor'].hung_task.done.wait(1.0)
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(minutes=1))
+        self.assertEqual(5.0,
+                         self.executor.read('dummy_sensor',
+                                            TEST_TIMEOUT_SECONDS, lambda: 5.0))
+        self.assertIsNone(self.executor.quarantined_until('dummy_sensor'))
+
+    def test_close_stops_idle_read_threads(self):
+        self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS, lambda: 1.0)
+        threads = list(self.executor._threads)
+        self.executor.close()
+        self.assertEqual([], [t for t in threads if t.is_alive()])
+
+    def test_close_leaves_hung_read_thread_behind(self):
+        with self.assertRaises(read_executor.ReadTimeoutError):
+            self.executor.read('dummy_sensor', TEST_TIMEOUT_SECONDS,
+                               self.hung_read)
+        threads = list(self.executor._threads)
+        self.executor.close()
+        self.assertEqual(1, len([t for t in threads if t.is_alive()]))
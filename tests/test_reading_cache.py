@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import reading_cache
+
+TIMESTAMP_A = datetime.datetime(2016, 7, 23, 10, 51, 9, tzinfo=pytz.utc)
+
+
+class ReadingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = TIMESTAMP_A
+        self.cache = reading_cache.ReadingCache(self.mock_clock)
+
+    def test_get_returns_None_for_sensor_without_reading(self):
+        self.assertIsNone(self.cache.get(reading_cache.LIGHT))
+        self.assertIsNone(self.cache.age(reading_cache.LIGHT))
+        self.assertIsNone(self.cache.fresh_value(reading_cache.LIGHT))
+
+    def test_get_returns_latest_reading(self):
+        self.cache.update(reading_cache.LIGHT, 50.0)
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(seconds=30))
+        self.cache.update(reading_cache.LIGHT, 55.0)
+        self.assertEqual(
+            reading_cache.Reading(
+                value=55.0,
+                timestamp=TIMESTAMP_A + datetime.timedelta(seconds=30)),
+            self.cache.get(reading_cache.LIGHT))
+
+    def test_readings_are_keyed_by_sensor(self):
+        self.cache.update(reading_cache.LIGHT, 50.0)
+        self.cache.update(reading_cache.WATER_LEVEL, 12.5)
+        self.assertEqual(50.0, self.cache.get(reading_cache.LIGHT).value)
+        self.assertEqual(12.5, self.cache.get(reading_cache.WATER_LEVEL).value)
+
+    def test_age_is_time_since_reading(self):
+        self.cache.update(reading_cache.LIGHT, 50.0)
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(minutes=2))
+        self.assertEqual(
+            datetime.timedelta(minutes=2), self.cache.age(reading_cache.LIGHT))
+
+    def test_fresh_value_returns_reading_within_max_age(self):
+        self.cache.update(reading_cache.LIGHT, 50.0)
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(minutes=5))
+        self.assertEqual(50.0,
+                         self.cache.fresh_value(
+                             reading_cache.LIGHT,
+                             max_age=datetime.timedelta(minutes=5)))
+
+    def test_fresh_value_returns_None_for_stale_reading(self):
+        self.cache.update(reading_cache.LIGHT, 50.0)
+        self.mock_clock.now.return_value = (
+            TIMESTAMP_A + datetime.timedelta(minutes=5, seconds=1))
+        self.assertIsNone(
+            self.cache.fresh_value(
+                reading_cache.LIGHT, max_age=datetime.timedelta(minutes=5)))
@@ -1,5 +1,6 @@
 import datetime
 import Queue
+import threading
 import unittest
 
 import mock
@@ -17,6 +18,7 @@ class RecordProcessorTest(unittest.TestCase):
         self.mock_light_store = mock.Mock()
         self.mock_humidity_store = mock.Mock()
         self.mock_temperature_store = mock.Mock()
+        self.mock_water_level_store = mock.Mock()
         self.mock_watering_event_store = mock.Mock()
         self.processor = record_processor.RecordProcessor(
             record_queue=self.record_queue,
@@ -24,6 +26,7 @@ class RecordProcessorTest(unittest.TestCase):
             light_store=self.mock_light_store,
             humidity_store=self.mock_humidity_store,
             temperature_store=self.mock_temperature_store,
+            water_level_store=self.mock_water_level_store,
             watering_event_store=self.mock_watering_event_store)
 
     def test_process_empty_queue_returns_False(self):
@@ -79,3 +82,218 @@ class RecordProcessorTest(unittest.TestCase):
         self.record_queue.put(record)
         with self.assertRaises(record_processor.UnsupportedRecordError):
             self.processor.try_process_next_record()
+
+
+class BatchingRecordProcessorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.record_queue = Queue.Queue()
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = datetime.datetime(
+            2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc)
+        self.mock_soil_moisture_store = mock.Mock()
+        self.mock_light_store = mock.Mock()
+        self.mock_humidity_store = mock.Mock()
+        self.mock_temperature_store = mock.Mock()
+        self.mock_water_level_store = mock.Mock()
+        self.mock_watering_event_store = mock.Mock()
+        self.mock_rollup_store = mock.Mock()
+        self.processor = record_processor.RecordProcessor(
+            record_queue=self.record_queue,
+            soil_moisture_store=self.mock_soil_moisture_store,
+            light_store=self.mock_light_store,
+            humidity_store=self.mock_humidity_store,
+            temperature_store=self.mock_temperature_store,
+            water_level_store=self.mock_water_level_store,
+            watering_event_store=self.mock_watering_event_store,
+            rollup_store=self.mock_rollup_store,
+            utc_clock=self.mock_clock,
+            batch_size=3,
+            batch_max_age=datetime.timedelta(seconds=2))
+        self.light_a = db_store.LightRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+            light=29.2)
+        self.light_b = db_store.LightRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 52, 0, tzinfo=pytz.utc),
+            light=30.5)
+        self.temperature_a = db_store.TemperatureRecord(
+            timestamp=datetime.datetime(
+                2016, 7, 23, 10, 51, 0, tzinfo=pytz.utc),
+            temperature=32.9)
+
+    def test_process_batch_on_empty_queue_returns_zero(self):
+        self.assertEqual(0, self.processor.process_batch())
+        self.mock_light_store.insert_many.assert_not_called()
+
+    def test_does_not_commit_before_thresholds_reached(self):
+        self.record_queue.put(self.light_a)
+        self.record_queue.put(self.temperature_a)
+        self.assertEqual(2, self.processor.process_batch())
+        self.mock_light_store.insert_many.assert_not_called()
+        self.mock_temperature_store.insert_many.assert_not_called()
+
+    def test_commits_when_batch_size_reached(self):
+        self.record_queue.put(self.light_a)
+        self.record_queue.put(self.temperature_a)
+        self.record_queue.put(self.light_b)
+        self.assertEqual(3, self.processor.process_batch())
+        self.mock_light_store.insert_many.assert_called_once_with(
+            [self.light_a, self.light_b], commit=False)
+        self.mock_temperature_store.insert_many.assert_called_once_with(
+            [self.temperature_a], commit=False)
+        self.mock_rollup_store.add.assert_called_once_with(
+            [self.light_a, self.temperature_a, self.light_b], commit=False)
+        self.mock_light_store.commit.assert_called_once()
+
+    def test_commits_when_batch_max_age_reached(self):
+        self.record_queue.put(self.light_a)
+        self.processor.process_batch()
+        self.mock_light_store.insert_many.assert_not_called()
+
+        self.mock_clock.now.return_value = datetime.datetime(
+            2016, 7, 23, 10, 51, 2, tzinfo=pytz.utc)
+        self.assertEqual(0, self.processor.process_batch())
+        self.mock_light_store.insert_many.assert_called_once_with(
+            [self.light_a], commit=False)
+        self.mock_light_store.commit.assert_called_once()
+
+    def test_flush_commits_pending_records(self):
+        self.record_queue.put(self.light_a)
+        self.processor.process_batch()
+        self.processor.flush()
+        self.mock_light_store.insert_many.assert_called_once_with(
+            [self.light_a], commit=False)
+        self.mock_light_store.commit.assert_called_once()
+
+        # Nothing left to write on a second flush.
+        self.processor.flush()
+        self.mock_light_store.insert_many.assert_called_once()
+
+    def test_coalesced_record_stores_mean_and_rolls_up_all_readings(self):
+        coalesced = db_store.coalesce(self.light_a, self.light_b)
+        self.record_queue.put(coalesced)
+        self.processor.process_batch()
+        self.processor.flush()
+        self.mock_light_store.insert_many.assert_called_once_with(
+            [coalesced.record], commit=False)
+        self.mock_rollup_store.add.assert_called_once_with(
+            [coalesced], commit=False)
+
+    def test_rolls_back_batch_when_insert_fails(self):
+        self.mock_temperature_store.insert_many.side_effect = ValueError(
+            'dummy insert failure')
+        self.record_queue.put(self.light_a)
+        self.record_queue.put(self.temperature_a)
+        self.processor.process_batch()
+        with self.assertRaises(ValueError):
+            self.processor.flush()
+        self.mock_light_store.rollback.assert_called_once()
+        self.mock_light_store.commit.assert_not_called()
+
+    def test_process_batch_waits_for_record(self):
+        threading.Timer(0.05, self.record_queue.put, [self.light_a]).start()
+        self.assertEqual(1, self.processor.process_batch(timeout=5.0))
+
+    def test_process_batch_wait_ends_when_batch_is_due(self):
+        self.record_queue.put(self.light_a)
+        self.processor.process_batch()
+        self.mock_clock.now.return_value = datetime.datetime(
+            2016, 7, 23, 10, 51, 2, tzinfo=pytz.utc)
+        # The pending batch is already due, so the processor commits it
+        # instead of waiting for more records.
+        self.assertEqual(0, self.processor.process_batch(timeout=60.0))
+        self.mock_light_store.commit.assert_called_once()
+
+    def test_run_stores_records_until_shutdown(self):
+        self.record_queue.put(self.light_a)
+        self.processor.shutdown()
+        self.record_queue.put(self.light_b)
+        self.processor.run()
+        self.mock_light_store.insert_many.assert_called_once_with(
+            [self.light_a], commit=False)
+        self.mock_light_store.commit.assert_called_once()
+        # Records queued after the shutdown request are left in the queue.
+        self.assertEqual(self.light_b, self.record_queue.get_nowait())
+
+    def test_shutdown_from_another_thread_stops_run(self):
+        threading.Timer(0.05, self.processor.shutdown).start()
+        self.processor.run()
+        self.mock_light_store.commit.assert_not_called()
+
+    def test_run_blocks_on_empty_queue_without_timeout(self):
+        threading.Timer(0.05, self.processor.shutdown).start()
+        with mock.patch.object(
+                self.record_queue, 'get',
+                wraps=self.record_queue.get) as mock_get:
+            self.processor.run()
+        mock_get.assert_called_once_with()
+
+    def test_process_batch_without_timeout_waits_until_batch_is_due(self):
+        self.record_queue.put(self.light_a)
+        self.processor.process_batch()
+        threading.Timer(0.05, self.record_queue.put, [self.light_b]).start()
+        with mock.patch.object(
+                self.record_queue, 'get',
+                wraps=self.record_queue.get) as mock_get:
+            self.assertEqual(1, self.processor.process_batch(timeout=None))
+        # The mock clock leaves the pending batch 2 seconds from due.
+        self.assertEqual(mock.call(timeout=2.0), mock_get.call_args_list[0])
+
+    def test_database_task_runs_after_pending_records_are_committed(self):
+        mock_connection = mock.Mock()
+        processor = record_processor.RecordProcessor(
+            self.record_queue,
+            self.mock_soil_moisture_store,
+            self.mock_light_store,
+            self.mock_humidity_store,
+            self.mock_temperature_store,
+            self.mock_water_level_store,
+            self.mock_watering_event_store,
+            connection=mock_connection,
+            utc_clock=self.mock_clock)
+        commits_before_task = []
+
+        def task_func(connection):
+            commits_before_task.append(
+                (connection, self.mock_light_store.commit.call_count))
+
+        task = record_processor.DatabaseTask(task_func)
+        self.record_queue.put(self.light_a)
+        self.record_queue.put(task)
+        self.assertEqual(2, processor.process_batch())
+        self.assertIsNone(task.result(timeout=0))
+        self.assertEqual([(mock_connection, 1)], commits_before_task)
+
+    def test_database_task_error_is_raised_to_requester(self):
+        processor = record_processor.RecordProcessor(
+            self.record_queue,
+            self.mock_soil_moisture_store,
+            self.mock_light_store,
+            self.mock_humidity_store,
+            self.mock_temperature_store,
+            self.mock_water_level_store,
+            self.mock_watering_event_store,
+            connection=mock.Mock())
+        task = record_processor.DatabaseTask(
+            mock.Mock(side_effect=ValueError('dummy error')))
+        self.record_queue.put(task)
+        processor.process_batch()
+        with self.assertRaises(ValueError):
+            task.result(timeout=0)
+
+    def test_database_task_without_connection_is_rejected(self):
+        self.record_queue.put(record_processor.DatabaseTask(mock.Mock()))
+        with self.assertRaises(record_processor.UnsupportedRecordError):
+            self.processor.process_batch()
+
+    def test_database_task_result_times_out_until_run(self):
+        task = record_processor.DatabaseTask(mock.Mock())
+        with self.assertRaises(record_processor.TaskTimeoutError):
+            task.result(timeout=0.01)
+
+    def test_process_batch_rejects_unsupported_record(self):
+        self.record_queue.put('dummy invalid record')
+        with self.assertRaises(record_processor.UnsupportedRecordError):
+            self.processor.process_batch()
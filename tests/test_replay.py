@@ -0,0 +1,227 @@
+import contextlib
+import datetime
+import os
+import Queue
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import db_store
+from greenpithumb import replay
+from greenpithumb import sleep_windows
+
+TIMESTAMP_A = datetime.datetime(2016, 7, 23, 10, 51, 9, tzinfo=pytz.utc)
+
+
+def _minutes_after_a(minutes):
+    return TIMESTAMP_A + datetime.timedelta(minutes=minutes)
+
+
+class IterHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.connection = db_store.open_or_create_db(self._temp_dir +
+                                                     '/history.db')
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self._temp_dir)
+
+    def test_merges_tables_in_timestamp_order(self):
+        db_store.TemperatureStore(self.connection).insert_many([
+            db_store.TemperatureRecord(_minutes_after_a(0), 21.0),
+            db_store.TemperatureRecord(_minutes_after_a(30), 22.0),
+        ])
+        db_store.SoilMoistureStore(self.connection).insert(
+            db_store.SoilMoistureRecord(_minutes_after_a(15), 30.0, False))
+        db_store.WateringEventStore(self.connection).insert(
+            db_store.WateringEventRecord(_minutes_after_a(15), 500.0))
+        self.assertEqual([
+            db_store.TemperatureRecord(_minutes_after_a(0), 21.0),
+            db_store.SoilMoistureRecord(_minutes_after_a(15), 30.0, False),
+            db_store.WateringEventRecord(_minutes_after_a(15), 500.0),
+            db_store.TemperatureRecord(_minutes_after_a(30), 22.0),
+        ], list(replay.iter_history(self.connection, chunk_size=1)))
+
+    def test_limits_records_to_time_range(self):
+        db_store.LightStore(self.connection).insert_many([
+            db_store.LightRecord(_minutes_after_a(minutes), 50.0)
+            for minutes in range(0, 60, 15)
+        ])
+        self.assertEqual([
+            db_store.LightRecord(_minutes_after_a(15), 50.0),
+            db_store.LightRecord(_minutes_after_a(30), 50.0),
+        ],
+                         list(
+                             replay.iter_history(
+                                 self.connection,
+                                 start=_minutes_after_a(15),
+                                 end=_minutes_after_a(45))))
+
+    def test_empty_database_yields_nothing(self):
+        self.assertEqual([], list(replay.iter_history(self.connection)))
+
+
+class CurrentSchemaDbTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self._temp_dir, 'history.db')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def replay_history(self, db_path):
+        with contextlib.closing(
+                db_store.ReadConnectionPool(db_path, 1)) as pool:
+            with pool.connection() as connection:
+                return list(replay.iter_history(connection))
+
+    def user_version(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            return db_store.schema_version(connection)
+
+    def test_current_database_is_replayed_in_place(self):
+        db_store.open_or_create_db(self.db_path).close()
+        with replay.current_schema_db(self.db_path) as replay_db_path:
+            self.assertEqual(self.db_path, replay_db_path)
+
+    def test_legacy_database_is_replayed_from_migrated_copy(self):
+        # Schema of databases created before schema versioning existed, which
+        # store timestamps as text.
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript("""
+                CREATE TABLE temperature (timestamp TEXT, temperature REAL);
+                CREATE TABLE humidity (timestamp TEXT, humidity REAL);
+                CREATE TABLE water_level (timestamp TEXT, water_level REAL);
+                CREATE TABLE soil_moisture (timestamp TEXT,
+                                            soil_moisture REAL);
+                CREATE TABLE light (timestamp TEXT, light REAL);
+                CREATE TABLE watering_events (timestamp TEXT,
+                                              water_pumped REAL);
+                INSERT INTO temperature
+                    VALUES ('2016-07-23T10:51:09+00:00', 21.0);
+                INSERT INTO soil_moisture
+                    VALUES ('2016-07-23T11:06:09+00:00', 30.0);
+                """)
+        with replay.current_schema_db(self.db_path) as replay_db_path:
+            self.assertNotEqual(self.db_path, replay_db_path)
+            self.assertEqual([
+                db_store.TemperatureRecord(_minutes_after_a(0), 21.0),
+                db_store.SoilMoistureRecord(_minutes_after_a(15), 30.0, None),
+            ], self.replay_history(replay_db_path))
+        self.assertFalse(os.path.exists(replay_db_path))
+        self.assertEqual(0, self.user_version())
+
+    def test_newer_schema_raises_UnsupportedSchemaError(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            connection.execute('PRAGMA user_version = %d' %
+                               (db_store.SCHEMA_VERSION + 1))
+        with self.assertRaises(db_store.UnsupportedSchemaError):
+            with replay.current_schema_db(self.db_path):
+                pass
+
+
+class ReplayerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.record_queue = Queue.Queue()
+        self.mock_mqtt_client = mock.Mock()
+
+    def make_replayer(self,
+                      moisture_threshold=25,
+                      pump_interval=datetime.timedelta(days=365),
+                      sleep_windows_raw=(),
+                      speed=None,
+                      wall_clock=None):
+        return replay.Replayer(self.record_queue, self.mock_mqtt_client,
+                               moisture_threshold, pump_interval,
+                               sleep_windows.parse(sleep_windows_raw), speed,
+                               wall_clock)
+
+    def queued_records(self):
+        records = []
+        while not self.record_queue.empty():
+            records.append(self.record_queue.get_nowait())
+        return records
+
+    def test_queues_and_publishes_each_record(self):
+        records = [
+            db_store.TemperatureRecord(_minutes_after_a(0), 21.0),
+            db_store.SoilMoistureRecord(_minutes_after_a(0), 30.0, True),
+            db_store.WateringEventRecord(_minutes_after_a(1), 500.0),
+        ]
+        results = self.make_replayer().replay(records)
+        self.assertEqual(records, self.queued_records())
+        self.mock_mqtt_client.publish.assert_has_calls([
+            mock.call('greenpi/temperature', 21.0),
+            mock.call('greenpi/soil_moisture', 30.0),
+            mock.call('greenpi/water_present', True),
+            mock.call('greenpi/ml_pumped', 500.0),
+        ])
+        self.assertEqual(3, results['records'])
+        self.assertEqual({
+            'TemperatureRecord': 1,
+            'SoilMoistureRecord': 1,
+            'WateringEventRecord': 1,
+        }, results['record_counts'])
+        self.assertEqual(1, results['recorded_waterings'])
+
+    def test_counts_waterings_under_replayed_threshold(self):
+        records = [
+            db_store.SoilMoistureRecord(_minutes_after_a(0), 30.0, False),
+            db_store.SoilMoistureRecord(_minutes_after_a(15), 24.0, False),
+            db_store.SoilMoistureRecord(_minutes_after_a(30), 28.0, False),
+        ]
+        self.assertEqual(
+            1,
+            self.make_replayer(
+                moisture_threshold=25).replay(records)['simulated_waterings'])
+        self.assertEqual(
+            3,
+            self.make_replayer(
+                moisture_threshold=35).replay(records)['simulated_waterings'])
+
+    def test_forced_watering_follows_history_timestamps(self):
+        records = [
+            db_store.SoilMoistureRecord(
+                TIMESTAMP_A + datetime.timedelta(hours=hours), 30.0, False)
+            for hours in range(0, 7 * 24, 6)
+        ]
+        results = self.make_replayer(
+            moisture_threshold=0,
+            pump_interval=datetime.timedelta(days=2)).replay(records)
+        self.assertEqual(3, results['simulated_waterings'])
+
+    def test_paces_replay_at_multiple_of_real_time(self):
+        mock_wall_clock = mock.Mock()
+        mock_wall_clock.now.return_value = TIMESTAMP_A
+        records = [
+            db_store.LightRecord(_minutes_after_a(0), 50.0),
+            db_store.LightRecord(_minutes_after_a(60), 50.0),
+        ]
+        self.make_replayer(speed=60, wall_clock=mock_wall_clock).replay(records)
+        mock_wall_clock.wait_until.assert_has_calls([
+            mock.call(TIMESTAMP_A),
+            mock.call(TIMESTAMP_A + datetime.timedelta(minutes=1)),
+        ])
+
+    def test_unpaced_replay_does_not_wait(self):
+        mock_wall_clock = mock.Mock()
+        mock_wall_clock.now.return_value = TIMESTAMP_A
+        self.make_replayer(wall_clock=mock_wall_clock).replay(
+            [db_store.LightRecord(_minutes_after_a(0), 50.0)])
+        mock_wall_clock.wait_until.assert_not_called()
+
+    def test_non_positive_speed_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            self.make_replayer(speed=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import contextlib
+import datetime
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import db_store
+from greenpithumb import record_processor
+from greenpithumb import retention
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_no_overrides_returns_default_retention(self):
+        self.assertEqual(db_store.DEFAULT_RETENTION, retention.parse([]))
+
+    def test_overrides_single_table(self):
+        table_retention = retention.parse(['temperature=30'])
+        self.assertEqual(
+            datetime.timedelta(days=30), table_retention['temperature'])
+        self.assertEqual(db_store.DEFAULT_RETENTION['humidity'],
+                         table_retention['humidity'])
+
+    def test_rejects_unknown_table(self):
+        with self.assertRaises(ValueError):
+            retention.parse(['dummy_table=30'])
+
+    def test_rejects_malformed_override(self):
+        with self.assertRaises(ValueError):
+            retention.parse(['temperature'])
+        with self.assertRaises(ValueError):
+            retention.parse(['temperature=abc'])
+
+    def test_rejects_non_positive_retention(self):
+        with self.assertRaises(ValueError):
+            retention.parse(['temperature=0'])
+
+
+class RetentionCompactorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self._temp_dir, 'test.db')
+        self.mock_clock = mock.Mock()
+        self.mock_clock.now.return_value = datetime.datetime(
+            2017, 4, 20, 12, 0, 0, tzinfo=pytz.utc)
+        with contextlib.closing(
+                db_store.open_or_create_db(self.db_path)) as connection:
+            db_store.TemperatureStore(connection).insert_many([
+                db_store.TemperatureRecord(
+                    timestamp=datetime.datetime(
+                        2017, 4, 1, 12, 0, 0, tzinfo=pytz.utc),
+                    temperature=20.0),
+                db_store.TemperatureRecord(
+                    timestamp=datetime.datetime(
+                        2017, 4, 19, 12, 0, 0, tzinfo=pytz.utc),
+                    temperature=21.0),
+            ])
+            db_store.LightStore(connection).insert_many([
+                db_store.LightRecord(
+                    timestamp=datetime.datetime(
+                        2017, 4, 15, 12, 0, 0, tzinfo=pytz.utc),
+                    light=50.0),
+            ])
+
+        self.record_queue = Queue.Queue()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def compact(self, compactor):
+        """Runs a compaction with a record processor on the test thread."""
+        results = []
+        compact_thread = threading.Thread(
+            target=lambda: results.append(compactor.compact()))
+        compact_thread.start()
+        with contextlib.closing(
+                db_store.open_or_create_db(self.db_path)) as connection:
+            stores = [mock.Mock() for _ in range(6)]
+            processor = record_processor.RecordProcessor(
+                self.record_queue, *stores, connection=connection)
+            self.assertEqual(1, processor.process_batch(timeout=5.0))
+        compact_thread.join()
+        return results[0]
+
+    def test_purges_records_older_than_table_retention(self):
+        compactor = retention.RetentionCompactor(self.record_queue,
+                                                 retention.parse(['light=2']),
+                                                 self.mock_clock)
+        result = self.compact(compactor)
+
+        self.assertEqual(1, result.rows_deleted['temperature'])
+        self.assertEqual(1, result.rows_deleted['light'])
+        self.assertEqual(0, result.rows_deleted['humidity'])
+        self.assertGreaterEqual(result.elapsed_seconds, 0.0)
+        with contextlib.closing(
+                db_store.open_or_create_db(self.db_path)) as connection:
+            self.assertEqual([
+                db_store.TemperatureRecord(
+                    timestamp=datetime.datetime(
+                        2017, 4, 19, 12, 0, 0, tzinfo=pytz.utc),
+                    temperature=21.0)
+            ], db_store.TemperatureStore(connection).get())
+            self.assertEqual([], db_store.LightStore(connection).get())
+
+    def test_purge_with_nothing_expired_deletes_nothing(self):
+        compactor = retention.RetentionCompactor(
+            self.record_queue, {'temperature': datetime.timedelta(days=30)},
+            self.mock_clock)
+        result = self.compact(compactor)
+        self.assertEqual({'temperature': 0}, result.rows_deleted)
+
+    def test_purge_not_run_by_record_processor_times_out(self):
+        compactor = retention.RetentionCompactor(
+            self.record_queue,
+            retention.parse([]),
+            self.mock_clock,
+            purge_timeout=0.01)
+        with self.assertRaises(record_processor.TaskTimeoutError):
+            compactor.compact()
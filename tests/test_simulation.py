@@ -0,0 +1,166 @@
+import datetime
+import random
+import unittest
+
+import mock
+import pytz
+
+from greenpithumb import clock
+from greenpithumb import poller
+from greenpithumb import simulation
+from greenpithumb import sleep_windows
+from greenpithumb import wiring_config_parser
+
+START_TIME = datetime.datetime(2016, 7, 23, 0, 0, 0, tzinfo=pytz.utc)
+
+_WIRING_CONFIG = """
+[gpio_pins]
+pump: 26
+dht22: 21
+sonar: 20
+soil_moisture_power: 16
+drain_sensor_power: 12
+mcp3008_clk: 18
+mcp3008_dout: 23
+mcp3008_din: 24
+mcp3008_cs_shdn: 25
+
+[adc_channels]
+soil_moisture_sensor: 7
+drain_sensor: 6
+light_sensor: 0
+"""
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(START_TIME)
+        self.simulator = simulation.Simulator(self.clock)
+
+    def test_call_later_runs_callbacks_in_order_at_their_due_times(self):
+        calls = []
+        self.simulator.call_later(120,
+                                  lambda: calls.append(('b', self.clock.now())))
+        self.simulator.call_later(60,
+                                  lambda: calls.append(('a', self.clock.now())))
+        self.assertEqual(2, self.simulator.run_for(datetime.timedelta(hours=1)))
+        self.assertEqual(
+            [
+                ('a', START_TIME + datetime.timedelta(seconds=60)),
+                ('b', START_TIME + datetime.timedelta(seconds=120)),
+            ],
+            calls)
+        self.assertEqual(
+            START_TIME + datetime.timedelta(hours=1), self.clock.now())
+
+    def test_cancelled_callback_does_not_run(self):
+        callback = mock.Mock()
+        self.simulator.call_later(60, callback).cancel()
+        self.assertEqual(0, self.simulator.run_for(datetime.timedelta(hours=1)))
+        callback.assert_not_called()
+
+    def test_callback_due_after_end_time_waits_for_next_run(self):
+        callback = mock.Mock()
+        self.simulator.call_later(2 * 60 * 60, callback)
+        self.simulator.run_for(datetime.timedelta(hours=1))
+        callback.assert_not_called()
+        self.simulator.run_for(datetime.timedelta(hours=1))
+        callback.assert_called_once_with()
+
+    def test_wait_within_job_delays_later_jobs(self):
+        run_times = []
+        self.simulator.call_later(60, self.clock.wait, 600)
+        self.simulator.call_later(120,
+                                  lambda: run_times.append(self.clock.now()))
+        self.simulator.run_for(datetime.timedelta(hours=1))
+        self.assertEqual(
+            [START_TIME + datetime.timedelta(seconds=660)], run_times)
+
+    def test_failed_job_does_not_stop_simulation(self):
+        callback = mock.Mock()
+        self.simulator.call_later(60, mock.Mock(side_effect=ValueError()))
+        self.simulator.call_later(120, callback)
+        self.simulator.run_for(datetime.timedelta(hours=1))
+        callback.assert_called_once_with()
+
+    def test_polls_scheduled_worker_each_interval_for_a_week(self):
+        worker = mock.Mock()
+        scheduler = poller.Scheduler(self.clock, datetime.timedelta(minutes=15))
+
+        def poll(poll_time):
+            scheduler.set_last_poll_time(poll_time)
+
+        worker.next_poll_time.side_effect = scheduler.next_poll_time
+        worker.poll.side_effect = poll
+        self.simulator.schedule(worker)
+        self.simulator.run_for(datetime.timedelta(days=7))
+        self.assertEqual(7 * 24 * 4 + 1, worker.poll.call_count)
+        self.assertEqual(
+            mock.call(START_TIME + datetime.timedelta(minutes=15)),
+            worker.poll.call_args_list[1])
+
+    def test_unscheduled_worker_stops_polling(self):
+        worker = mock.Mock()
+        worker.next_poll_time.return_value = START_TIME + datetime.timedelta(
+            minutes=15)
+        self.simulator.schedule(worker)
+        self.simulator.unschedule(worker)
+        self.simulator.run_for(datetime.timedelta(hours=1))
+        worker.poll.assert_not_called()
+
+    def test_call_later_rejects_unknown_keyword_arguments(self):
+        with self.assertRaises(TypeError):
+            self.simulator.call_later(60, mock.Mock(), priority=1)
+
+
+class WateringSeasonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wiring_config = wiring_config_parser.parse(_WIRING_CONFIG)
+
+    def run_season(self, days, moisture_threshold, pump_interval,
+                   sleep_windows_raw):
+        return simulation.run_watering_season(
+            self.wiring_config,
+            START_TIME,
+            datetime.timedelta(days=days),
+            datetime.timedelta(minutes=15),
+            moisture_threshold,
+            200,
+            pump_interval,
+            sleep_windows.parse(sleep_windows_raw),
+            random.Random(0))
+
+    def test_waters_when_soil_dries_below_threshold(self):
+        summary = self.run_season(
+            days=28,
+            moisture_threshold=25,
+            pump_interval=datetime.timedelta(days=365),
+            sleep_windows_raw=[])
+        self.assertEqual(28 * 24 * 4 + 1, summary['polls'])
+        self.assertGreater(summary['waterings'], 0)
+        self.assertEqual(0, summary['forced_waterings'])
+        self.assertGreater(summary['min_moisture'], 20.0)
+
+    def test_forces_watering_when_timer_expires(self):
+        summary = self.run_season(
+            days=14,
+            moisture_threshold=0,
+            pump_interval=datetime.timedelta(days=2),
+            sleep_windows_raw=[])
+        self.assertEqual(summary['waterings'], summary['forced_waterings'])
+        self.assertIn(summary['waterings'], (6, 7))
+
+    def test_never_waters_during_sleep_window(self):
+        summary = self.run_season(
+            days=14,
+            moisture_threshold=0,
+            pump_interval=datetime.timedelta(hours=6),
+            sleep_windows_raw=['00:00-12:00'])
+        self.assertGreater(summary['waterings'], 0)
+        self.assertEqual(0, summary['sleep_window_waterings'])
+
+
+if __name__ == '__main__':
+    unittest.main()